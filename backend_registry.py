@@ -0,0 +1,105 @@
+"""
+Registry of Terraform state backends that have already been bootstrapped.
+
+Each project/region pair maps to the S3 state bucket and DynamoDB lock table
+created by backend-bootstrap. When an entry exists, the generator pins to it
+instead of inventing new names and applying a fresh bootstrap every run.
+"""
+import json
+import os
+import tempfile
+
+from rundir import file_lock
+from runner import run_command
+
+DEFAULT_REGISTRY_PATH = ".tf_backends.json"
+
+
+def registry_key(project_name, region):
+    return f"{project_name}/{region}"
+
+
+def load_registry(path=DEFAULT_REGISTRY_PATH):
+    """Returns the registry dict, or an empty one if the file is missing or unreadable."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable backend registry {path}: {e}")
+        return {}
+
+
+def registry_lock(path=DEFAULT_REGISTRY_PATH):
+    """Lock that serializes read-modify-write updates of the registry file across runs."""
+    return file_lock(f"{path}.lock", "the backend registry")
+
+
+def lookup_backend(project_name, region, path=DEFAULT_REGISTRY_PATH):
+    """Returns {"state_bucket", "lock_table"} for a registered backend, or None."""
+    entry = load_registry(path).get(registry_key(project_name, region))
+    if entry and entry.get("state_bucket") and entry.get("lock_table"):
+        return {"state_bucket": entry["state_bucket"], "lock_table": entry["lock_table"]}
+    return None
+
+
+def register_backend(project_name, region, backend_names, path=DEFAULT_REGISTRY_PATH):
+    """
+    Adds or replaces the registry entry for a project/region and saves it atomically.
+    Callers must hold registry_lock(path) so concurrent runs don't drop each other's entries.
+    """
+    registry = load_registry(path)
+    registry[registry_key(project_name, region)] = {
+        "state_bucket": backend_names["state_bucket"],
+        "lock_table": backend_names["lock_table"],
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(registry, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def backend_from_terraform_outputs(directory):
+    """
+    Reads the bucket/table names from `terraform output -json` in the bootstrap directory.
+    Returns None when there is no local state, terraform is unavailable, or the outputs are missing.
+    """
+    if not os.path.exists(os.path.join(directory, "terraform.tfstate")):
+        return None
+    try:
+        result = run_command(["terraform", "output", "-json"], cwd=directory, timeout=120,
+                             echo=False, capture_stdout=True)
+    except FileNotFoundError:
+        return None
+    if not result.ok:
+        return None
+    try:
+        outputs = json.loads(result.stdout or "{}")
+    except ValueError:
+        return None
+    state_bucket = outputs.get("terraform_state_bucket_name", {}).get("value")
+    lock_table = outputs.get("terraform_lock_table_name", {}).get("value")
+    if state_bucket and lock_table:
+        return {"state_bucket": state_bucket, "lock_table": lock_table}
+    return None
+
+
+def find_existing_backend(project_name, region, bootstrap_directory, path=DEFAULT_REGISTRY_PATH):
+    """
+    Looks for an already bootstrapped backend: first in the registry file, then in the
+    bootstrap directory's Terraform outputs (which are registered for next time).
+    """
+    backend_names = lookup_backend(project_name, region, path)
+    if backend_names:
+        return backend_names
+    backend_names = backend_from_terraform_outputs(bootstrap_directory)
+    if backend_names:
+        with registry_lock(path):
+            # Another run may have registered a backend while terraform output was running
+            registered = lookup_backend(project_name, region, path)
+            if registered:
+                return registered
+            register_backend(project_name, region, backend_names, path)
+    return backend_names
@@ -0,0 +1,117 @@
+"""
+Batch generation of many projects from a JSONL manifest.
+
+Each manifest line describes one project:
+
+    {"project_name": "orders-api", "aws_region": "eu-west-1", "github_repo_url": "https://..."}
+
+Optional keys are "lambda_runtime" and "directory" (defaults to
+<batch root>/<project_name>). Blank lines and lines starting with '#' are
+ignored.
+
+Projects run in a process pool, each in a fresh worker process, so the
+generator's per-project module state and working directory never leak
+between projects. A semaphore shared by all workers caps the number of model
+calls in flight across the whole batch. Every project yields one result
+record, in manifest order.
+"""
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import re
+
+PROJECT_KEYS = ("project_name", "aws_region", "lambda_runtime", "github_repo_url", "directory")
+
+_PROJECT_NAME = re.compile(r"^[a-z0-9][a-z0-9-]{1,40}$")
+
+
+class ManifestError(ValueError):
+    """Raised for a malformed batch manifest."""
+
+
+def validate_project(project, root="projects", where="project"):
+    """
+    Checks one project description and returns it with "directory" resolved to an absolute path.
+    where prefixes error messages (e.g. "manifest.jsonl:3").
+    """
+    if not isinstance(project, dict):
+        raise ManifestError(f"{where}: expected a JSON object")
+    unknown = sorted(set(project) - set(PROJECT_KEYS))
+    if unknown:
+        raise ManifestError(f"{where}: unknown key(s) {', '.join(unknown)}")
+    name = project.get("project_name", "")
+    if not isinstance(name, str) or not _PROJECT_NAME.match(name):
+        # Names end up in S3 bucket names, which only allow lowercase letters, digits and hyphens.
+        raise ManifestError(f"{where}: project_name must be 2-41 lowercase letters, digits or hyphens")
+    project = dict(project)
+    project["directory"] = os.path.abspath(project.get("directory") or os.path.join(root, name))
+    return project
+
+
+def load_manifest(path, root="projects"):
+    """
+    Reads and validates a JSONL manifest. Returns one dict per project, with
+    "directory" resolved to an absolute path.
+    """
+    projects = []
+    seen = set()
+    with open(path, "r") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                project = json.loads(line)
+            except ValueError as e:
+                raise ManifestError(f"{path}:{number}: invalid JSON: {e}")
+            project = validate_project(project, root, f"{path}:{number}")
+            if project["project_name"] in seen:
+                raise ManifestError(f"{path}:{number}: duplicate project_name {project['project_name']}")
+            seen.add(project["project_name"])
+            projects.append(project)
+    if not projects:
+        raise ManifestError(f"{path}: no projects")
+    return projects
+
+
+def run_batch(projects, worker, worker_args, workers=4, llm_concurrency=2, initializer=None):
+    """
+    Runs worker(project, worker_args) for every project in a process pool.
+    initializer(llm_slots) runs once in each worker process with the shared LLM semaphore.
+    Returns the result records in manifest order; a crashed worker yields a failed record.
+    """
+    # Fresh "spawn" processes per project (max_tasks_per_child=1); the semaphore must come from the same context.
+    context = multiprocessing.get_context("spawn")
+    llm_slots = context.BoundedSemaphore(llm_concurrency)
+    records = [None] * len(projects)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer,
+                                                initargs=(llm_slots,), max_tasks_per_child=1) as executor:
+        futures = {executor.submit(worker, project, worker_args): i for i, project in enumerate(projects)}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                records[i] = future.result()
+            except Exception as e:
+                records[i] = {"project": projects[i]["project_name"], "directory": projects[i]["directory"],
+                              "status": "failed", "error": f"worker crashed: {e}"}
+            print(f"[batch] {records[i]['project']}: {records[i]['status']}", flush=True)
+    return records
+
+
+def write_results(path, records):
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True, default=str) + "\n")
+
+
+def format_results(records, wall_seconds):
+    """Per-project status table plus batch throughput."""
+    lines = [f"Batch results ({len(records)} project(s) in {wall_seconds:.1f}s):"]
+    for record in records:
+        detail = record.get("error") or record.get("source_code_hash") or ""
+        lines.append(f"  {record['status']:<7} {record.get('duration_seconds', 0):7.1f}s  {record['project']:<24} {detail}")
+    succeeded = sum(1 for record in records if record["status"] == "ok")
+    if wall_seconds:
+        lines.append(f"{succeeded}/{len(records)} succeeded, {len(records) / wall_seconds * 60:.1f} project(s)/min")
+    return "\n".join(lines)
@@ -0,0 +1,293 @@
+"""
+Benchmark for code-block extraction.
+
+Generates synthetic Gemini-style responses (1 KB to several MB, 1 to 50
+'### <path> <lang>' file blocks) in several shapes, including adversarial ones:
+a block missing its closing fence, CRLF line endings, fences nested inside HCL
+heredocs, indented headers, long runs of blank lines and '### Outputs' section
+banners right before a block's closing fence. Each case is run
+through the single-pass extractor in codeblocks.py and, up to a size limit,
+through the two regex extractors that lambda.py and lambda1.py used before it.
+
+Reports throughput and worst-case time per extractor. Fails when the
+single-pass extractor returns wrong blocks, falls below a throughput floor, or
+slows down on larger inputs (a sign of backtracking or other superlinear work).
+
+Usage:
+    python bench_extract.py [--sizes 1K,16K,256K,1M,4M] [--blocks 1,10,50]
+                            [--legacy-max-size 256K] [--min-throughput-mb 2]
+                            [--max-slowdown 3] [--verbose] [--json PATH]
+"""
+import argparse
+import json
+import random
+import re
+import statistics
+import textwrap
+import time
+
+from codeblocks import extract_code_block, index_code_blocks
+
+VARIANTS = ("clean", "crlf", "unterminated", "heredoc", "indented", "blank_lines", "section_banner")
+
+# Seconds spent repeating a single case before taking the median.
+MIN_CASE_SECONDS = 0.2
+MAX_CASE_RUNS = 50
+
+
+# --- Extractors under test ---
+
+def legacy_lambda(response, file_language_map):
+    """The regex extract_code_block from lambda.py, called once per file."""
+    blocks = {}
+    for filename, language in file_language_map.items():
+        pattern = re.compile(
+            rf"^\s*### {re.escape(filename)} {re.escape(language)}\s*\n"
+            rf"\s*```(?:{re.escape(language)})?\s*\n"
+            r"(.*?)\n"
+            r"^\s*```",
+            re.DOTALL | re.IGNORECASE | re.MULTILINE
+        )
+        match = pattern.search(response)
+        blocks[filename] = match.group(1).strip() if match else None
+    return blocks
+
+
+def legacy_lambda1(response, file_language_map):
+    """The regex extract_multiple_code_blocks from lambda1.py, without its warnings."""
+    blocks = {}
+    for filename, language in file_language_map.items():
+        pattern = re.compile(rf"^\s*###\s*{re.escape(filename)}\s*{re.escape(language)}\s*\n```(?:{language})?\n(.*?)\n^\s*```", re.DOTALL | re.MULTILINE)
+        match = pattern.search(response)
+        blocks[filename] = textwrap.dedent(match.group(1)).strip() if match else None
+    return blocks
+
+
+def single_pass(response, file_language_map):
+    """codeblocks.extract_code_block, with the index cache cleared so every run parses."""
+    index_code_blocks.cache_clear()
+    return {filename: extract_code_block(response, filename, language, file_language_map)
+            for filename, language in file_language_map.items()}
+
+
+EXTRACTORS = {
+    "codeblocks": single_pass,
+    "legacy lambda.py": legacy_lambda,
+    "legacy lambda1.py": legacy_lambda1,
+}
+
+
+# --- Synthetic responses ---
+
+def hcl_resource(rng, n):
+    return (
+        f'resource "aws_s3_bucket" "bucket_{n}" {{\n'
+        f'  bucket = "example-{rng.randrange(10**8):08d}"\n'
+        f'  tags = {{\n'
+        f'    Name = "bucket-{n}"\n'
+        f'  }}\n'
+        f'}}\n'
+    )
+
+
+def heredoc_resource(rng, n):
+    return (
+        f'resource "aws_instance" "web_{n}" {{\n'
+        f'  ami       = "ami-{rng.randrange(16**8):08x}"\n'
+        f'  user_data = <<-EOF\n'
+        f'    ```bash\n'
+        f'    echo "setup {n}"\n'
+        f'    ```\n'
+        f'  EOF\n'
+        f'}}\n'
+    )
+
+
+def block_body(rng, variant, target_chars):
+    parts = []
+    size = 0
+    n = 0
+    while size < target_chars or not parts:
+        make = heredoc_resource if variant == "heredoc" and n % 3 == 0 else hcl_resource
+        parts.append(make(rng, n))
+        size += len(parts[-1])
+        n += 1
+    if variant == "section_banner":
+        # A comment banner as the block's last line must stay in the block, not start a new one.
+        parts.append("### Outputs")
+    return "\n".join(parts).strip()
+
+
+def make_case(size, blocks, variant, seed=0):
+    """
+    Builds one synthetic response.
+    Returns (response, file_language_map, expected) where expected holds the content
+    a correct extractor returns for each file (None for the block left unterminated).
+    """
+    rng = random.Random(f"{seed}-{size}-{blocks}-{variant}")
+    per_block = max(1, size // blocks - 40)
+    file_language_map = {}
+    expected = {}
+    sections = ["Here are the requested files.\n"]
+    broken = blocks // 2 if variant == "unterminated" else None
+    for i in range(blocks):
+        path = f"modules/m{i}/main.tf"
+        body = block_body(rng, variant, per_block)
+        file_language_map[path] = "hcl"
+        expected[path] = None if i == broken else body
+        indent = " " * (2 + i % 3) if variant == "indented" else ""
+        closing = "" if i == broken else f"{indent}```\n"
+        gap = "\n" * max(1, per_block // 4) if variant == "blank_lines" else "\n"
+        sections.append(
+            f"{indent}### {path} hcl\n"
+            f"{indent}```hcl\n"
+            f"{textwrap.indent(body, indent)}\n"
+            f"{closing}{gap}"
+        )
+    response = "".join(sections)
+    if variant == "crlf":
+        response = response.replace("\n", "\r\n")
+    return response, file_language_map, expected
+
+
+# --- Measurement ---
+
+def time_case(extractor, response, file_language_map):
+    """Returns (median seconds, worst seconds, last result) over repeated runs."""
+    timings = []
+    result = None
+    spent = 0.0
+    while not timings or (spent < MIN_CASE_SECONDS and len(timings) < MAX_CASE_RUNS):
+        started = time.perf_counter()
+        result = extractor(response, file_language_map)
+        elapsed = time.perf_counter() - started
+        timings.append(elapsed)
+        spent += elapsed
+    return statistics.median(timings), max(timings), result
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    units = {"K": 1024, "M": 1024 * 1024}
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):g}M"
+    if size >= 1024:
+        return f"{size / 1024:g}K"
+    return str(size)
+
+
+def run_benchmark(sizes, block_counts, legacy_max_size, verbose=False):
+    results = []
+    for variant in VARIANTS:
+        for size in sizes:
+            for blocks in block_counts:
+                response, file_language_map, expected = make_case(size, blocks, variant)
+                for name, extractor in EXTRACTORS.items():
+                    if name != "codeblocks" and len(response) > legacy_max_size:
+                        continue
+                    median, worst, extracted = time_case(extractor, response, file_language_map)
+                    correct = sum(1 for path in expected if extracted.get(path) == expected[path])
+                    row = {
+                        "extractor": name,
+                        "variant": variant,
+                        "size": size,
+                        "bytes": len(response),
+                        "blocks": blocks,
+                        "median_seconds": median,
+                        "worst_seconds": worst,
+                        "throughput_mb": len(response) / median / (1024 * 1024) if median else float("inf"),
+                        "correct": correct,
+                    }
+                    results.append(row)
+                    if verbose:
+                        print(f"  {name:<18} {variant:<12} {format_size(size):>5} x{blocks:<3}"
+                              f" median {median * 1000:9.2f} ms  worst {worst * 1000:9.2f} ms"
+                              f"  {row['throughput_mb']:8.1f} MB/s  correct {correct}/{blocks}")
+    return results
+
+
+def summarize(results):
+    """Prints one line per extractor: aggregate throughput, worst case and correctness."""
+    print(f"{'extractor':<18} {'MB/s':>8} {'worst ms':>10}  {'worst case':<28} correct")
+    for name in EXTRACTORS:
+        rows = [row for row in results if row["extractor"] == name]
+        if not rows:
+            continue
+        total_bytes = sum(row["bytes"] for row in rows)
+        total_seconds = sum(row["median_seconds"] for row in rows)
+        worst = max(rows, key=lambda row: row["worst_seconds"])
+        correct = sum(row["correct"] for row in rows)
+        expected = sum(row["blocks"] for row in rows)
+        case = f"{worst['variant']} {format_size(worst['size'])} x{worst['blocks']}"
+        print(f"{name:<18} {total_bytes / total_seconds / (1024 * 1024):8.1f} {worst['worst_seconds'] * 1000:10.2f}"
+              f"  {case:<28} {correct}/{expected}")
+
+
+def check_regressions(results, min_throughput_mb, max_slowdown, min_scaling_size):
+    """Returns failure messages for the single-pass extractor."""
+    failures = []
+    rows = [row for row in results if row["extractor"] == "codeblocks"]
+    for row in rows:
+        case = f"{row['variant']} {format_size(row['size'])} x{row['blocks']}"
+        if row["correct"] != row["blocks"]:
+            failures.append(f"{case}: extracted {row['correct']}/{row['blocks']} blocks correctly")
+        if row["bytes"] >= min_scaling_size and row["throughput_mb"] < min_throughput_mb:
+            failures.append(f"{case}: {row['throughput_mb']:.1f} MB/s is below {min_throughput_mb:g} MB/s")
+
+    # Per-byte cost must stay flat as inputs grow; superlinear behaviour shows up here.
+    for variant in VARIANTS:
+        for blocks in sorted({row["blocks"] for row in rows}):
+            series = sorted((row for row in rows if row["variant"] == variant and row["blocks"] == blocks
+                             and row["bytes"] >= min_scaling_size), key=lambda row: row["bytes"])
+            if len(series) < 2:
+                continue
+            smallest, largest = series[0], series[-1]
+            slowdown = smallest["throughput_mb"] / largest["throughput_mb"]
+            if slowdown > max_slowdown:
+                failures.append(
+                    f"{variant} x{blocks}: throughput drops {slowdown:.1f}x from "
+                    f"{format_size(smallest['size'])} to {format_size(largest['size'])} (limit {max_slowdown:g}x)"
+                )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark code-block extraction on normal and pathological responses.")
+    parser.add_argument("--sizes", default="1K,16K,256K,1M,4M", help="Comma-separated response sizes.")
+    parser.add_argument("--blocks", default="1,10,50", help="Comma-separated numbers of file blocks per response.")
+    parser.add_argument("--legacy-max-size", default="256K",
+                        help="Skip the regex extractors on larger responses; they can take minutes.")
+    parser.add_argument("--min-throughput-mb", type=float, default=2.0,
+                        help="Fail when the single-pass extractor is slower than this on any case.")
+    parser.add_argument("--max-slowdown", type=float, default=3.0,
+                        help="Fail when per-byte cost grows more than this between the smallest and largest size.")
+    parser.add_argument("--verbose", action="store_true", help="Print every case.")
+    parser.add_argument("--json", metavar="PATH", help="Write every measurement to a JSON file.")
+    args = parser.parse_args()
+
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    block_counts = [int(b) for b in args.blocks.split(",")]
+    results = run_benchmark(sizes, block_counts, parse_size(args.legacy_max_size), args.verbose)
+    summarize(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    # Small inputs are dominated by fixed per-call overhead, so rates are only compared from 64 KB up.
+    failures = check_regressions(results, args.min_throughput_mb, args.max_slowdown, 64 * 1024)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        exit(1)
+    print("OK: single-pass extraction is correct and scales linearly")
+
+
+if __name__ == "__main__":
+    main()
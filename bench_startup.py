@@ -0,0 +1,105 @@
+"""
+Startup budget benchmark for lambda1.py.
+
+Measures `python -X importtime -c "import lambda1"` and the wall-clock time of
+a trivial CLI action (`lambda1.py extract` on a tiny response), and fails when
+either exceeds its budget or when a heavy dependency (the Gemini SDK, dotenv)
+is imported eagerly.
+
+Usage:
+    python bench_startup.py [--runs 7] [--import-budget-ms 150] [--cli-budget-ms 400]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must only be imported by commands that actually call the LLM.
+LAZY_MODULES = ("google.generativeai", "dotenv")
+
+SAMPLE_RESPONSE = "### main.tf hcl\n```hcl\nresource \"aws_s3_bucket\" \"b\" {}\n```\n"
+
+
+def measure_import(module="lambda1"):
+    """Returns (cumulative import time in ms, set of imported module names) from -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=HERE,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            cumulative_us = int(cumulative.strip())
+    return cumulative_us / 1000.0, imported
+
+
+def measure_cli(response_path):
+    """Wall-clock milliseconds for a trivial CLI command that never touches the LLM."""
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(HERE, "lambda1.py"), "extract", response_path],
+        cwd=HERE,
+        capture_output=True,
+        check=True,
+    )
+    return (time.perf_counter() - started) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check lambda1.py import and CLI startup against a budget.")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--import-budget-ms", type=float, default=150.0)
+    parser.add_argument("--cli-budget-ms", type=float, default=400.0)
+    args = parser.parse_args()
+
+    import_times = []
+    imported = set()
+    for _ in range(args.runs):
+        elapsed, imported = measure_import()
+        import_times.append(elapsed)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write(SAMPLE_RESPONSE)
+        response_path = f.name
+    try:
+        cli_times = [measure_cli(response_path) for _ in range(args.runs)]
+    finally:
+        os.remove(response_path)
+
+    import_ms = statistics.median(import_times)
+    cli_ms = statistics.median(cli_times)
+    print(f"import lambda1:        median {import_ms:7.1f} ms  (max {max(import_times):.1f}, budget {args.import_budget_ms:.0f})")
+    print(f"lambda1.py extract:    median {cli_ms:7.1f} ms  (max {max(cli_times):.1f}, budget {args.cli_budget_ms:.0f})")
+
+    failures = []
+    eager = sorted(name for name in imported if name in LAZY_MODULES)
+    if eager:
+        failures.append(f"heavy modules imported at startup: {', '.join(eager)}")
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import time {import_ms:.1f} ms exceeds budget {args.import_budget_ms:.0f} ms")
+    if cli_ms > args.cli_budget_ms:
+        failures.append(f"CLI time {cli_ms:.1f} ms exceeds budget {args.cli_budget_ms:.0f} ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        exit(1)
+    print("OK: startup within budget")
+
+
+if __name__ == "__main__":
+    main()
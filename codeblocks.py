@@ -0,0 +1,197 @@
+"""
+Single-pass extraction of named code blocks from LLM responses.
+
+Responses are expected to look like:
+
+    ### main.tf hcl
+    ```hcl
+    ...
+    ```
+
+index_code_blocks() walks the response once, line by line, and records every
+header/fence pair; StreamingBlockParser does the same incrementally for
+streamed responses. extract_code_block() and extract_multiple_code_blocks() are
+served from that index, so the cost is linear in the response size no matter
+how many files are requested.
+"""
+import functools
+import textwrap
+
+FENCE = "```"
+
+
+def parse_header(line):
+    """Returns (path, language) for a '### <path> <lang>' line, or None."""
+    stripped = line.strip()
+    if not stripped.startswith("###"):
+        return None
+    parts = stripped[3:].split()
+    if not parts:
+        return None
+    path = parts[0].strip("`")
+    language = parts[1].strip("`").lower() if len(parts) > 1 else ""
+    return path, language
+
+
+def parse_fence(line):
+    """Returns (backtick_count, info_string) for a fence line, or None."""
+    stripped = line.strip()
+    if not stripped.startswith(FENCE):
+        return None
+    count = len(stripped) - len(stripped.lstrip("`"))
+    return count, stripped[count:].strip().lower()
+
+
+class CodeBlockIndex:
+    """
+    Result of a single pass over a response.
+    named maps a header path to (language, content); the first block wins.
+    fences lists (info_string, content) for every top-level fenced block in order.
+    """
+
+    def __init__(self):
+        self.named = {}
+        self.fences = []
+
+    def add(self, header, info, lines):
+        """Records a closed block. Returns (path, language, content) for a new named block, else None."""
+        content = clean_block("\n".join(lines))
+        self.fences.append((info, content))
+        if header and header[0] not in self.named:
+            self.named[header[0]] = (header[1], content)
+            return header[0], header[1], content
+        return None
+
+
+def clean_block(content):
+    """Normalizes the body of a code block the way both scripts always have."""
+    return textwrap.dedent(content).strip()
+
+
+class StreamingBlockParser:
+    """
+    Incremental header/fence parser, fed response text chunk by chunk.
+    Fences opened inside a block with an info string (e.g. a ```bash inside a
+    heredoc) are treated as nested and must be closed before the block ends.
+    An unterminated block is dropped when the next '### <path>' header with an
+    opening fence starts, instead of swallowing the following file. A header line
+    only counts as that restart when the fence after it has an info string or the
+    header names one of the expected paths; otherwise (e.g. a '### Outputs'
+    banner right before the closing fence) it stays in the block.
+    Args:
+        expected (iterable, optional): Paths the caller asked for.
+    """
+
+    def __init__(self, expected=()):
+        self.index = CodeBlockIndex()
+        self._expected = frozenset(expected)
+        self._partial = ""
+        self._header = None
+        self._block = None  # [header, info, fence_length, body_lines, nesting_depth]
+        self._held = None  # header-looking line inside a block, pending one line of lookahead
+        self._completed = []
+
+    def feed(self, text):
+        """Consumes a chunk and returns the named blocks (path, language, content) it completed."""
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._push(line.rstrip("\r"))
+        completed, self._completed = self._completed, []
+        return completed
+
+    def close(self):
+        """Flushes the last line; returns any blocks it completed. Unterminated blocks are dropped."""
+        completed = self.feed("\n") if self._partial else []
+        self._block = None
+        self._held = None
+        return completed
+
+    def _push(self, line):
+        if self._held is not None:
+            held, self._held = self._held, None
+            fence = parse_fence(line)
+            if fence and (fence[1] or parse_header(held)[0] in self._expected):
+                # The previous block never closed; restart at the held header.
+                self._block = None
+                self._outside(held)
+            else:
+                self._block[3].append(held)
+        if self._block is None:
+            self._outside(line)
+        else:
+            self._inside(line)
+
+    def _outside(self, line):
+        fence = parse_fence(line)
+        if fence:
+            self._block = [self._header, fence[1], fence[0], [], 0]
+            self._header = None
+        elif line.strip():
+            self._header = parse_header(line)
+
+    def _inside(self, line):
+        block = self._block
+        fence = parse_fence(line)
+        if fence and not fence[1] and fence[0] >= block[2]:
+            if block[4]:
+                block[4] -= 1
+                block[3].append(line)
+            else:
+                added = self.index.add(block[0], block[1], block[3])
+                if added:
+                    self._completed.append(added)
+                self._block = None
+        elif fence and fence[1]:
+            block[4] += 1
+            block[3].append(line)
+        elif parse_header(line):
+            self._held = line
+        else:
+            block[3].append(line)
+
+
+@functools.lru_cache(maxsize=16)
+def index_code_blocks(response, expected=frozenset()):
+    """Walks the response once and indexes every header and fenced block (expected: see StreamingBlockParser)."""
+    parser = StreamingBlockParser(expected)
+    parser.feed(response)
+    parser.close()
+    return parser.index
+
+
+def extract_code_block(response, block_name, language, expected=()):
+    """
+    Extracts a specific code block from the AI's response.
+    With no block_name, returns the first fenced block tagged with the language (or untagged).
+    expected lists every path requested from the same response (block_name is always included).
+    """
+    if not response:
+        return None
+    index = index_code_blocks(response, frozenset(expected).union([block_name] if block_name else []))
+    language = language.lower()
+    if block_name:
+        found = index.named.get(block_name)
+        if found and found[0] == language:
+            return found[1]
+        return None
+    for info, content in index.fences:
+        if info in (language, ""):
+            return content
+    return None
+
+
+def extract_multiple_code_blocks(response, file_language_map):
+    """
+    Extracts multiple named code blocks from the AI's response based on a map.
+    file_language_map = {
+        "filename.ext": "language",
+        "another_file.ext": "another_language"
+    }
+    """
+    extracted_blocks = {}
+    for filename, language in file_language_map.items():
+        extracted_blocks[filename] = extract_code_block(response, filename, language, file_language_map)
+        if extracted_blocks[filename] is None:
+            print(f"Warning: Could not find code block for {filename} ({language}) in AI response.")
+    return extracted_blocks
@@ -0,0 +1,302 @@
+"""
+Long-running generation daemon with a local job API.
+
+`lambda1.py serve` starts a pool of worker processes once. Each worker imports
+the SDK, configures the model client and opens its response cache when it
+starts, and then keeps them across jobs. The Terraform provider cache is on
+disk and shared by every worker. A job only pays for its own model calls and
+Terraform commands.
+
+Jobs are queued and run concurrently, up to the number of workers. They are
+accepted over HTTP, on 127.0.0.1 or on a Unix socket (--socket). The socket is
+only accessible to the daemon's user; over TCP every request must carry the
+token the daemon writes to .daemon_token (mode 0600) at startup, as
+"Authorization: Bearer <token>".
+
+    POST /jobs                  {"project_name": "orders-api", "aws_region": "eu-west-1",
+                                 "lambda_runtime": "nodejs18.x"}
+                                -> 202 {"id": ..., "status": "queued", ...}
+    POST /jobs?follow=1         same, then streams the job's log and ends with its record
+    GET  /jobs                  all jobs
+    GET  /jobs/<id>             one job (status: queued, running, ok or failed)
+    GET  /jobs/<id>/log         the log so far; ?follow=1 streams it until the job ends
+    GET  /health                worker and queue counts
+
+Job bodies take the same keys as a batch manifest line (see batch.py). A
+"directory" must be inside the daemon's --root.
+
+    curl -N -X POST 'localhost:8765/jobs?follow=1' -H "Authorization: Bearer $(cat .daemon_token)" \
+         -d '{"project_name": "orders-api"}'
+"""
+import concurrent.futures
+import hmac
+import http.server
+import json
+import multiprocessing
+import os
+import secrets
+import socketserver
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+from batch import ManifestError, validate_project
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+LOG_NAME = "daemon.log"
+TOKEN_FILE = ".daemon_token"
+# How often a followed log is polled for new output.
+FOLLOW_INTERVAL_SECONDS = 0.2
+MAX_BODY_BYTES = 64 * 1024
+
+
+class JobQueue:
+    """
+    Runs jobs on a pool of long-lived worker processes and tracks their state.
+    Args:
+        worker (callable): worker(job_id, project, worker_args) -> result record; runs in a worker process.
+        worker_args: Passed to every job and to the initializer.
+        workers (int): Worker processes, i.e. jobs running at once.
+        llm_concurrency (int): Model calls in flight across all workers.
+        initializer (callable): initializer(llm_slots, events, worker_args), run once per worker.
+            Workers report a job as started with events.put(("started", job_id)).
+        root (str): Parent directory for job projects; a job's "directory" must be inside it.
+    """
+
+    def __init__(self, worker, worker_args, workers=2, llm_concurrency=2, initializer=None, root="projects"):
+        self.worker = worker
+        self.worker_args = worker_args
+        self.root = root
+        self.jobs = {}
+        self._lock = threading.Lock()
+        context = multiprocessing.get_context("spawn")
+        self.events = context.Queue()
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=initializer,
+            initargs=(context.BoundedSemaphore(llm_concurrency), self.events, worker_args))
+        self.workers = workers
+        threading.Thread(target=self._watch_events, name="job-events", daemon=True).start()
+
+    def warm_up(self):
+        """Starts every worker now, so the first jobs do not pay for the imports and client setup."""
+        futures = [self.executor.submit(time.sleep, 0.1) for _ in range(self.workers)]
+        concurrent.futures.wait(futures)
+
+    def _watch_events(self):
+        while True:
+            try:
+                kind, job_id = self.events.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self.jobs.get(job_id)
+                if kind == "started" and job and job["status"] == "queued":
+                    job.update(status="running", started_at=time.time())
+
+    def submit(self, payload):
+        """Validates a job body and queues it. Returns the job record. Raises ManifestError."""
+        project = validate_project(payload, self.root, "job")
+        # The API may come from any local user, so jobs only ever write under --root.
+        root = os.path.realpath(self.root)
+        project["directory"] = os.path.realpath(project["directory"])
+        if project["directory"] == root or os.path.commonpath([root, project["directory"]]) != root:
+            raise ManifestError(f"job: directory must be inside {self.root}")
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "id": job_id,
+            "project": project["project_name"],
+            "directory": project["directory"],
+            "log": os.path.join(project["directory"], LOG_NAME),
+            "status": "queued",
+            "submitted_at": time.time(),
+        }
+        with self._lock:
+            busy = [j["project"] for j in self.jobs.values() if j["status"] in ("queued", "running")]
+            if project["project_name"] in busy:
+                raise ManifestError(f"job: project {project['project_name']} already has a job queued or running")
+            self.jobs[job_id] = job
+        future = self.executor.submit(self.worker, job_id, project, self.worker_args)
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return self.get(job_id)
+
+    def _finish(self, job_id, future):
+        try:
+            record = future.result()
+        except Exception as e:
+            record = {"status": "failed", "error": f"worker crashed: {e}"}
+        with self._lock:
+            job = self.jobs[job_id]
+            job.update(status=record.get("status", "failed"), finished_at=time.time(), result=record)
+            job.setdefault("started_at", job["submitted_at"])
+            job["latency_seconds"] = round(job["finished_at"] - job["submitted_at"], 3)
+            job["queued_seconds"] = round(job["started_at"] - job["submitted_at"], 3)
+        print(f"[daemon] job {job_id} ({job['project']}): {job['status']} in {job['latency_seconds']:.1f}s", flush=True)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self._lock:
+            return sorted((dict(job) for job in self.jobs.values()), key=lambda job: job["submitted_at"])
+
+    def health(self):
+        with self._lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+        return {"workers": self.workers, **{status: statuses.count(status) for status in ("queued", "running", "ok", "failed")}}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class JobRequestHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP front end of a JobQueue (set as the server's job_queue attribute)."""
+
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def _send_json(self, status, data):
+        body = (json.dumps(data, indent=2) + "\n").encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        follow = parse_qs(url.query).get("follow", ["0"])[0] not in ("0", "", "false")
+        return parts, follow
+
+    def _authorized(self):
+        """True if the server has no token (Unix socket) or the request carries it; else sends 401."""
+        token = self.server.token
+        if token is None:
+            return True
+        supplied = self.headers.get("Authorization", "")
+        if hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+            return True
+        self.close_connection = True  # any request body is left unread
+        self._send_json(401, {"error": "missing or wrong token"})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        parts, follow = self._route()
+        job_queue = self.server.job_queue
+        if parts == ["health"]:
+            return self._send_json(200, job_queue.health())
+        if parts == ["jobs"]:
+            return self._send_json(200, job_queue.list())
+        job = job_queue.get(parts[1]) if len(parts) in (2, 3) and parts[0] == "jobs" else None
+        if job is None:
+            return self._send_json(404, {"error": "not found"})
+        if len(parts) == 2:
+            return self._send_json(200, job)
+        if parts[2] == "log":
+            return self._stream_log(job["id"], follow)
+        return self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        parts, follow = self._route()
+        if parts != ["jobs"]:
+            return self._send_json(404, {"error": "not found"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            return self._send_json(413, {"error": "request body too large"})
+        try:
+            job = self.server.job_queue.submit(json.loads(self.rfile.read(length) or b"{}"))
+        except ValueError as e:  # invalid JSON or ManifestError
+            return self._send_json(400, {"error": str(e)})
+        if not follow:
+            return self._send_json(202, job)
+        self._stream_log(job["id"], follow=True)
+
+    def _stream_log(self, job_id, follow):
+        """Sends the job's log as chunked text; when following, until the job ends, then its record."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        offset = 0
+        try:
+            while True:
+                job = self.server.job_queue.get(job_id)
+                # While queued, the log may still be an earlier job's for the same project.
+                if job["status"] != "queued":
+                    offset = self._send_log_chunk(job["log"], offset)
+                if not follow or job["status"] in ("ok", "failed"):
+                    break
+                time.sleep(FOLLOW_INTERVAL_SECONDS)
+            if follow:
+                # Output written between the last poll and the job finishing, then the result.
+                self._send_log_chunk(job["log"], offset)
+                self._send_chunk(("\n" + json.dumps(job) + "\n").encode("utf-8"))
+            self._send_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client went away; the job keeps running
+
+    def _send_log_chunk(self, path, offset):
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return offset
+        if data:
+            self._send_chunk(data)
+        return offset + len(data)
+
+    def _send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        print(f"[daemon] {self.address_string()} {format % args}", flush=True)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def write_token(path=TOKEN_FILE):
+    """Generates a fresh API token and writes it to path, readable only by the daemon's user."""
+    token = secrets.token_urlsafe(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)  # an existing file keeps its old mode otherwise
+    with os.fdopen(fd, "w") as f:
+        f.write(token + "\n")
+    return token
+
+
+def make_server(job_queue, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, token=None):
+    """
+    An HTTP server for job_queue on host:port, or on a Unix socket when socket_path is given.
+    token (str): Required as a bearer token on every request; TCP servers must have one.
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # left behind by a previous daemon
+        # Bind under a restrictive umask so the socket is 0600 from the moment it exists; it has no token.
+        umask = os.umask(0o177)
+        try:
+            server = ThreadingUnixHTTPServer(socket_path, JobRequestHandler)
+        finally:
+            os.umask(umask)
+    else:
+        if not token:
+            raise ValueError("a TCP job server needs a token; use a Unix socket to run without one")
+        server = http.server.ThreadingHTTPServer((host, port), JobRequestHandler)
+    server.job_queue = job_queue
+    server.token = token
+    return server
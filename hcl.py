@@ -0,0 +1,366 @@
+"""
+Top-level block parsing and resource-level patching for Terraform files.
+
+parse_blocks() splits an HCL file into its top-level blocks (resource, data,
+variable, output, module, locals, ...) keyed by type and labels, e.g.
+"resource.aws_lambda_function.app". It only tracks what it needs to find block
+boundaries reliably: braces, quoted strings with ${...} templates, heredocs and
+comments.
+
+apply_edits() takes a set of complete replacement blocks, as returned by the
+model in edit mode, and applies them to the current file:
+
+    resource "aws_lambda_function" "app" { ... }   # replaces or adds that block
+    # delete resource.aws_instance.old             # removes a block
+
+Edits are checked against the base text the model was shown. A block that
+changed on disk since then, a block added twice, or a delete of a block that
+does not exist raises EditConflict instead of silently overwriting anything.
+
+validate_hcl() runs the same parser as a fast pre-flight check on generated
+files, plus a Contract of blocks the prompt required or ruled out, so a bad
+generation is caught in milliseconds instead of after `terraform init`.
+"""
+import re
+
+_IDENT = re.compile(r"[A-Za-z_][A-Za-z0-9_-]*")
+_HEREDOC = re.compile(r"<<(-?)([A-Za-z_][A-Za-z0-9_]*)[ \t]*\r?\n")
+_DELETE = re.compile(r"^\s*(?:#|//)\s*delete\s+([A-Za-z0-9_.\-]+)\s*$", re.MULTILINE)
+
+
+class HclParseError(ValueError):
+    """Raised when a file's top-level blocks cannot be delimited."""
+
+
+class EditConflict(ValueError):
+    """Raised when edits cannot be applied without overwriting other changes."""
+
+
+class HclBlock:
+    """One top-level block: its type, labels and [start, end) span in the source text."""
+
+    def __init__(self, block_type, labels, start, end, text):
+        self.type = block_type
+        self.labels = labels
+        self.start = start
+        self.end = end
+        self.text = text
+
+    @property
+    def key(self):
+        return block_key(self.type, self.labels)
+
+    @property
+    def children(self):
+        """Blocks nested directly inside this one, e.g. the backend block of a terraform block."""
+        body_start = self.text.index("{") + 1
+        return _parse_body(self.text, body_start, len(self.text) - 1, top_level=False)
+
+    @property
+    def header(self):
+        return " ".join([self.type] + [f'"{label}"' for label in self.labels])
+
+
+def block_key(block_type, labels):
+    return ".".join([block_type] + list(labels))
+
+
+def _skip_string(text, i):
+    """i is just past an opening quote; returns the index just past the closing quote."""
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == "\\":
+            i += 2
+        elif c == '"':
+            return i + 1
+        elif c in "$%" and text.startswith("{", i + 1):
+            i = _skip_braces(text, i + 2)
+        elif c == "\n":
+            raise HclParseError(f"unterminated string on line {_line_number(text, i)}")
+        else:
+            i += 1
+    raise HclParseError("unterminated string at end of file")
+
+
+def _skip_heredoc(text, match):
+    """Returns the index just past the heredoc's closing marker line."""
+    marker = match.group(2)
+    i = match.end()
+    while i < len(text):
+        line_end = text.find("\n", i)
+        line_end = len(text) if line_end == -1 else line_end
+        if text[i:line_end].strip() == marker:
+            return line_end
+        i = line_end + 1
+    raise HclParseError(f"unterminated heredoc <<{marker}")
+
+
+def _skip_comment(text, i):
+    """Returns the index past the comment starting at i, or None if there is none."""
+    if text.startswith("#", i) or text.startswith("//", i):
+        end = text.find("\n", i)
+        return len(text) if end == -1 else end
+    if text.startswith("/*", i):
+        end = text.find("*/", i + 2)
+        if end == -1:
+            raise HclParseError("unterminated /* comment")
+        return end + 2
+    return None
+
+
+_CLOSERS = {"{": "}", "[": "]", "(": ")"}
+
+# Top-level block types Terraform accepts, with the number of labels each one takes.
+BLOCK_LABELS = {
+    "terraform": 0, "locals": 0, "provider": 1, "variable": 1, "output": 1, "module": 1,
+    "resource": 2, "data": 2, "ephemeral": 2, "moved": 0, "import": 0, "removed": 0, "check": 1,
+}
+
+
+def _line_number(text, i):
+    return text.count("\n", 0, i) + 1
+
+
+def _skip_braces(text, i, opener="{"):
+    """i is just past an opening bracket; returns the index just past its matching closing bracket."""
+    stack = [_CLOSERS[opener]]
+    n = len(text)
+    while i < n:
+        c = text[i]
+        skipped = _skip_comment(text, i)
+        if skipped is not None:
+            i = skipped
+        elif c == '"':
+            i = _skip_string(text, i + 1)
+        elif c == "<" and text.startswith("<<", i):
+            heredoc = _HEREDOC.match(text, i)
+            i = _skip_heredoc(text, heredoc) if heredoc else i + 2
+        elif c in _CLOSERS:
+            stack.append(_CLOSERS[c])
+            i += 1
+        elif c in "}])":
+            if c != stack.pop():
+                raise HclParseError(f"mismatched {c!r} on line {_line_number(text, i)}")
+            i += 1
+            if not stack:
+                return i
+        else:
+            i += 1
+    raise HclParseError(f"unbalanced brackets: missing {stack[-1]!r} at end of file")
+
+
+def _skip_expression(text, i, end):
+    """Skips an attribute value starting at i, up to the end of its (last) line or end."""
+    while i < end and text[i] != "\n":
+        c = text[i]
+        skipped = _skip_comment(text, i)
+        if skipped is not None:
+            i = skipped
+        elif c == '"':
+            i = _skip_string(text, i + 1)
+        elif c == "<" and text.startswith("<<", i):
+            heredoc = _HEREDOC.match(text, i)
+            i = _skip_heredoc(text, heredoc) if heredoc else i + 2
+        elif c in _CLOSERS:
+            i = _skip_braces(text, i + 1, c)
+        elif c in "}])":
+            raise HclParseError(f"unexpected {c!r} on line {_line_number(text, i)}")
+        else:
+            i += 1
+    return i
+
+
+def _parse_body(text, start, end, top_level):
+    """Returns the blocks between start and end; attributes are skipped (rejected at the top level)."""
+    blocks = []
+    i = start
+    while i < end:
+        if text[i].isspace():
+            i += 1
+            continue
+        skipped = _skip_comment(text, i)
+        if skipped is not None:
+            i = skipped
+            continue
+        block_start = i
+        ident = _IDENT.match(text, i)
+        if not ident:
+            raise HclParseError(f"unexpected {text[i]!r} on line {_line_number(text, i)}")
+        block_type = ident.group(0)
+        i = ident.end()
+        labels = []
+        while True:
+            while i < end and text[i] in " \t":
+                i += 1
+            if text.startswith('"', i):
+                label_end = _skip_string(text, i + 1)
+                labels.append(text[i + 1:label_end - 1])
+                i = label_end
+                continue
+            label = _IDENT.match(text, i)
+            if label:
+                labels.append(label.group(0))
+                i = label.end()
+                continue
+            break
+        if text.startswith("{", i):
+            i = _skip_braces(text, i + 1)
+            blocks.append(HclBlock(block_type, labels, block_start, i, text[block_start:i]))
+        elif text.startswith("=", i) and not labels and not top_level:
+            i = _skip_expression(text, i + 1, end)
+        elif text.startswith("=", i) and not labels:
+            raise HclParseError(f"attribute '{block_type}' outside of any block on line {_line_number(text, block_start)}")
+        else:
+            raise HclParseError(f"malformed block header '{text[block_start:i].strip()}' on line {_line_number(text, block_start)}")
+    return blocks
+
+
+def parse_blocks(text):
+    """Splits HCL text into its top-level blocks, in file order."""
+    return _parse_body(text, 0, len(text), top_level=True)
+
+
+def block_index(text):
+    """One header line per top-level block, e.g. 'resource "aws_vpc" "main"'."""
+    return "\n".join(block.header for block in parse_blocks(text))
+
+
+def _by_key(blocks):
+    keyed = {}
+    for block in blocks:
+        keyed.setdefault(block.key, []).append(block)
+    return keyed
+
+
+def _normalized(text):
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+def parse_edits(edit_text):
+    """Returns (replacement blocks, keys to delete) from an edit response."""
+    deletes = _DELETE.findall(edit_text)
+    replacements = parse_blocks(edit_text)
+    seen = set()
+    for key in [block.key for block in replacements] + deletes:
+        if key in seen:
+            raise EditConflict(f"{key} is edited more than once")
+        seen.add(key)
+    return replacements, deletes
+
+
+def apply_edits(base_text, current_text, edit_text):
+    """
+    Applies resource-level edits to current_text and returns the patched text.
+    Args:
+        base_text (str): The file content the edits were generated against.
+        current_text (str): The file content to patch (usually the file as it is on disk now).
+        edit_text (str): Replacement blocks and '# delete <key>' lines.
+    Raises:
+        HclParseError: If any of the three texts cannot be split into blocks.
+        EditConflict: If an edit would overwrite a change made since base_text.
+    """
+    replacements, deletes = parse_edits(edit_text)
+    if not replacements and not deletes:
+        raise EditConflict("the edit contains no blocks")
+    base = _by_key(parse_blocks(base_text))
+    current = _by_key(parse_blocks(current_text))
+
+    conflicts = []
+    spans = []  # (start, end, replacement text) within current_text
+    appended = []
+    for key, replacement in [(block.key, block.text) for block in replacements] + [(key, None) for key in deletes]:
+        base_blocks = base.get(key, [])
+        current_blocks = current.get(key, [])
+        if len(base_blocks) > 1 or len(current_blocks) > 1:
+            conflicts.append(f"{key} is ambiguous (defined more than once)")
+        elif not base_blocks:
+            if current_blocks:
+                conflicts.append(f"{key} was added since the edit was requested")
+            elif replacement is None:
+                conflicts.append(f"{key} cannot be deleted: no such block")
+            else:
+                appended.append(replacement)
+        elif not current_blocks:
+            conflicts.append(f"{key} was removed since the edit was requested")
+        elif _normalized(base_blocks[0].text) != _normalized(current_blocks[0].text):
+            conflicts.append(f"{key} was modified since the edit was requested")
+        else:
+            spans.append((current_blocks[0].start, current_blocks[0].end, replacement))
+    if conflicts:
+        raise EditConflict("; ".join(conflicts))
+
+    patched = current_text
+    for start, end, replacement in sorted(spans, reverse=True):
+        if replacement is None:
+            # Drop the block along with its line break and one separating blank line.
+            rest = patched[end:].lstrip(" \t")
+            for _ in range(2):
+                if rest.startswith("\n"):
+                    rest = rest[1:]
+            patched = patched[:start] + rest
+        else:
+            patched = patched[:start] + replacement + patched[end:]
+    if appended:
+        patched = patched.rstrip("\n") + "\n\n" + "\n\n".join(appended) + "\n"
+    return patched
+
+
+class Contract:
+    """
+    Blocks a generated file must or must not contain, as promised by its prompt.
+    Patterns are block keys or key prefixes, matched segment by segment against every
+    top-level block and the blocks nested directly inside it, e.g. "resource.aws_s3_bucket"
+    or "terraform.backend". A required pattern may list alternatives separated by "|".
+    Args:
+        required (list): Patterns that must each match at least one block.
+        forbidden (list): Patterns that must not match any block.
+        allowed_types (list, optional): The only top-level block types allowed, if given.
+    """
+
+    def __init__(self, required=(), forbidden=(), allowed_types=None):
+        self.required = list(required)
+        self.forbidden = list(forbidden)
+        self.allowed_types = allowed_types
+
+
+def _matches(pattern, key):
+    pattern_parts = pattern.split(".")
+    return key.split(".")[:len(pattern_parts)] == pattern_parts
+
+
+def validate_hcl(text, contract=None):
+    """
+    Checks that text splits into well-formed top-level blocks and honours the contract.
+    Returns a list of problems; an empty list means the file passed.
+    """
+    try:
+        blocks = parse_blocks(text)
+        keys = []
+        for block in blocks:
+            keys.append(block.key)
+            keys.extend(f"{block.key}.{child.key}" for child in block.children)
+    except HclParseError as e:
+        return [str(e)]
+
+    problems = []
+    for block in blocks:
+        expected = BLOCK_LABELS.get(block.type)
+        if expected is None:
+            problems.append(f"unknown top-level block type '{block.type}'")
+        elif len(block.labels) != expected:
+            problems.append(f"'{block.header}' should have {expected} label(s), not {len(block.labels)}")
+    if not contract:
+        return problems
+    if contract.allowed_types is not None:
+        for block in blocks:
+            if block.type not in contract.allowed_types:
+                problems.append(f"'{block.header}' is not allowed here (only {', '.join(contract.allowed_types)} blocks)")
+    for pattern in contract.required:
+        if not any(_matches(alternative, key) for alternative in pattern.split("|") for key in keys):
+            problems.append(f"missing required block {pattern.replace('|', ' or ')}")
+    for pattern in contract.forbidden:
+        for key in keys:
+            if _matches(pattern, key):
+                problems.append(f"forbidden block {key}")
+    return problems
@@ -0,0 +1,204 @@
+"""
+Hedged model calls, driven by a per-stage latency history.
+
+Every model call's latency is recorded per stage in a small JSON file
+(.llm_latency.json) that persists across runs. With hedging on, a call that
+has not returned by the chosen percentile of its stage's history (e.g. p95)
+gets a duplicate request. Whichever finishes first is used. The other request
+cannot be cancelled, so it keeps running in the background. Its time so far
+goes into the history as a lower bound, so the thresholds still follow the
+model's actual latency. After that it has no side effects and its result is
+dropped.
+
+The same file holds a histogram and percentiles for each stage, rewritten on
+every save, for dashboards or for tuning the percentile.
+"""
+import concurrent.futures
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+from rundir import file_lock
+
+DEFAULT_HISTORY_PATH = ".llm_latency.json"
+MAX_SAMPLES = 200
+# A stage is only hedged once it has this many samples.
+MIN_SAMPLES = 5
+# Upper bounds (seconds) of the exported histogram buckets; the last bucket is open-ended.
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def histogram(samples):
+    """{"<=1s": n, ..., ">300s": n} counts over HISTOGRAM_BUCKETS."""
+    counts = {f"<={bound}s": 0 for bound in HISTOGRAM_BUCKETS}
+    counts[f">{HISTOGRAM_BUCKETS[-1]}s"] = 0
+    for sample in samples:
+        bound = next((bound for bound in HISTOGRAM_BUCKETS if sample <= bound), None)
+        counts[f"<={bound}s" if bound is not None else f">{HISTOGRAM_BUCKETS[-1]}s"] += 1
+    return counts
+
+
+class LatencyHistory:
+    """
+    Recent call latencies per stage, loaded from and merged back into a JSON file.
+    Args:
+        path (str): History file; None keeps the history in memory only.
+        max_samples (int): Most recent samples kept per stage.
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH, max_samples=MAX_SAMPLES):
+        self.path = path
+        self.max_samples = max_samples
+        self.samples = self._load()
+        self.pending = {}  # stage -> samples recorded since the last save
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return {stage: list(samples) for stage, samples in json.load(f).get("samples", {}).items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Warning: Ignoring unreadable latency history {self.path}: {e}")
+            return {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(round(seconds, 3))
+            del self.samples[stage][:-self.max_samples]
+            self.pending.setdefault(stage, []).append(round(seconds, 3))
+
+    def threshold(self, stage, p):
+        """The p-th percentile latency of stage, or None until it has MIN_SAMPLES samples."""
+        with self._lock:
+            samples = list(self.samples.get(stage, []))
+        return percentile(samples, p) if len(samples) >= MIN_SAMPLES else None
+
+    def stats(self):
+        """Per-stage count, percentiles and histogram."""
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self.samples.items()}
+        return {
+            stage: {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "histogram": histogram(values),
+            }
+            for stage, values in sorted(samples.items())
+        }
+
+    def save(self):
+        """
+        Merges this run's samples into the file (other runs may have written to it meanwhile)
+        and rewrites the exported stats.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        with file_lock(f"{self.path}.lock", "the latency history"):
+            on_disk = self._load()
+            with self._lock:
+                for stage, values in pending.items():
+                    on_disk[stage] = (on_disk.get(stage, []) + values)[-self.max_samples:]
+                self.samples = on_disk
+            data = {"samples": on_disk, "stages": self.stats()}
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+class HedgeStats:
+    """Counts of hedged calls for the run summary. Thread-safe."""
+
+    def __init__(self):
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_won = 0
+        self._lock = threading.Lock()
+
+    def add(self, hedged, hedge_won):
+        with self._lock:
+            self.calls += 1
+            self.hedged += hedged
+            self.hedge_won += hedge_won
+
+    def summary(self):
+        return (f"Hedging: {self.hedged} of {self.calls} call(s) hedged, "
+                f"duplicate finished first {self.hedge_won} time(s)")
+
+
+def hedged_call(func, threshold, on_latency=None, label="call", abandoned=None):
+    """
+    Calls func() and, if it has not returned within threshold seconds, calls it again in
+    parallel. Returns (result, hedged, hedge_won) from whichever call succeeds first; an error
+    is only raised once both calls have failed. When a call succeeds, on_latency(seconds) is
+    called in the caller's thread for each request that did not fail: its latency, or for one
+    still running, its time so far. abandoned (threading.Event, optional) is set on return;
+    func should check it to drop the losing request's side effects.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"hedge-{label}")
+    futures = []
+    started = {}
+    latencies = {}
+
+    def timed(n):
+        result = func()
+        latencies[n] = time.monotonic() - started[n]
+        return result
+
+    def submit():
+        started[len(futures)] = time.monotonic()
+        futures.append(executor.submit(timed, len(futures)))
+
+    try:
+        submit()
+        done, _ = concurrent.futures.wait(futures, timeout=threshold)
+        if not done:
+            print(f"[hedge] {label}: no response after {threshold:.1f}s; sending a duplicate request")
+            submit()
+        pending = list(futures)
+        error = None
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                if future.exception() is None:
+                    if on_latency:
+                        for n, other in enumerate(futures):
+                            if n in latencies:
+                                on_latency(latencies[n])
+                            elif other in pending:
+                                on_latency(time.monotonic() - started[n])  # still running: a lower bound
+                    hedge_won = len(futures) > 1 and future is futures[1]
+                    if hedge_won:
+                        print(f"[hedge] {label}: duplicate request finished first")
+                    return future.result(), len(futures) > 1, hedge_won
+                error = future.exception()
+        raise error
+    finally:
+        if abandoned is not None:
+            abandoned.set()
+        # Never wait for the losing request; it finishes (or fails) in the background.
+        executor.shutdown(wait=False)
@@ -0,0 +1,99 @@
+"""
+Run journal for resumable pipelines.
+
+After each step completes, the journal records a hash of the step's inputs,
+the step's result and a SHA-256 of every file it produced. A resumed run
+can then skip any step whose inputs hash the same and whose output files
+are still on disk, unchanged.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+DEFAULT_JOURNAL_PATH = ".run_journal.json"
+JOURNAL_VERSION = 1
+
+
+def fingerprint(value):
+    """SHA-256 of a JSON-serializable value, with stable key ordering."""
+    payload = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_sha256(path):
+    """Returns the SHA-256 of a file's bytes, or None if it does not exist."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+class RunJournal:
+    """
+    JSON journal of completed steps.
+    Args:
+        path (str): Journal file location.
+        resume (bool): Let lookup() report completed steps so they can be skipped.
+            Either way, previous entries are kept, so running a subset of the steps
+            does not forget the others; steps that run again overwrite their entry.
+        file_hash (callable): Returns a path's SHA-256; defaults to hashing the file on disk.
+            Pass a staged workspace's hasher to record outputs that are not written yet.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, resume=False, file_hash=file_sha256):
+        self.path = path
+        self.resume = resume
+        self.file_hash = file_hash
+        self.steps = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Warning: Ignoring unreadable run journal {self.path}: {e}")
+            return
+        if data.get("version") == JOURNAL_VERSION:
+            self.steps = data.get("steps", {})
+
+    def lookup(self, name, inputs_hash, outputs):
+        """
+        Returns (True, result) when the step completed before with the same inputs hash
+        and all of its output files still match the recorded hashes, else (False, None).
+        """
+        entry = self.steps.get(name)
+        if not self.resume or not entry or entry.get("inputs_hash") != inputs_hash:
+            return False, None
+        recorded = entry.get("outputs", {})
+        if sorted(recorded) != sorted(outputs):
+            return False, None
+        for path, digest in recorded.items():
+            if self.file_hash(path) != digest:
+                return False, None
+        return True, entry.get("result")
+
+    def record(self, name, inputs_hash, outputs, result):
+        """Records a completed step and saves the journal immediately."""
+        self.steps[name] = {
+            "inputs_hash": inputs_hash,
+            "outputs": {path: self.file_hash(path) for path in outputs},
+            "result": result,
+            "finished_at": time.time(),
+        }
+        self.save()
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": JOURNAL_VERSION, "steps": self.steps}, f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,110 @@
+"""
+Schema-constrained JSON output mode.
+
+Instead of relying on the model to follow the "### <path> <lang>" + fence
+layout, the request sets response_mime_type to application/json with a
+response schema, so the model returns
+
+    {"files": [{"path": "main.tf", "language": "hcl", "content": "..."}, ...]}
+
+decode_files() turns that into the same {path: content or None} map that
+codeblocks.extract_multiple_code_blocks() returns, plus a list of problems.
+When entries are missing or malformed, build_prompt_retry() asks again for just
+those files instead of regenerating everything.
+"""
+import json
+
+from codeblocks import clean_block
+
+JSON_MIME_TYPE = "application/json"
+
+# OpenAPI-style schema in the subset the Gemini API accepts.
+FILES_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "files": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "path": {"type": "STRING"},
+                    "language": {"type": "STRING"},
+                    "content": {"type": "STRING"},
+                },
+                "required": ["path", "language", "content"],
+            },
+        },
+    },
+    "required": ["files"],
+}
+
+
+def json_generation_config(generation_config):
+    """generation_config plus the JSON MIME type and files schema."""
+    return dict(generation_config, response_mime_type=JSON_MIME_TYPE, response_schema=FILES_SCHEMA)
+
+
+def json_instructions(file_language_map):
+    """Prompt suffix that replaces the markdown output layout with the JSON one."""
+    wanted = "\n".join(f'- path "{path}", language "{language}"' for path, language in file_language_map.items())
+    return f"""
+OUTPUT FORMAT OVERRIDE: Ignore any instructions above about markdown headers and code fences.
+Respond with a single JSON object of the form {{"files": [{{"path": ..., "language": ..., "content": ...}}]}},
+with exactly one entry for each of these files:
+{wanted}
+"content" is the complete file content as plain text, without code fences.
+"""
+
+
+def _strip_fence(text):
+    # Some responses still wrap the JSON in a ```json fence despite the MIME type.
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = stripped.split("\n", 1)[1] if "\n" in stripped else ""
+        if stripped.rstrip().endswith("```"):
+            stripped = stripped.rstrip()[:-3]
+    return stripped
+
+
+def decode_files(text, file_language_map):
+    """
+    Decodes a JSON files response. Returns (blocks, problems): blocks maps every requested
+    path to its content or None; problems lists what was wrong, one string per issue.
+    Files that were not requested are ignored.
+    """
+    blocks = {path: None for path in file_language_map}
+    try:
+        data = json.loads(_strip_fence(text or ""))
+    except ValueError as e:
+        return blocks, [f"The response was not valid JSON ({e})."]
+    files = data.get("files") if isinstance(data, dict) else data
+    if not isinstance(files, list):
+        return blocks, ['The response must be an object with a "files" array.']
+    problems = []
+    reported = set()  # paths that already have a problem of their own
+    for i, entry in enumerate(files):
+        if not isinstance(entry, dict) or not all(isinstance(entry.get(key), str) for key in ("path", "content")):
+            problems.append(f'files[{i}] must be an object with string "path", "language" and "content".')
+            continue
+        path = entry["path"].strip()
+        if path not in blocks or blocks[path] is not None:
+            continue
+        content = clean_block(entry["content"])
+        if not content:
+            problems.append(f"{path}: content is empty.")
+            reported.add(path)
+            continue
+        blocks[path] = content
+    for path, content in blocks.items():
+        if content is None and path not in reported:
+            problems.append(f"{path}: missing from the response.")
+    return blocks, problems
+
+
+def build_prompt_retry(prompt, file_language_map, problems):
+    """Re-asks for only the files in file_language_map (the ones that were missing or malformed)."""
+    problem_list = "\n".join(f"- {problem}" for problem in problems)
+    return f"""{prompt}
+Your previous JSON answer to this request had these problems:
+{problem_list}
+{json_instructions(file_language_map)}"""
@@ -1,10 +1,13 @@
 import os
 import subprocess
-import time
-import re
 import uuid # For generating unique names
 from dotenv import load_dotenv
-import google.generativeai as genai
+
+from codeblocks import extract_code_block
+from llm import make_backend
+from pipeline import Step, run_steps
+from runner import run_command
+from token_budget import TokenBudget, TokenBudgetExceeded
 
 # --- Configuration ---
 # Replace with your GitHub repository URL
@@ -20,40 +23,6 @@ DDB_LOCK_TABLE_NAME = f"{PROJECT_NAME}-tf-lock-{UNIQUE_ID}"
 
 # --- Helper Functions ---
 
-import re # Make sure 're' is imported at the top of your script
-
-def extract_code_block(response_text, filename_hint, lang_tag):
-    """
-    Extracts a code block from the Gemini response based on filename hint and language tag.
-    Assumes the format: ### filename language\n```[lang]\nCODE\n```
-    Made more robust for leading/trailing whitespace around fences and headers.
-    """
-    # pattern = re.compile( # This was your previous pattern
-    #     rf"### {re.escape(filename_hint)} {re.escape(lang_tag)}\s*\n```(?:{re.escape(lang_tag)})?\s*\n(.*?)\n```",
-    #     re.DOTALL | re.IGNORECASE
-    # )
-
-    # *** THIS IS THE CORRECTED REGEX ***
-    pattern = re.compile(
-        # Matches optional leading whitespace on the line, then '###', filename, and lang tag
-        rf"^\s*### {re.escape(filename_hint)} {re.escape(lang_tag)}\s*\n"
-        # Matches optional leading whitespace before the opening code fence, then the fence itself
-        rf"\s*```(?:{re.escape(lang_tag)})?\s*\n"
-        # Captures the actual code content (non-greedy, matches anything including newlines)
-        r"(.*?)\n"
-        # Matches optional leading whitespace before the closing code fence, then the fence itself
-        r"^\s*```",
-        re.DOTALL | re.IGNORECASE | re.MULTILINE # MULTILINE makes '^' and '$' match start/end of lines
-    )
-    # *** END CORRECTED REGEX ***
-
-    match = pattern.search(response_text)
-    if match:
-        return match.group(1).strip()
-    return None
-
-# ... (rest of your lambda.py script)
-
 import os # Make sure os is imported at the top of your script
 
 def write_file(path, content):
@@ -72,6 +41,13 @@ def write_file(path, content):
         print(f"Error writing file {path}: {e}")
         exit(1)
 
+def generate_text(stage, prompt):
+    """Sends a prompt through the token budget (compressing or refusing it if over) and returns the reply text."""
+    prompt, prompt_tokens = token_budget.fit(stage, prompt)
+    response = model.generate(prompt, None)
+    token_budget.record(stage, prompt_tokens, response.text, response.usage)
+    return response.text
+
 def call_gemini_and_save(prompt_text, output_filename, lang_tag, preamble_text=None):
     """
     Calls Gemini API with a prompt, extracts a specific code block, and saves it.
@@ -89,8 +65,7 @@ def call_gemini_and_save(prompt_text, output_filename, lang_tag, preamble_text=N
 
     print(f"\n--- Sending prompt for {output_filename} ---")
     try:
-        response = model.generate_content(full_prompt)
-        reply = response.text
+        reply = generate_text(output_filename, full_prompt)
         # print(f"Gemini Raw Response for {output_filename}:\n{reply}\n--- End Raw Response ---") # For debugging
 
         code_content = extract_code_block(reply, output_filename, lang_tag)
@@ -103,27 +78,27 @@ def call_gemini_and_save(prompt_text, output_filename, lang_tag, preamble_text=N
             print("AI Response was:\n", reply)
             return None
 
+    except TokenBudgetExceeded as e:
+        print(f"Error: Token budget exceeded: {e}")
+        print(token_budget.summary())
+        exit(1)
     except Exception as e:
         print(f"Error while getting Gemini response for {output_filename}: {e}")
         return None
 
 def run_terraform_command(command, cwd=None):
-    """Helper to run terraform commands."""
+    """Helper to run terraform commands, streaming their output as it arrives."""
     print(f"\n--- Running: {' '.join(command)} in {cwd if cwd else os.getcwd()} ---")
     try:
-        result = subprocess.run(command, cwd=cwd, check=True, capture_output=True, text=True)
-        print(result.stdout)
-        if result.stderr:
-            print("Stderr:\n", result.stderr)
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error during Terraform command: {' '.join(command)}")
-        print("Stdout:\n", e.stdout)
-        print("Stderr:\n", e.stderr)
-        return False
+        result = run_command(command, cwd=cwd)
     except FileNotFoundError:
         print("Terraform command not found. Please ensure Terraform is installed and in your PATH.")
         return False
+    if not result.ok:
+        print(f"Error during Terraform command: {' '.join(command)}")
+        print(result.error_report())
+        return False
+    return True
 
 # --- Main Script Execution ---
 
@@ -131,15 +106,22 @@ def main():
     # Step 1: Load .env
     load_dotenv()
     api_key = os.getenv("GEMINI_API_KEY")
+    # LLM_MODE: live calls Gemini, record also saves responses, replay serves saved responses offline
+    llm_mode = os.getenv("LLM_MODE", "live")
 
-    if not api_key:
+    if not api_key and llm_mode != "replay":
         print("GEMINI_API_KEY not found. Please check your .env file and ensure it contains GEMINI_API_KEY=YOUR_KEY.")
         exit(1)
 
     # Step 2: Configure Gemini
-    global model
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-1.5-pro')
+    global model, token_budget
+    model = make_backend(llm_mode, 'gemini-1.5-pro', api_key)
+    # PROMPT_TOKEN_BUDGET / RUN_TOKEN_BUDGET: token limits per prompt and per run (unset: no limit);
+    # TOKEN_BUDGET_POLICY: warn, compress (the default) or fail for a prompt over its limit
+    prompt_budget = os.getenv("PROMPT_TOKEN_BUDGET")
+    run_budget = os.getenv("RUN_TOKEN_BUDGET")
+    token_budget = TokenBudget(int(prompt_budget) if prompt_budget else None, run_budget=int(run_budget) if run_budget else None,
+                               policy=os.getenv("TOKEN_BUDGET_POLICY", "compress"))
 
     # Step 3: Create all necessary directories upfront
     print("Creating project directories...")
@@ -262,139 +244,160 @@ Output must be in this exact format:
     """
 
     # --- Execution Steps ---
+    # Each step receives a dict with the results of the steps listed as its inputs.
 
     # Step 4.1: Generate backend-bootstrap/backend.tf
-    backend_tf_content = call_gemini_and_save(prompt_backend, "backend-bootstrap/backend.tf", "hcl")
-    if not backend_tf_content:
-        print("Failed to generate backend-bootstrap/backend.tf. Exiting.")
-        exit(1)
-
-    # Step 4.2: Run Terraform init + apply for backend only
-    # ... (rest of the script remains the same up to this point)
+    def step_backend(inputs):
+        backend_tf_content = call_gemini_and_save(prompt_backend, "backend-bootstrap/backend.tf", "hcl")
+        if not backend_tf_content:
+            print("Failed to generate backend-bootstrap/backend.tf. Exiting.")
+            exit(1)
+        return backend_tf_content
 
     # Step 4.2: Run Terraform init + apply for backend only
-    print("\n--- Running Terraform backend init/apply ---")
-    current_dir = os.getcwd()
-
-    # --- THIS IS THE CRITICAL CHANGE ---
-    # When initializing the backend-bootstrap, it should NOT try to use a remote backend.
-    # It should use local state to CREATE the S3/DDB resources.
-    if not run_terraform_command(["terraform", "init"], cwd="backend-bootstrap"):
-        print("Terraform backend init failed. Exiting.")
-        exit(1)
-    # --- END CRITICAL CHANGE ---
+    def step_backend_apply(inputs):
+        print("\n--- Running Terraform backend init/apply ---")
 
-    # This terraform apply will now create the S3 bucket and DynamoDB table
-    # using its local state.
-    if not run_terraform_command(["terraform", "apply", "-auto-approve"], cwd="backend-bootstrap"):
-        print("Terraform backend apply failed. Exiting.")
-        exit(1)
-    print("Terraform backend setup complete. S3 bucket and DynamoDB table for state have been created.")
+        # When initializing the backend-bootstrap, it should NOT try to use a remote backend.
+        # It should use local state to CREATE the S3/DDB resources.
+        if not run_terraform_command(["terraform", "init"], cwd="backend-bootstrap"):
+            print("Terraform backend init failed. Exiting.")
+            exit(1)
 
-# ... (rest of the script continues from here)
+        # This terraform apply will now create the S3 bucket and DynamoDB table
+        # using its local state.
+        if not run_terraform_command(["terraform", "apply", "-auto-approve"], cwd="backend-bootstrap"):
+            print("Terraform backend apply failed. Exiting.")
+            exit(1)
+        print("Terraform backend setup complete. S3 bucket and DynamoDB table for state have been created.")
+        return True
 
     # Step 4.3: Generate initial main.tf and variables.tf
-    print("\n--- Sending prompt for main.tf and variables.tf (initial infrastructure) ---")
-    try:
-        response_core_infra = model.generate_content(prompt_core_infra).text
-        main_tf_content_initial = extract_code_block(response_core_infra, "main.tf", "hcl")
-        variables_tf_content = extract_code_block(response_core_infra, "variables.tf", "hcl")
-
-        if main_tf_content_initial and variables_tf_content:
-            write_file("main.tf", main_tf_content_initial)
-            write_file("variables.tf", variables_tf_content)
-        else:
-            print("Warning: Could not extract both main.tf and variables.tf from core infra response.")
-            print("AI Response was:\n", response_core_infra)
+    def step_core_infra(inputs):
+        print("\n--- Sending prompt for main.tf and variables.tf (initial infrastructure) ---")
+        try:
+            response_core_infra = generate_text("core_infra", prompt_core_infra)
+            core_files = ("main.tf", "variables.tf")
+            main_tf_content_initial = extract_code_block(response_core_infra, "main.tf", "hcl", core_files)
+            variables_tf_content = extract_code_block(response_core_infra, "variables.tf", "hcl", core_files)
+
+            if main_tf_content_initial and variables_tf_content:
+                write_file("main.tf", main_tf_content_initial)
+                write_file("variables.tf", variables_tf_content)
+            else:
+                print("Warning: Could not extract both main.tf and variables.tf from core infra response.")
+                print("AI Response was:\n", response_core_infra)
+                exit(1)
+        except TokenBudgetExceeded as e:
+            print(f"Error: Token budget exceeded: {e}")
+            print(token_budget.summary())
             exit(1)
-    except Exception as e:
-        print(f"Error generating core infrastructure files: {e}")
-        exit(1)
+        except Exception as e:
+            print(f"Error generating core infrastructure files: {e}")
+            exit(1)
+        return main_tf_content_initial
 
     # Step 4.4: Write src/index.js (hardcoded as per requirement and simplicity)
-    write_file(
-        "src/index.js",
-        'exports.handler = async (event) => {\n  console.log("Lambda invoked with event:", JSON.stringify(event, null, 2));\n  return {\n    statusCode: 200,\n    headers: { "Content-Type": "application/json" },\n    body: JSON.stringify({ message: "My name is pankaj" }),\n  };\n};\n'
-    )
-    # Create a dummy package.json for npm install in GitHub Actions
-    write_file(
-        "src/package.json",
-        '{\n  "name": "my-nodejs-app",\n  "version": "1.0.0",\n  "description": "A simple Node.js Lambda app",\n  "main": "index.js",\n  "scripts": {\n    "test": "echo \\"Error: no test specified\\" && exit 1"\n  },\n  "keywords": [],\n  "author": "",\n  "license": "ISC"\n}\n'
-    )
-
+    def step_src(inputs):
+        write_file(
+            "src/index.js",
+            'exports.handler = async (event) => {\n  console.log("Lambda invoked with event:", JSON.stringify(event, null, 2));\n  return {\n    statusCode: 200,\n    headers: { "Content-Type": "application/json" },\n    body: JSON.stringify({ message: "My name is pankaj" }),\n  };\n};\n'
+        )
+        # Create a dummy package.json for npm install in GitHub Actions
+        write_file(
+            "src/package.json",
+            '{\n  "name": "my-nodejs-app",\n  "version": "1.0.0",\n  "description": "A simple Node.js Lambda app",\n  "main": "index.js",\n  "scripts": {\n    "test": "echo \\"Error: no test specified\\" && exit 1"\n  },\n  "keywords": [],\n  "author": "",\n  "license": "ISC"\n}\n'
+        )
+        return True
 
     # Step 4.5: Generate updated main.tf with Lambda and ALB
-    current_main_tf_content = ""
-    if os.path.exists("main.tf"):
-        with open("main.tf", "r") as f:
-            current_main_tf_content = f.read()
-
-    # Pass current main.tf as context to the AI for updating
-    updated_main_tf_content = call_gemini_and_save(
-        prompt_update_main_tf.format(current_main_tf_content=current_main_tf_content),
-        "main.tf",
-        "hcl"
-    )
-    if not updated_main_tf_content:
-        print("Failed to generate updated main.tf. Exiting.")
-        exit(1)
-
+    def step_lambda_alb(inputs):
+        # Pass the core infra main.tf as context to the AI for updating
+        updated_main_tf_content = call_gemini_and_save(
+            prompt_update_main_tf.format(current_main_tf_content=inputs["core_infra"]),
+            "main.tf",
+            "hcl"
+        )
+        if not updated_main_tf_content:
+            print("Failed to generate updated main.tf. Exiting.")
+            exit(1)
+        return updated_main_tf_content
 
     # Step 4.6: Generate .github/workflows/deploy.yml
-    github_actions_content = call_gemini_and_save(prompt_github_actions, ".github/workflows/deploy.yml", "yaml")
-    if not github_actions_content:
-        print("Failed to generate .github/workflows/deploy.yml. Exiting.")
-        exit(1)
+    def step_workflow(inputs):
+        github_actions_content = call_gemini_and_save(prompt_github_actions, ".github/workflows/deploy.yml", "yaml")
+        if not github_actions_content:
+            print("Failed to generate .github/workflows/deploy.yml. Exiting.")
+            exit(1)
+        return github_actions_content
 
     # Step 4.7: Write .gitignore (hardcoded as per requirement)
-    write_file(
-        ".gitignore",
-        ".env\nnode_modules/\nnpm-debug.log*\nyarn-debug.log*\nyarn-error.log*\n"
-        ".terraform/\n*.tfstate*\n__pycache__/\nlambda.zip\n"
-    )
+    def step_gitignore(inputs):
+        write_file(
+            ".gitignore",
+            ".env\nnode_modules/\nnpm-debug.log*\nyarn-debug.log*\nyarn-error.log*\n"
+            ".terraform/\n*.tfstate*\n__pycache__/\nlambda.zip\n"
+        )
+        return True
 
     # Step 5: Initialize Git & Push
-    print("\n--- Initializing Git repo and pushing to GitHub ---")
-    if not os.path.isdir(".git"):
-        if not run_terraform_command(["git", "init"]):
-            print("Git init failed. Exiting.")
+    def step_publish(inputs):
+        print("\n--- Initializing Git repo and pushing to GitHub ---")
+        if not os.path.isdir(".git"):
+            if not run_terraform_command(["git", "init"]):
+                print("Git init failed. Exiting.")
+                exit(1)
+
+        # Add all generated files
+        if not run_terraform_command(["git", "add", "."]):
+            print("Git add failed. Exiting.")
+            exit(1)
+        if not run_terraform_command(["git", "commit", "-m", "AI-generated Lambda deployment infra"]):
+            print("Git commit failed. Exiting.")
+            exit(1)
+        if not run_terraform_command(["git", "branch", "-M", "main"]):
+            print("Git branch failed. Exiting.")
             exit(1)
 
-    # Add all generated files
-    if not run_terraform_command(["git", "add", "."]):
-        print("Git add failed. Exiting.")
-        exit(1)
-    if not run_terraform_command(["git", "commit", "-m", "AI-generated Lambda deployment infra"]):
-        print("Git commit failed. Exiting.")
-        exit(1)
-    if not run_terraform_command(["git", "branch", "-M", "main"]):
-        print("Git branch failed. Exiting.")
-        exit(1)
-
-    # Set remote URL, handling if it already exists
-    try:
-        subprocess.run(["git", "remote", "set-url", "origin", GITHUB_REPO_URL], check=True, stderr=subprocess.PIPE)
-        print(f"Git remote 'origin' set to {GITHUB_REPO_URL}")
-    except subprocess.CalledProcessError as e:
-        if "already exists" in e.stderr.decode():
-            print("Git remote 'origin' already exists. Skipping 'add remote'.")
-        else:
-            print(f"Error setting git remote: {e.stderr.decode()}")
+        # Set remote URL, handling if it already exists
+        try:
+            subprocess.run(["git", "remote", "set-url", "origin", GITHUB_REPO_URL], check=True, stderr=subprocess.PIPE)
+            print(f"Git remote 'origin' set to {GITHUB_REPO_URL}")
+        except subprocess.CalledProcessError as e:
+            if "already exists" in e.stderr.decode():
+                print("Git remote 'origin' already exists. Skipping 'add remote'.")
+            else:
+                print(f"Error setting git remote: {e.stderr.decode()}")
+                exit(1)
+
+        try:
+            subprocess.run(["git", "push", "-u", "origin", "main"], check=True)
+            print("Code pushed to GitHub. CI/CD will trigger now.")
+        except subprocess.CalledProcessError as e:
+            print(f"Error pushing to GitHub: {e.stderr.decode()}")
+            print("Please ensure your GitHub repository exists, you have push access, and your Git credentials are configured correctly.")
             exit(1)
+        return True
 
-    try:
-        subprocess.run(["git", "push", "-u", "origin", "main"], check=True)
-        print("Code pushed to GitHub. CI/CD will trigger now.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error pushing to GitHub: {e.stderr.decode()}")
-        print("Please ensure your GitHub repository exists, you have push access, and your Git credentials are configured correctly.")
-        exit(1)
+    # The backend apply only gates the final push, so the remaining prompts
+    # run alongside it.
+    run_steps([
+        Step("backend", step_backend),
+        Step("backend_apply", step_backend_apply, inputs=["backend"]),
+        Step("core_infra", step_core_infra),
+        Step("src", step_src),
+        Step("lambda_alb", step_lambda_alb, inputs=["core_infra"]),
+        Step("workflow", step_workflow),
+        Step("gitignore", step_gitignore),
+        Step("publish", step_publish, inputs=["backend_apply", "lambda_alb", "src", "workflow", "gitignore"]),
+    ])
 
     print("\n--- Deployment Automation Script Finished ---")
     print("Please check your GitHub Actions workflow for deployment status.")
     print(f"\nYour S3 state bucket: {S3_STATE_BUCKET_NAME}")
     print(f"Your DynamoDB lock table: {DDB_LOCK_TABLE_NAME}")
     print(f"Your GitHub Repo: {GITHUB_REPO_URL}")
+    print(token_budget.summary())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
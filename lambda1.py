@@ -1,28 +1,47 @@
+import argparse
+import concurrent.futures
+import contextlib
+import glob
 import os
 import random
-import dotenv
-import google.generativeai as genai
-import textwrap
-import re
 import json
-import subprocess
+import shlex
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
 import uuid
 
-# Load environment variables
-dotenv.load_dotenv()
-
-# Configure Google Generative AI
-GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GOOGLE_API_KEY:
-    print("Error: GOOGLE_API_KEY not found in .env file.")
-    exit(1)
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel('gemini-1.5-pro')
+from backend_registry import DEFAULT_REGISTRY_PATH, find_existing_backend, register_backend, registry_lock
+from codeblocks import StreamingBlockParser, extract_multiple_code_blocks, index_code_blocks
+from hedging import DEFAULT_HISTORY_PATH, HedgeStats, LatencyHistory, hedged_call
+from hcl import Contract, EditConflict, HclParseError, apply_edits, block_index, validate_hcl
+from journal import RunJournal
+from json_output import build_prompt_retry, decode_files, json_generation_config, json_instructions
+from llm import LLM_MODES, DEFAULT_RECORDINGS_DIR, make_backend
+from llm_client import (DEFAULT_DEADLINE_SECONDS, DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_RETRIES,
+                        DEFAULT_REQUESTS_PER_MINUTE)
+from llm_cache import DEFAULT_CACHE_DIR, ResponseCache, cache_key
+from lambda_package import build_package, package_and_upload
+from pipeline import Step, run_steps
+from rundir import DEFAULT_RUNS_DIR, create_run_dir, file_lock
+from runner import clear_command_log, command_summary, run_command
+from terraform_init import init_fingerprint, init_is_current, plugin_cache_dir, record_init, terraform_env
+from terraform_plan import DEFAULT_PLAN_FILE, format_plan_summary, plan_is_empty, show_plan
+from token_budget import BUDGET_POLICIES, TokenBudget, TokenBudgetExceeded, compress_prompt, estimate_tokens
+from tracing import clear_spans, format_report, span, write_trace
+from workspace import Workspace
+
+# Google Generative AI model; the backend is built in main() from --llm-mode
+MODEL_NAME = 'gemini-1.5-pro'
+LLM_BACKEND = None
 
 # Generation configuration for all AI calls
-generation_config = genai.types.GenerationConfig(
-    temperature=0.2,
-)
+generation_config = {
+    "temperature": 0.2,
+}
 
 # --- Global Constants (Adjust these as needed) ---
 PROJECT_NAME = "pankaj-devops-lambda"
@@ -30,132 +49,547 @@ AWS_REGION = "ap-south-1"
 LAMBDA_RUNTIME = "nodejs18.x"
 GITHUB_REPO_URL = "https://github.com/pankajpachahara/automated_lambda1.git"  # Update this to your repo
 
-# Generate a random hex suffix for unique bucket/table names
-RANDOM_HEX = str(uuid.uuid4())[:8]
-
-# Derived names for backend resources
-S3_STATE_BUCKET_NAME = f"{PROJECT_NAME}-tfstate-{RANDOM_HEX}"
-DDB_LOCK_TABLE_NAME = f"{PROJECT_NAME}-tf-lock-{RANDOM_HEX}"
-
 # Define the literal string for S3 bucket interpolation for Gemini
 S3_LAMBDA_CODE_BUCKET_TF_REF = "$${{aws_s3_bucket.lambda_code_bucket.id}}"
 
+# Stream responses and write each file as soon as its block closes (set by --stream)
+STREAM_RESPONSES = False
+
+# "markdown" (### path lang + fenced blocks) or "json" (schema-constrained, set by --output-format)
+OUTPUT_FORMAT = "markdown"
+
+# Candidates requested per stage; the first that passes validation wins (set by --candidates)
+CANDIDATES = 1
+# Temperature for the extra candidates, so they differ from the first one
+CANDIDATE_TEMPERATURE = 0.7
+
+# Also run `terraform validate` on generated Terraform (set by --terraform-validate)
+TERRAFORM_VALIDATE = False
+
+# Per-stage model latencies; with --hedge, slow calls get a duplicate request
+LATENCY_HISTORY = LatencyHistory(None)
+HEDGE = False
+HEDGE_PERCENTILE = 95
+HEDGE_STATS = HedgeStats()
+
+# Prompt token limits and per-stage usage (configured by the --*-token-budget options)
+TOKEN_BUDGET = TokenBudget()
+
+# Response cache shared by every LLM call (configured by --no-cache / --refresh)
+LLM_CACHE = ResponseCache()
+
+# Semaphore shared by all batch/daemon workers that caps concurrent model calls (None otherwise)
+LLM_SLOTS = None
+# Queue a daemon worker reports job progress on (None outside `serve`)
+DAEMON_EVENTS = None
+
+# Background checks kicked off for files emitted mid-stream
+STREAM_CHECKS = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="check")
+
+# Ask for resource-level edits to main.tf instead of the whole file (set by --edit-mode)
+EDIT_MODE = False
+
+# Always bootstrap a new state backend, even if one is registered (set by --new-backend)
+FORCE_NEW_BACKEND = False
+
+# Per-command timeouts in seconds, keyed by the first two words of the command
+COMMAND_TIMEOUTS = {
+    "terraform init": 600,
+    "terraform plan": 1800,
+    "terraform show": 120,
+    "terraform apply": 3600,
+    "terraform fmt": 60,
+    "terraform validate": 120,
+    "git fetch": 300,
+    "git push": 300,
+}
+DEFAULT_COMMAND_TIMEOUT = 900
+
+# Generated files are staged here and written to disk by commit_workspace()
+WORKSPACE = Workspace()
+
+# Journal of completed steps, used by --resume to skip unchanged work
+RUN_JOURNAL_PATH = ".run_journal.json"
+
+# Shared between concurrent runs; made absolute when a run moves into its own directory (--isolated)
+BACKEND_REGISTRY_PATH = DEFAULT_REGISTRY_PATH
+PUBLISH_LOCK_PATH = ".publish.lock"
+
 
 # --- Helper Functions ---
+def new_backend_names():
+    """Derives fresh names for the backend resources from a random hex suffix."""
+    random_hex = str(uuid.uuid4())[:8]
+    return {
+        "state_bucket": f"{PROJECT_NAME}-tfstate-{random_hex}",
+        "lock_table": f"{PROJECT_NAME}-tf-lock-{random_hex}",
+    }
+
+def command_timeout(args):
+    """Looks up the timeout for a command by its first two words, e.g. "terraform apply"."""
+    return COMMAND_TIMEOUTS.get(" ".join(args[:2]), DEFAULT_COMMAND_TIMEOUT)
+
 def run_terraform_command(command, directory):
-    """Executes a Terraform command in the specified directory."""
-    print(f"\n--- Running: {command} in {directory} ---")
+    """Executes a Terraform command in the specified directory, streaming its output."""
+    args = shlex.split(command) if isinstance(command, str) else list(command)
+    print(f"\n--- Running: {' '.join(args)} in {directory} ---")
     try:
-        process = subprocess.run(
-            command,
-            cwd=directory,
-            shell=True,
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        print(f"Stdout:\n{process.stdout}")
-        if process.stderr:
-            print(f"Stderr:\n{process.stderr}")
-        return process.stdout
-    except subprocess.CalledProcessError as e:
-        print(f"Error during Terraform command: {command}")
-        print(f"Stdout:\n{e.stdout}")
-        print(f"Stderr:\n{e.stderr}")
-        exit(1)
+        result = run_command(args, cwd=directory, timeout=command_timeout(args), env=terraform_env())
     except FileNotFoundError:
         print(f"Error: Command not found. Is Terraform installed and in your PATH?")
         exit(1)
+    if not result.ok:
+        print(f"Error during Terraform command: {' '.join(args)}")
+        print(result.error_report())
+        exit(1)
+    print(f"Finished in {result.duration:.1f}s")
+    return result
+
+def run_terraform_init(directory):
+    """
+    Runs terraform init, unless the lock file, backend config and modules are unchanged
+    since the last successful init in this directory (see terraform_init.py).
+    """
+    if init_is_current(directory, init_fingerprint(directory)):
+        print(f"\n--- Skipping terraform init in {directory} (lock file, backend and modules unchanged) ---")
+        return True
+    # Terraform does not guarantee that concurrent inits can safely share the plugin cache.
+    with file_lock(os.path.join(plugin_cache_dir(), ".init.lock"), "the provider cache"):
+        result = run_terraform_command(["terraform", "init"], directory)
+    record_init(directory, init_fingerprint(directory))
+    return result
+
+def run_terraform_plan_apply(directory, var_args=()):
+    """
+    Plans into a saved plan file, prints its change summary, and applies exactly that plan.
+    Apply is skipped when the plan has no changes. Returns the change summary.
+    """
+    plan_path = os.path.join(directory, DEFAULT_PLAN_FILE)
+    run_terraform_command(["terraform", "plan", "-input=false", f"-out={DEFAULT_PLAN_FILE}"] + list(var_args), directory)
+    summary = show_plan(directory, DEFAULT_PLAN_FILE, env=terraform_env(), timeout=command_timeout(["terraform", "show"]))
+    if summary is None:
+        print(f"Error: Could not read the saved plan in {directory}. Exiting.")
+        exit(1)
+    print(format_plan_summary(summary))
+    if plan_is_empty(summary):
+        print(f"No changes in {directory}; skipping terraform apply.")
+        os.remove(plan_path)
+        return summary
+    run_terraform_command(["terraform", "apply", "-input=false", DEFAULT_PLAN_FILE], directory)
+    os.remove(plan_path)
+    return summary
 
 def run_git_command(command, directory):
-    """Executes a Git command in the specified directory."""
+    """Executes a Git command in the specified directory, streaming its output."""
     print(f"\n--- Running: {' '.join(command)} in {directory} ---")
     try:
-        process = subprocess.run(
-            command,
-            cwd=directory,
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        print(f"Stdout:\n{process.stdout}")
-        if process.stderr:
-            print(f"Stderr:\n{process.stderr}")
-        return True
-    except subprocess.CalledProcessError as e:
+        result = run_command(command, cwd=directory, timeout=command_timeout(command))
+    except FileNotFoundError:
+        print("Error: git not found. Is Git installed and in your PATH?")
+        return False
+    if not result.ok:
         print(f"Error during Git command: {' '.join(command)}")
-        print(f"Stdout:\n{e.stdout}")
-        print(f"Stderr:\n{e.stderr}")
+        print(result.error_report())
         return False
+    return True
 
 def write_file(path, content):
-    """Helper to write content to a file, creating directories if needed."""
-    try:
-        dir_name = os.path.dirname(path)
-        if dir_name:
-            os.makedirs(dir_name, exist_ok=True)
-        with open(path, "w") as f:
-            f.write(content)
-        print(f"Created {path}")
-    except IOError as e:
-        print(f"Error writing file {path}: {e}")
-        exit(1)
+    """Stages content for path in WORKSPACE; nothing touches disk until commit_workspace()."""
+    with span(f"stage {path}", "file", bytes=len(content)):
+        WORKSPACE.stage(path, content)
+    print(f"Staged {path}")
 
 def read_file(path):
-    """Helper to read content from a file."""
+    """Helper to read content from a file, seeing staged content first."""
     try:
-        with open(path, "r") as f:
-            return f.read()
-    except FileNotFoundError:
-        return ""
+        content = WORKSPACE.read(path)
     except IOError as e:
         print(f"Error reading file {path}: {e}")
         exit(1)
+    return "" if content is None else content
 
-def extract_code_block(response, block_name, language):
-    """Extracts a specific code block from the AI's response."""
-    if block_name:
-        pattern = re.compile(rf"^\s*###\s*{re.escape(block_name)}\s*{re.escape(language)}\s*\n```(?:{language})?\n(.*?)\n^\s*```", re.DOTALL | re.MULTILINE)
-    else:
-        pattern = re.compile(rf"```(?:{language})?\n(.*?)\n```", re.DOTALL)
+def commit_workspace(paths=None, contents=None):
+    """
+    Writes the staged files (all, or just paths) to disk. Each changed file goes through
+    a temp file and rename; files whose content is unchanged are not touched at all.
+    contents: see Workspace.commit().
+    """
+    try:
+        with span("commit workspace", "file") as commit_span:
+            written, unchanged = WORKSPACE.commit(paths, contents)
+            commit_span.set(written=len(written), unchanged=len(unchanged))
+    except OSError as e:
+        print(f"Error writing generated files: {e}")
+        exit(1)
+    for path in written:
+        print(f"Created {path}")
+    if unchanged:
+        print(f"Unchanged: {', '.join(unchanged)}")
+    return written
 
-    match = pattern.search(response)
-    if match:
-        return textwrap.dedent(match.group(1)).strip()
-    return None
+def check_terraform_syntax(path, content):
+    """Runs `terraform fmt -` on HCL content so syntax errors surface before it is written."""
+    try:
+        result = run_command(["terraform", "fmt", "-"], input_text=content, echo=False, capture_stdout=True,
+                             timeout=command_timeout(["terraform", "fmt"]))
+    except FileNotFoundError:
+        return True
+    if not result.ok:
+        print(f"Warning: terraform fmt found syntax errors in streamed {path}:\n{''.join(result.stderr_tail)}")
+        return False
+    print(f"Syntax check passed for streamed {path}")
+    return True
 
-def extract_multiple_code_blocks(response, file_language_map):
+def commit_streamed_file(path, content):
+    """Writes a streamed file to disk unless a re-prompt has staged newer content for it since."""
+    commit_workspace([path], {path: content})
+
+def check_and_commit_streamed_file(path, content):
+    if check_terraform_syntax(path, content):
+        commit_streamed_file(path, content)
+
+def emit_files(file_language_map, emitted, checks):
     """
-    Extracts multiple named code blocks from the AI's response based on a map.
-    file_language_map = {
-        "filename.ext": "language",
-        "another_file.ext": "another_language"
-    }
+    Returns an on_block callback for generate_text() that writes each expected file to disk
+    as soon as its closing fence arrives; .tf files are written once `terraform fmt` accepts
+    them, on a background check (whose future is appended to checks). Files written this way
+    reach disk before the stage's full validation; if that fails, the re-prompt replaces them.
+    Emitted paths are recorded in the emitted dict (path -> content).
     """
-    extracted_blocks = {}
-    for filename, language in file_language_map.items():
-        pattern = re.compile(rf"^\s*###\s*{re.escape(filename)}\s*{re.escape(language)}\s*\n```(?:{language})?\n(.*?)\n^\s*```", re.DOTALL | re.MULTILINE)
-        match = pattern.search(response)
-        if match:
-            extracted_blocks[filename] = textwrap.dedent(match.group(1)).strip()
+    def on_block(path, language, content):
+        if file_language_map.get(path) != language or path in emitted or not content:
+            return
+        write_file(path, content)
+        emitted[path] = content
+        if path.endswith(".tf"):
+            checks.append(STREAM_CHECKS.submit(check_and_commit_streamed_file, path, content))
         else:
-            print(f"Warning: Could not find code block for {filename} ({language}) in AI response.")
-            extracted_blocks[filename] = None
-    return extracted_blocks
+            commit_streamed_file(path, content)
+    return on_block
+
+def api_token_counter(prompt):
+    """Exact prompt size from the model's count_tokens API (--count-tokens api), else an estimate."""
+    try:
+        return LLM_BACKEND.count_tokens(prompt)
+    except Exception as e:
+        print(f"Warning: count_tokens failed ({e}); estimating instead.")
+        return estimate_tokens(prompt)
+
+def request_config(candidate=0):
+    """The generation config for the current output format; extra candidates sample hotter."""
+    config = json_generation_config(generation_config) if OUTPUT_FORMAT == "json" else generation_config
+    return dict(config, temperature=CANDIDATE_TEMPERATURE) if candidate else config
+
+def response_key(prompt, candidate=0):
+    """LLM cache key of a prompt's response; every candidate gets its own entry."""
+    config = request_config(candidate)
+    return cache_key(MODEL_NAME, dict(config, candidate=candidate) if candidate else config, prompt)
+
+def generate_text(prompt, on_block=None, stage=None, candidate=0, expected=()):
+    """
+    Sends a prompt to Gemini and returns the full response text, served from LLM_CACHE when possible.
+    With --stream, the response is consumed chunk by chunk and on_block(path, language, content)
+    is called for every named code block as soon as it completes; expected lists the requested paths.
+    Prompts are checked against TOKEN_BUDGET before sending (and may be compressed to fit);
+    the cache is keyed by the prompt as built.
+    """
+    with span(f"llm {stage or 'prompt'}", "llm", stage=stage, candidate=candidate, prompt_chars=len(prompt)) as llm_span:
+        config = request_config(candidate)
+        key = response_key(prompt, candidate)
+        cached = LLM_CACHE.get(key)
+        if cached is not None:
+            print(f"Using cached Gemini response ({key[:12]})")
+            llm_span.set(cached=True, response_chars=len(cached))
+            return cached
+
+        prompt, prompt_tokens = TOKEN_BUDGET.fit(stage or "prompt", prompt)
+        llm_span.set(prompt_tokens=prompt_tokens, sent_chars=len(prompt))
+        streamed = bool(STREAM_RESPONSES and on_block)
+        waited = time.monotonic()
+        with LLM_SLOTS if LLM_SLOTS is not None else contextlib.nullcontext():
+            llm_span.set(queue_seconds=round(time.monotonic() - waited, 3) if LLM_SLOTS is not None else None)
+            if not streamed:
+                response, call_stats = call_model(prompt, config, stage or "prompt", llm_span)
+                text = response.text
+                usage = response.usage
+            else:
+                parser = StreamingBlockParser(expected)
+                chunks = []
+                usage = {}
+                for chunk in LLM_BACKEND.stream(prompt, config, usage):
+                    chunks.append(chunk)
+                    for block in parser.feed(chunk):
+                        on_block(*block)
+                for block in parser.close():
+                    on_block(*block)
+                text = "".join(chunks)
+                call_stats = LLM_BACKEND.last_call() if hasattr(LLM_BACKEND, "last_call") else {}
+
+        llm_span.set(cached=False, streamed=streamed, response_chars=len(text), **usage, **call_stats)
+        TOKEN_BUDGET.record(stage or "prompt", prompt_tokens, text, usage)
+        LLM_CACHE.put(key, text, model_name=MODEL_NAME)
+        return text
+
+def call_model(prompt, config, stage, llm_span):
+    """
+    One non-streamed model call; returns (response, client metrics). Its latency goes into
+    LATENCY_HISTORY. With --hedge, a call still running after the stage's --hedge-percentile
+    latency gets a duplicate request and the first response wins (see hedging.py).
+    """
+    def call():
+        response = LLM_BACKEND.generate(prompt, config)
+        return response, LLM_BACKEND.last_call() if hasattr(LLM_BACKEND, "last_call") else {}
+
+    threshold = LATENCY_HISTORY.threshold(stage, HEDGE_PERCENTILE) if HEDGE else None
+    if threshold is None:
+        started = time.monotonic()
+        result = call()
+        LATENCY_HISTORY.record(stage, time.monotonic() - started)
+        HEDGE_STATS.add(False, False)
+        return result
+    abandoned = threading.Event()
+
+    def hedged_request():
+        # The losing request must not print or count into stats once the call has returned.
+        if hasattr(LLM_BACKEND, "set_cancel_check"):
+            LLM_BACKEND.set_cancel_check(abandoned.is_set)
+        return call()
+
+    result, hedged, hedge_won = hedged_call(hedged_request, threshold,
+                                            lambda seconds: LATENCY_HISTORY.record(stage, seconds),
+                                            label=stage, abandoned=abandoned)
+    HEDGE_STATS.add(hedged, hedge_won)
+    llm_span.set(hedge_threshold=round(threshold, 3), hedged=hedged, hedge_won=hedge_won)
+    return result
+
+def extract_blocks(response, file_language_map, stage):
+    """extract_multiple_code_blocks() recorded as an "extract" span."""
+    with span(f"extract {stage}", "extract", stage=stage, response_chars=len(response or ""),
+              files=len(file_language_map)):
+        return extract_multiple_code_blocks(response, file_language_map)
+
+# Re-requests allowed for files missing or malformed in a JSON response
+JSON_RETRIES = 2
+
+def files_prompt(prompt, file_language_map):
+    """The prompt as sent: in JSON mode, with the output format override appended."""
+    return prompt + json_instructions(file_language_map) if OUTPUT_FORMAT == "json" else prompt
+
+def request_files(prompt, file_language_map, stage, on_block=None, candidate=0):
+    """
+    Sends a prompt and returns {path: content or None} for the requested files.
+    In JSON mode the response is decoded against the files schema, and files that are missing
+    or malformed are re-requested on their own (up to JSON_RETRIES times). Nothing is
+    streamed to on_block in JSON mode.
+    """
+    if OUTPUT_FORMAT != "json":
+        return extract_blocks(generate_text(prompt, on_block=on_block, stage=stage, candidate=candidate,
+                                            expected=file_language_map), file_language_map, stage)
+    blocks = {path: None for path in file_language_map}
+    wanted = dict(file_language_map)
+    attempt_prompt = files_prompt(prompt, wanted)
+    for attempt in range(JSON_RETRIES + 1):
+        response = generate_text(attempt_prompt, stage=stage, candidate=candidate)
+        with span(f"decode {stage}", "extract", stage=stage, response_chars=len(response or ""), files=len(wanted)):
+            decoded, problems = decode_files(response, wanted)
+        blocks.update((path, content) for path, content in decoded.items() if content is not None)
+        wanted = {path: language for path, language in wanted.items() if blocks[path] is None}
+        if not wanted:
+            break
+        print(f"JSON response for {stage} had problems:")
+        for problem in problems:
+            print(f"  - {problem}")
+        LLM_CACHE.discard(response_key(attempt_prompt, candidate))
+        if attempt < JSON_RETRIES:
+            print(f"Re-requesting {', '.join(wanted)} ({attempt + 1}/{JSON_RETRIES})...")
+            attempt_prompt = build_prompt_retry(prompt, wanted, problems)
+    for path, language in wanted.items():
+        print(f"Warning: Could not find {path} ({language}) in the JSON response.")
+    return blocks
+
+# Re-prompts allowed per stage when generated Terraform fails pre-validation
+MAX_REPROMPTS = 2
+
+def validate_generated_files(stage, blocks):
+    """
+    Runs the in-process HCL checks and the stage's prompt contracts, loads YAML files (when
+    PyYAML is installed) and, with --terraform-validate, runs `terraform validate` on the
+    Terraform files. Returns 'path: problem' strings.
+    """
+    problems = []
+    for path, contract in FILE_CONTRACTS.get(stage, {}).items():
+        if blocks.get(path):
+            with span(f"validate {path}", "validate", stage=stage):
+                problems.extend(f"{path}: {problem}" for problem in validate_hcl(blocks[path], contract))
+    for path, content in blocks.items():
+        if content and path.endswith((".yml", ".yaml")):
+            problems.extend(f"{path}: {problem}" for problem in validate_yaml(content))
+    if TERRAFORM_VALIDATE and not problems:
+        with span(f"terraform validate {stage}", "validate", stage=stage):
+            problems.extend(terraform_validate(blocks))
+    return problems
+
+def validate_yaml(content):
+    """YAML load check; skipped when PyYAML is not installed."""
+    try:
+        import yaml
+    except ImportError:
+        return []
+    try:
+        yaml.safe_load(content)
+    except yaml.YAMLError as e:
+        return [f"invalid YAML: {e}"]
+    return []
+
+def terraform_validate(blocks):
+    """
+    Runs `terraform init -backend=false` and `terraform validate` on each directory's generated
+    .tf files in a scratch copy, together with the directory's other staged or existing .tf files.
+    Returns 'path: problem' strings; an empty list when terraform is not installed.
+    """
+    problems = []
+    generated = {path: content for path, content in blocks.items() if path.endswith(".tf") and content}
+    for directory in sorted({os.path.dirname(path) for path in generated}):
+        files = {}
+        for path in glob.glob(os.path.join(directory or ".", "*.tf")) + WORKSPACE.staged_paths():
+            path = os.path.normpath(path)
+            if path.endswith(".tf") and os.path.dirname(path) == directory:
+                files[path] = WORKSPACE.read(path)
+        files.update((path, content) for path, content in generated.items() if os.path.dirname(path) == directory)
+        scratch = tempfile.mkdtemp(prefix="tf-validate-")
+        try:
+            for path, content in files.items():
+                with open(os.path.join(scratch, os.path.basename(path)), "w") as f:
+                    f.write(content or "")
+            try:
+                with file_lock(os.path.join(plugin_cache_dir(), ".init.lock"), "the provider cache"):
+                    init = run_command(["terraform", "init", "-backend=false", "-input=false", "-no-color"], cwd=scratch,
+                                       env=terraform_env(), echo=False, timeout=command_timeout(["terraform", "init"]))
+                if not init.ok:
+                    problems.append(f"{directory or '.'}: terraform init failed: {''.join(init.stderr_tail).strip()}")
+                    continue
+                result = run_command(["terraform", "validate", "-json", "-no-color"], cwd=scratch, env=terraform_env(),
+                                     echo=False, capture_stdout=True, timeout=command_timeout(["terraform", "validate"]))
+            except FileNotFoundError:
+                return []
+            try:
+                diagnostics = json.loads(result.stdout).get("diagnostics", [])
+            except (ValueError, AttributeError):
+                diagnostics = [] if result.ok else [{"severity": "error", "summary": "".join(result.stderr_tail).strip()}]
+            for diagnostic in diagnostics:
+                if diagnostic.get("severity") != "error":
+                    continue
+                location = diagnostic.get("range") or {}
+                path = os.path.join(directory, location["filename"]) if location.get("filename") else directory or "."
+                line = f":{location['start']['line']}" if location.get("start") else ""
+                detail = f": {diagnostic['detail']}" if diagnostic.get("detail") else ""
+                problems.append(f"{path}{line}: terraform validate: {diagnostic.get('summary')}{detail}")
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return problems
+
+def generate_candidate(prompt, file_language_map, stage, candidate, on_block=None, postprocess=None, stop=None):
+    """
+    One candidate for a stage: request, extract, postprocess. Returns (blocks, validation problems).
+    Once the stop event is set (another candidate won), the response is cached but not validated.
+    """
+    blocks = request_files(prompt, file_language_map, stage, on_block=on_block, candidate=candidate)
+    if stop is not None and stop.is_set():
+        return blocks, ["abandoned: another candidate passed validation first"]
+    if postprocess:
+        blocks = postprocess(blocks)
+    return blocks, validate_generated_files(stage, blocks)
+
+def best_of_candidates(prompt, file_language_map, stage, postprocess=None):
+    """
+    Requests CANDIDATES candidates concurrently and returns (blocks, problems, candidate) for the
+    first one that has every file and passes validation. Candidates not started yet are cancelled;
+    those in flight are waited for, so none outlives the step (a request cannot be cancelled), but
+    they skip validation and their responses are only cached. If none passes, returns the one with
+    the fewest problems.
+    """
+    print(f"Requesting {CANDIDATES} candidates for {stage}...")
+    stop = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=CANDIDATES, thread_name_prefix=f"candidate-{stage}")
+    futures = {executor.submit(generate_candidate, prompt, file_language_map, stage, candidate, None, postprocess,
+                               stop): candidate
+               for candidate in range(CANDIDATES)}
+    outcomes = []
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            candidate = futures[future]
+            try:
+                blocks, problems = future.result()
+            except TokenBudgetExceeded:
+                raise  # every candidate sends the same prompt
+            except Exception as e:
+                print(f"Candidate {candidate + 1} for {stage} failed: {e}")
+                continue
+            missing = [f"{path}: missing from the response" for path, content in blocks.items() if not content]
+            if not problems and not missing:
+                print(f"Candidate {candidate + 1}/{CANDIDATES} for {stage} passed validation.")
+                return blocks, problems, candidate
+            outcomes.append((len(problems) + len(missing), candidate, blocks, problems))
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+    if not outcomes:
+        print(f"Error: Every candidate for {stage} failed. Exiting.")
+        exit(1)
+    _, candidate, blocks, problems = min(outcomes, key=lambda outcome: outcome[:2])
+    return blocks, problems, candidate
+
+def generate_files(prompt, file_language_map, stage, emitted, emit_map=None, postprocess=None):
+    """
+    Generates a stage's files and pre-validates the Terraform ones before anything runs them.
+    On problems, the prompt is re-sent with the problems listed (up to MAX_REPROMPTS times) and
+    the rejected response is dropped from the cache. Exits if the files still fail.
+    Args:
+        emit_map (dict, optional): Files to write mid-stream, defaults to file_language_map.
+        postprocess (callable, optional): Rewrites the extracted blocks before validation.
+    """
+    attempt_prompt = prompt
+    for attempt in range(MAX_REPROMPTS + 1):
+        candidate = 0
+        if CANDIDATES > 1:
+            blocks, problems, candidate = best_of_candidates(attempt_prompt, file_language_map, stage, postprocess)
+        else:
+            checks = []
+            blocks, problems = generate_candidate(
+                attempt_prompt, file_language_map, stage, 0,
+                on_block=emit_files(file_language_map if emit_map is None else emit_map, emitted, checks),
+                postprocess=postprocess)
+            # The streamed files' syntax checks overlapped the stream; don't let them outlive the stage.
+            concurrent.futures.wait(checks)
+        if not problems:
+            return blocks
+        print(f"Generated files for {stage} failed validation:")
+        for problem in problems:
+            print(f"  - {problem}")
+        LLM_CACHE.discard(response_key(files_prompt(attempt_prompt, file_language_map), candidate))
+        emitted.clear()
+        if attempt < MAX_REPROMPTS:
+            print(f"Re-prompting ({attempt + 1}/{MAX_REPROMPTS})...")
+            attempt_prompt = build_prompt_fix(prompt, problems)
+    print(f"Error: Generated files for {stage} still fail validation after {MAX_REPROMPTS} re-prompt(s). Exiting.")
+    exit(1)
 
 
 # --- Prompts for Gemini ---
 
 # Prompt 1: Terraform Backend
-prompt_backend = f"""
+def build_prompt_backend(backend_names):
+    state_bucket = backend_names["state_bucket"]
+    lock_table = backend_names["lock_table"]
+    return f"""
 You are an expert DevOps engineer.
 Generate only the necessary Terraform configuration for the `backend-bootstrap/backend.tf` file.
 This file should define **ONLY** the AWS resources (`aws_s3_bucket`, `aws_dynamodb_table`, and `aws_s3_bucket_public_access_block`) needed to create an S3 bucket and DynamoDB table to store the Terraform state and lock it.
 **IMPORTANT: DO NOT include a `terraform {{ backend ... }}` block or any `provider` block in this file.** This file's sole purpose is to define resources to be created, not to configure Terraform's own state backend or AWS provider.
 Ensure S3 bucket versioning and server-side encryption (AES256) are enabled.
 **For public access blocking, create a separate `aws_s3_bucket_public_access_block` resource and explicitly link it to the S3 state bucket.** Make sure to block all public access settings (block_public_acls, block_public_policy, ignore_public_acls, restrict_public_buckets). DO NOT configure public access blocking directly within the `aws_s3_bucket` resource itself.
-The DynamoDB table should be named `{DDB_LOCK_TABLE_NAME}` and have `LockID` as the primary key with PAY_PER_REQUEST billing mode.
-The S3 bucket should be named `{S3_STATE_BUCKET_NAME}`.
+The DynamoDB table should be named `{lock_table}` and have `LockID` as the primary key with PAY_PER_REQUEST billing mode.
+The S3 bucket should be named `{state_bucket}`.
 The S3 bucket should also have `force_destroy = true` for easy cleanup in development.
 **Include Terraform output blocks for the S3 bucket name (named `terraform_state_bucket_name`) and the DynamoDB table name (named `terraform_lock_table_name`).**
 Output must be in this exact format:
@@ -166,7 +600,10 @@ Output must be in this exact format:
 """
 
 # Prompt 2: Core Infrastructure (VPC, Subnets, Security Groups, IAM)
-prompt_core_infra = f"""
+def build_prompt_core_infra(backend_names):
+    state_bucket = backend_names["state_bucket"]
+    lock_table = backend_names["lock_table"]
+    return f"""
 You are an expert DevOps engineer.
 Generate the initial Terraform configuration for main.tf and variables.tf files.
 These files should define:
@@ -185,7 +622,7 @@ IAM role and policy for the Lambda function with basic execution permissions (Cl
 
 An S3 bucket for storing the Lambda deployment package (e.g., {PROJECT_NAME}-lambda-code-${{data.aws_caller_identity.current.account_id}}).
 
-The main.tf should also contain the Terraform backend configuration, referencing the S3 bucket {S3_STATE_BUCKET_NAME} and DynamoDB table {DDB_LOCK_TABLE_NAME} created in the previous step.
+The main.tf should also contain the Terraform backend configuration, referencing the S3 bucket {state_bucket} and DynamoDB table {lock_table} created in the previous step.
 
 Variables for aws_region (default: {AWS_REGION}), project_name (default: {PROJECT_NAME}), and environment (default: development).
 
@@ -207,15 +644,10 @@ Output must be in this exact format, providing both files:
 """
 
 # Prompt 3: Update main.tf with Lambda and ALB
-prompt_update_main_tf = f"""
-You are an expert DevOps engineer.
-Here is the current content of my main.tf file:
-
-```hcl
-{{current_main_tf_content}}
-```
-
-Please update this main.tf file to include the AWS Lambda function and the Application Load Balancer (ALB).
+# The requirement and source-file sections are shared with the edit-mode prompt below.
+# Like the prompts themselves, they are f-strings that still go through .format().
+def lambda_alb_requirements():
+    return f"""Please update this main.tf file to include the AWS Lambda function and the Application Load Balancer (ALB).
 
 For the Lambda function:
 
@@ -251,14 +683,10 @@ Grant the ALB permission to invoke the Lambda function using aws_lambda_permissi
 
 Add an alb_dns_name output.
 
-Output the complete, updated main.tf file content in the following format:
-
-### main.tf hcl
-```hcl
-# Updated main.tf code goes here
-```
+"""
 
-### src/index.js javascript
+def lambda_src_format():
+    return """### src/index.js javascript
 ```javascript
 // Node.js Lambda code
 ```
@@ -269,8 +697,58 @@ Output the complete, updated main.tf file content in the following format:
 ```
 """
 
+def build_prompt_update_main_tf(current_main_tf_content):
+    return (f"""
+You are an expert DevOps engineer.
+Here is the current content of my main.tf file:
+
+```hcl
+{{current_main_tf_content}}
+```
+
+""" + lambda_alb_requirements() + """Output the complete, updated main.tf file content in the following format:
+
+### main.tf hcl
+```hcl
+# Updated main.tf code goes here
+```
+
+""" + lambda_src_format()).format(current_main_tf_content=current_main_tf_content)
+
+# Prompt 3 (edit mode): only the block index of main.tf goes out, and only changed blocks come back
+def build_prompt_edit_main_tf(current_main_tf_content):
+    return (f"""
+You are an expert DevOps engineer.
+My main.tf file defines these top-level blocks (contents omitted):
+
+```hcl
+{{block_index}}
+```
+
+""" + lambda_alb_requirements() + """Do not repeat the whole file. Output only the blocks to add or change, each one complete,
+in a single main.tf.edits block. A block with the same type and labels as an existing block
+replaces it; any other block is added. To remove a block, write a line '# delete <type>.<labels>',
+e.g. '# delete resource.aws_instance.old'. Use the following format:
+
+### main.tf.edits hcl
+```hcl
+# New and replaced main.tf blocks go here
+```
+
+""" + lambda_src_format()).format(block_index=block_index(current_main_tf_content))
+
+def build_prompt_lambda_alb(current_main_tf_content):
+    """The Lambda/ALB prompt for the current mode (--edit-mode or the full main.tf)."""
+    if EDIT_MODE:
+        try:
+            return build_prompt_edit_main_tf(current_main_tf_content)
+        except HclParseError:
+            pass  # step_lambda_alb reports this and sends the whole file
+    return build_prompt_update_main_tf(current_main_tf_content)
+
 # Prompt 4: GitHub Actions Workflow
-prompt_github_actions = f"""
+def build_prompt_github_actions():
+    return f"""
 You are an expert DevOps engineer.
 Generate the GitHub Actions workflow file for .github/workflows/deploy.yml.
 This workflow should:
@@ -285,7 +763,7 @@ Set up Node.js (v18.x).
 
 Install Node.js dependencies (e.g., npm install in src/).
 
-Package the Node.js application from src/ into a lambda.zip file. The src directory contains index.js. Use zip -r lambda.zip . from inside the src directory.
+Package the Node.js application from src/ into lambda.zip with python3 lambda_package.py src --output lambda.zip (lambda_package.py is in the repository root). It builds a reproducible zip (fixed timestamps and ordering, no dev dependencies) and prints "source_code_hash: <base64 sha256>"; pass that value to Terraform instead of running zip and sha256sum.
 
 Set up Terraform using hashicorp/setup-terraform@v2.
 
@@ -293,11 +771,11 @@ Configure AWS credentials using OIDC for an IAM role named arn:aws:iam::${{{{ se
 
 Run terraform init (ensuring it uses the S3 backend and DynamoDB lock table, region {AWS_REGION}).
 
-Run terraform plan.
+Run terraform plan -input=false -out=tfplan -detailed-exitcode in a step with id plan, recording the exit code (0 = no changes, 1 = error, 2 = changes) as a step output without failing the job on exit code 2.
 
-Run terraform apply -auto-approve.
+Run terraform apply -input=false tfplan only when the plan step reported changes (exit code 2), so the saved plan is applied without planning again and no-change pushes skip apply.
 
-The lambda.zip file should be uploaded to the S3 bucket created by Terraform (you can use aws s3 cp or ensure Terraform's aws_lambda_function resource uploads it from the local path). Ensure the Lambda source_code_hash is updated dynamically during packaging.
+The lambda.zip file should be uploaded to the S3 bucket created by Terraform with python3 lambda_package.py src --output lambda.zip --upload s3://<bucket>/lambda.zip, which skips the upload when the object already carries the same source_code_hash. An unchanged package must leave source_code_hash unchanged so the Lambda function is not updated.
 
 Output must be in this exact format:
 
@@ -307,191 +785,861 @@ Output must be in this exact format:
 ```
 """
 
-# --- Main Script Execution ---
-def main():
-    # Step 1: Load .env (already done at the top)
-    api_key = os.getenv("GEMINI_API_KEY")
+# Prompt 5: Re-prompt after generated files fail pre-validation
+def build_prompt_fix(prompt, problems):
+    problem_list = "\n".join(f"- {problem}" for problem in problems)
+    return f"""{prompt}
+Your previous answer to this request had these problems:
+{problem_list}
+Fix them and output all of the requested files again, complete, in the same format.
+"""
 
-    if not api_key:
-        print("GEMINI_API_KEY not found. Please check your .env file and ensure it contains GOOGLE_API_KEY=YOUR_KEY.")
+# What each stage's prompt promises about the Terraform files it returns, checked in-process
+# right after extraction (see validate_generated_files)
+LAMBDA_ALB_CONTRACT = Contract(
+    required=["terraform.backend", "resource.aws_vpc", "resource.aws_lambda_function",
+              "resource.aws_lb|resource.aws_alb", "resource.aws_lb_target_group|resource.aws_alb_target_group",
+              "resource.aws_lb_listener|resource.aws_alb_listener", "resource.aws_lambda_permission",
+              "output.alb_dns_name"],
+)
+FILE_CONTRACTS = {
+    "backend": {
+        "backend-bootstrap/backend.tf": Contract(
+            required=["resource.aws_s3_bucket", "resource.aws_dynamodb_table", "resource.aws_s3_bucket_public_access_block",
+                      "output.terraform_state_bucket_name", "output.terraform_lock_table_name"],
+            forbidden=["provider", "terraform.backend"],
+        ),
+    },
+    "core_infra": {
+        "main.tf": Contract(
+            required=["terraform.backend", "resource.aws_vpc", "resource.aws_subnet", "resource.aws_internet_gateway",
+                      "resource.aws_security_group", "resource.aws_iam_role", "resource.aws_s3_bucket",
+                      "data.aws_caller_identity"],
+            forbidden=["resource.aws_lambda_function", "resource.aws_lb", "resource.aws_alb"],
+        ),
+        "variables.tf": Contract(
+            required=["variable.aws_region", "variable.project_name", "variable.environment"],
+            allowed_types=["variable"],
+        ),
+    },
+    "lambda_alb": {"main.tf": LAMBDA_ALB_CONTRACT},
+    "lambda_alb_edits": {"main.tf": LAMBDA_ALB_CONTRACT},
+}
+
+# --- Pipeline Steps ---
+# Each step receives a dict with the results of the steps listed as its inputs.
+
+PLACEHOLDER_INDEX_JS = 'exports.handler = async (event) => {\n  console.log("Lambda invoked with event:", JSON.stringify(event, null, 2));\n  return {\n    statusCode: 200,\n    headers: { "Content-Type": "application/json" },\n    body: JSON.stringify({ message: "My name is pankaj" }),\n  };\n};\n'
+PLACEHOLDER_PACKAGE_JSON = '{\n  "name": "my-nodejs-app",\n  "version": "1.0.0",\n  "description": "A simple Node.js Lambda app",\n  "main": "index.js",\n  "scripts": {\n    "test": "echo \\"Error: no test specified\\" && exit 1"\n  },\n  "keywords": [],\n  "author": "",\n  "license": "ISC"\n}\n'
+
+def step_backend_names(inputs):
+    """
+    Step 4.0: Pick the S3 state bucket and DynamoDB lock table names for this run.
+    An already bootstrapped backend (registry file or backend-bootstrap outputs) is reused,
+    in which case the backend generation and bootstrap apply are skipped.
+    """
+    if not FORCE_NEW_BACKEND:
+        existing = find_existing_backend(PROJECT_NAME, AWS_REGION, "backend-bootstrap", BACKEND_REGISTRY_PATH)
+        if existing:
+            print(f"Reusing existing state backend: {existing['state_bucket']} / {existing['lock_table']}")
+            return dict(existing, existing=True)
+    return dict(new_backend_names(), existing=False)
+
+def step_backend(inputs):
+    """Step 4.1: Generate backend-bootstrap/backend.tf."""
+    if inputs["backend_names"]["existing"]:
+        print("Skipping backend-bootstrap/backend.tf generation (backend already exists).")
+        return None
+    print("\n--- Sending prompt for backend-bootstrap/backend.tf ---")
+    emitted = {}
+    backend_tf_content = generate_files(build_prompt_backend(inputs["backend_names"]),
+                                        {"backend-bootstrap/backend.tf": "hcl"}, "backend", emitted)["backend-bootstrap/backend.tf"]
+    if not backend_tf_content:
+        print("Failed to generate backend-bootstrap/backend.tf. Exiting.")
         exit(1)
-
-    # Step 2: Configure Gemini (already done at top)
-
-    # Step 3: Create all necessary directories upfront
-    print("Creating project directories...")
-    os.makedirs(".github/workflows", exist_ok=True)
-    os.makedirs("backend-bootstrap", exist_ok=True)
-    os.makedirs("src", exist_ok=True)
-    print("Directories created.")
-
-    # Step 4.1: Generate backend-bootstrap/backend.tf
-    # Step 4.1: Generate backend-bootstrap/backend.tf
-    backend_tf_content = extract_code_block(model.generate_content(prompt_backend, generation_config=generation_config).text, "backend-bootstrap/backend.tf", "hcl")
-
-    # Step 4.2: Run Terraform init + apply for backend only
+    if "backend-bootstrap/backend.tf" not in emitted:
+        write_file("backend-bootstrap/backend.tf", backend_tf_content)
+    return backend_tf_content
+
+def step_backend_apply(inputs):
+    """Step 4.2: Run Terraform init + apply for backend only."""
+    backend_names = inputs["backend_names"]
+    if backend_names["existing"]:
+        print("Skipping Terraform backend init/apply (backend already exists).")
+        return True
     print("\n--- Running Terraform backend init/apply ---")
+    commit_workspace(["backend-bootstrap/backend.tf"])
 
-    if not run_terraform_command("terraform init", directory="backend-bootstrap"):
+    if not run_terraform_init("backend-bootstrap"):
         print("Terraform backend init failed. Exiting.")
         exit(1)
 
-    if not run_terraform_command("terraform apply -auto-approve", directory="backend-bootstrap"):
-        print("Terraform backend apply failed. Exiting.")
-        exit(1)
+    run_terraform_plan_apply("backend-bootstrap")
     print("Terraform backend setup complete. S3 bucket and DynamoDB table for state have been created.")
+    with registry_lock(BACKEND_REGISTRY_PATH):
+        register_backend(PROJECT_NAME, AWS_REGION, backend_names, BACKEND_REGISTRY_PATH)
+    return True
 
-    # Step 4.3: Generate initial main.tf and variables.tf
+def step_core_infra(inputs):
+    """Step 4.3: Generate initial main.tf and variables.tf."""
     print("\n--- Sending prompt for main.tf and variables.tf (initial infrastructure) ---")
     try:
-        response_core_infra = model.generate_content(prompt_core_infra, generation_config=generation_config).text
-        extracted_infra_blocks = extract_multiple_code_blocks(
-            response_core_infra,
-            {
-                "main.tf": "hcl",
-                "variables.tf": "hcl"
-            }
-        )
+        core_infra_files = {
+            "main.tf": "hcl",
+            "variables.tf": "hcl"
+        }
+        emitted = {}
+        extracted_infra_blocks = generate_files(build_prompt_core_infra(inputs["backend_names"]),
+                                                core_infra_files, "core_infra", emitted)
 
         main_tf_content_initial = extracted_infra_blocks.get("main.tf")
         variables_tf_content = extracted_infra_blocks.get("variables.tf")
 
         if main_tf_content_initial and variables_tf_content:
-            write_file("main.tf", main_tf_content_initial)
-            write_file("variables.tf", variables_tf_content)
+            if "main.tf" not in emitted:
+                write_file("main.tf", main_tf_content_initial)
+            if "variables.tf" not in emitted:
+                write_file("variables.tf", variables_tf_content)
         else:
             print("Warning: Could not extract both main.tf and variables.tf from core infra response.")
-            print("AI Response was:\n", response_core_infra)
             exit(1)
+    except TokenBudgetExceeded:
+        raise  # reported with the budget summary by run_generation()
     except Exception as e:
         print(f"Error generating core infrastructure files: {e}")
         exit(1)
+    return extracted_infra_blocks
 
-    # Step 4.4: Write src/index.js and package.json (initial hardcoded)
-    write_file(
-        "src/index.js",
-        'exports.handler = async (event) => {\n  console.log("Lambda invoked with event:", JSON.stringify(event, null, 2));\n  return {\n    statusCode: 200,\n    headers: { "Content-Type": "application/json" },\n    body: JSON.stringify({ message: "My name is pankaj" }),\n  };\n};\n'
-    )
-    write_file(
-        "src/package.json",
-        '{\n  "name": "my-nodejs-app",\n  "version": "1.0.0",\n  "description": "A simple Node.js Lambda app",\n  "main": "index.js",\n  "scripts": {\n    "test": "echo \\"Error: no test specified\\" && exit 1"\n  },\n  "keywords": [],\n  "author": "",\n  "license": "ISC"\n}\n'
-    )
+def patch_main_tf(base_content, edits):
+    """
+    Applies resource-level edits from an edit-mode response to main.tf.
+    Returns the patched content, or None if the edits are missing, unparsable or conflict
+    with changes made to main.tf since base_content was sent.
+    """
+    if not edits:
+        print("Error: Could not extract main.tf.edits content from the AI response.")
+        return None
+    current_content = read_file("main.tf") or base_content
+    try:
+        with span("patch main.tf", "edit", edit_chars=len(edits)):
+            return apply_edits(base_content, current_content, edits)
+    except (HclParseError, EditConflict) as e:
+        print(f"Error: Could not apply main.tf edits: {e}")
+        return None
+
+def full_prompt_over_budget(current_main_tf_content):
+    """
+    With --budget-policy compress, True if the whole-main.tf prompt would not fit the lambda_alb
+    budget even compressed; step_lambda_alb then sends only the block index (edit mode).
+    """
+    if TOKEN_BUDGET.policy != "compress":
+        return False
+    prompt = compress_prompt(files_prompt(build_prompt_update_main_tf(current_main_tf_content),
+                                          {"main.tf": "hcl", "src/index.js": "javascript", "src/package.json": "json"}))
+    if not TOKEN_BUDGET.over_budget("lambda_alb", prompt):
+        return False
+    print("The complete main.tf does not fit the lambda_alb token budget; switching to edit mode.")
+    return True
 
-    # Step 4.5: Generate updated main.tf with Lambda and ALB (and new src files)
+def step_lambda_alb(inputs):
+    """Step 4.4/4.5: Generate updated main.tf with Lambda and ALB (and src files)."""
     print("\n--- Sending prompt for main.tf, src/index.js, src/package.json (Lambda & ALB) ---")
-    current_main_tf_content = ""
-    if os.path.exists("main.tf"):
-        current_main_tf_content = read_file("main.tf")
+    current_main_tf_content = inputs["core_infra"]["main.tf"]
 
     try:
-        response_lambda_api = model.generate_content(
-            prompt_update_main_tf.format(current_main_tf_content=current_main_tf_content),
-            generation_config=generation_config,
-        ).text
-
-        extracted_lambda_blocks = extract_multiple_code_blocks(
-            response_lambda_api,
-            {
-                "main.tf": "hcl",
-                "src/index.js": "javascript",
-                "src/package.json": "json"
-            }
-        )
+        lambda_files = {
+            "main.tf": "hcl",
+            "src/index.js": "javascript",
+            "src/package.json": "json"
+        }
+        emitted = {}
+        extracted_lambda_blocks = None
+        edit_prompt = None
+        if EDIT_MODE or full_prompt_over_budget(current_main_tf_content):
+            try:
+                edit_prompt = build_prompt_edit_main_tf(current_main_tf_content)
+            except HclParseError as e:
+                print(f"Warning: Cannot index main.tf for edit mode ({e}). Sending the complete file instead.")
+
+        if edit_prompt:
+            src_files = {path: language for path, language in lambda_files.items() if path != "main.tf"}
+
+            def apply_main_tf_edits(blocks):
+                blocks["main.tf"] = patch_main_tf(current_main_tf_content, blocks.pop("main.tf.edits"))
+                return blocks
+
+            extracted_lambda_blocks = generate_files(edit_prompt, dict(src_files, **{"main.tf.edits": "hcl"}),
+                                                     "lambda_alb_edits", emitted, emit_map=src_files,
+                                                     postprocess=apply_main_tf_edits)
+            if extracted_lambda_blocks["main.tf"] is None:
+                print("Falling back to regenerating the complete main.tf.")
+                extracted_lambda_blocks = None
+
+        if extracted_lambda_blocks is None:
+            extracted_lambda_blocks = generate_files(build_prompt_update_main_tf(current_main_tf_content),
+                                                     lambda_files, "lambda_alb", emitted)
 
         updated_main_tf_content = extracted_lambda_blocks.get("main.tf")
         lambda_index_js_content = extracted_lambda_blocks.get("src/index.js")
         lambda_package_json_content = extracted_lambda_blocks.get("src/package.json")
 
         if updated_main_tf_content:
-            write_file("main.tf", updated_main_tf_content)
+            if "main.tf" not in emitted:
+                write_file("main.tf", updated_main_tf_content)
         else:
             print("Error: Could not extract updated main.tf content for Lambda/ALB. Keeping existing main.tf.")
 
         if lambda_index_js_content:
-            write_file("src/index.js", lambda_index_js_content)
+            if "src/index.js" not in emitted:
+                write_file("src/index.js", lambda_index_js_content)
         else:
             print("Warning: Could not extract src/index.js content. Using placeholder.")
+            write_file("src/index.js", PLACEHOLDER_INDEX_JS)
 
         if lambda_package_json_content:
-            write_file("src/package.json", lambda_package_json_content)
+            if "src/package.json" not in emitted:
+                write_file("src/package.json", lambda_package_json_content)
         else:
             print("Warning: Could not extract src/package.json content. Using placeholder.")
+            write_file("src/package.json", PLACEHOLDER_PACKAGE_JSON)
 
+    except TokenBudgetExceeded:
+        raise  # reported with the budget summary by run_generation()
     except Exception as e:
         print(f"An error occurred during Lambda/ALB prompt generation: {e}")
         exit(1)
 
     print("Lambda function, ALB configuration, and source files generated/updated.")
+    return extracted_lambda_blocks
 
-    # Step 4.6: Generate .github/workflows/deploy.yml
+def step_workflow(inputs):
+    """Step 4.6: Generate .github/workflows/deploy.yml."""
     print("\n--- Generating GitHub Actions workflow ---")
     try:
-        response = model.generate_content(prompt_github_actions, generation_config=generation_config).text
-        github_actions_content = extract_code_block(response, ".github/workflows/deploy.yml", "yaml")
+        emitted = {}
+        github_actions_content = generate_files(build_prompt_github_actions(), {".github/workflows/deploy.yml": "yaml"},
+                                                "workflow", emitted)[".github/workflows/deploy.yml"]
         if github_actions_content:
-            write_file(".github/workflows/deploy.yml", github_actions_content)
+            if ".github/workflows/deploy.yml" not in emitted:
+                write_file(".github/workflows/deploy.yml", github_actions_content)
         else:
             print("Failed to generate .github/workflows/deploy.yml. Exiting.")
             exit(1)
+    except TokenBudgetExceeded:
+        raise  # reported with the budget summary by run_generation()
     except Exception as e:
         print(f"Error generating GitHub Actions workflow: {e}")
         exit(1)
+    return github_actions_content
 
-    # Step 4.7: Write .gitignore (hardcoded as per requirement)
-    write_file(
-        ".gitignore",
-        ".env\nnode_modules/\nnpm-debug.log*\nyarn-debug.log*\nyarn-error.log*\n"
-        ".terraform/\n*.tfstate*\n__pycache__/\nlambda.zip\n"
-    )
+GITIGNORE_CONTENT = (
+    ".env\nnode_modules/\nnpm-debug.log*\nyarn-debug.log*\nyarn-error.log*\n"
+    ".terraform/\n*.tfstate*\ntfplan\n__pycache__/\nlambda.zip\n.lambda_package.json\n.llm_cache/\n.run_journal.json\n.llm_latency.json\n"
+    ".runs/\n*.lock\n.daemon_token\n"
+)
 
-    # --- Git Initialization and Push ---
+def step_gitignore(inputs):
+    """Step 4.7: Write .gitignore (hardcoded as per requirement)."""
+    write_file(".gitignore", GITIGNORE_CONTENT)
+    return True
+
+def step_publish(inputs):
+    """Step 5: Initialize Git repo and push to GitHub, one run at a time."""
     print("\n--- Initializing Git repo and pushing to GitHub ---")
+    commit_workspace()
+    with file_lock(PUBLISH_LOCK_PATH, "the publish lock"):
+        return push_to_github()
+
+def rebase_onto_remote_main():
+    """
+    Fetches origin/main and rebases this run's commit onto it, so a run that cloned an older HEAD
+    (e.g. --isolated runs publishing one after another) still pushes as a fast-forward. On
+    conflicting hunks this run's generated files win, as if it had pushed last on its own.
+    """
+    listed = run_command(["git", "ls-remote", "--exit-code", "--heads", "origin", "main"], cwd=os.getcwd(),
+                         echo=False, timeout=command_timeout(["git", "fetch"]))
+    if not listed.ok:
+        return True  # first push, or the remote is unreachable and the push will report it
+    if not run_git_command(["git", "fetch", "origin", "main"], directory=os.getcwd()):
+        print("Git fetch failed. Exiting.")
+        return False
+    if not run_git_command(["git", "rebase", "-X", "theirs", "origin/main"], directory=os.getcwd()):
+        run_command(["git", "rebase", "--abort"], cwd=os.getcwd(), echo=False)
+        print("Could not rebase onto origin/main; resolve it by hand and run `push` again.")
+        return False
+    return True
+
+def push_to_github():
+    """Commits the working tree and pushes it to GITHUB_REPO_URL; called with the publish lock held."""
 
     # Initialize git if not already initialized
     if not os.path.isdir(".git"):
-        try:
-            subprocess.run(["git", "init"], check=True, cwd=os.getcwd())
-            print("Git repository initialized.")
-        except subprocess.CalledProcessError as e:
-            print(f"Error initializing git: {e}")
+        if not run_git_command(["git", "init"], directory=os.getcwd()):
+            print("Git init failed. Exiting.")
             exit(1)
+        print("Git repository initialized.")
 
     # Add remote
-    try:
-        # Check if origin remote already exists
-        subprocess.run(["git", "remote", "get-url", "origin"], check=True, capture_output=True, text=True)
+    # Check if origin remote already exists
+    if run_command(["git", "remote", "get-url", "origin"], cwd=os.getcwd(), echo=False).ok:
         # If it exists, set URL
-        subprocess.run(["git", "remote", "set-url", "origin", GITHUB_REPO_URL], check=True, cwd=os.getcwd())
+        if not run_git_command(["git", "remote", "set-url", "origin", GITHUB_REPO_URL], directory=os.getcwd()):
+            exit(1)
         print(f"Git remote 'origin' set to {GITHUB_REPO_URL}")
-    except subprocess.CalledProcessError:
+    else:
         # If it doesn't exist, add it
-        subprocess.run(["git", "remote", "add", "origin", GITHUB_REPO_URL], check=True, cwd=os.getcwd())
+        if not run_git_command(["git", "remote", "add", "origin", GITHUB_REPO_URL], directory=os.getcwd()):
+            exit(1)
         print(f"Git remote 'origin' added as {GITHUB_REPO_URL}")
 
     # Git operations
     if not run_git_command(["git", "add", "."], directory=os.getcwd()):
         print("Git add failed. Exiting.")
         exit(1)
-    if not run_git_command(["git", "commit", "-m", "AI-generated Lambda deployment infra"], directory=os.getcwd()):
+    if run_command(["git", "diff", "--cached", "--quiet"], cwd=os.getcwd(), echo=False).ok:
+        print("No changes to commit.")
+    elif not run_git_command(["git", "commit", "-m", "AI-generated Lambda deployment infra"], directory=os.getcwd()):
         print("Git commit failed. Exiting.")
         exit(1)
     if not run_git_command(["git", "branch", "-M", "main"], directory=os.getcwd()):
         print("Git branch failed. Exiting.")
         exit(1)
+    if not rebase_onto_remote_main():
+        exit(1)
 
-    try:
-        subprocess.run(["git", "push", "-u", "origin", "main"], check=True, cwd=os.getcwd())
+    if run_git_command(["git", "push", "-u", "origin", "main"], directory=os.getcwd()):
         print("Code pushed to GitHub. CI/CD will trigger now.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error pushing to GitHub: {e}")
+    else:
+        print("Error pushing to GitHub.")
         print("Please ensure your GitHub repository exists, you have push access, and your Git credentials are configured correctly.")
         exit(1)
+    return True
+
+# The generation DAG. The backend apply only gates the final push, so the
+# core infra, Lambda/ALB and workflow prompts run alongside it.
+# Outputs and fingerprints feed the run journal: a resumed run skips a step
+# whose rendered prompt, inputs and output files are unchanged. core_infra
+# does not list main.tf because lambda_alb rewrites it; its journaled result
+# still carries the initial main.tf content.
+PIPELINE_STEPS = [
+    Step("backend_names", step_backend_names,
+         fingerprint=lambda inputs: [PROJECT_NAME, AWS_REGION, FORCE_NEW_BACKEND]),
+    Step("backend", step_backend, inputs=["backend_names"],
+         outputs=["backend-bootstrap/backend.tf"],
+         fingerprint=lambda inputs: build_prompt_backend(inputs["backend_names"])),
+    Step("backend_apply", step_backend_apply, inputs=["backend_names", "backend"],
+         outputs=["backend-bootstrap/terraform.tfstate"]),
+    Step("core_infra", step_core_infra, inputs=["backend_names"],
+         outputs=["variables.tf"],
+         fingerprint=lambda inputs: build_prompt_core_infra(inputs["backend_names"])),
+    Step("lambda_alb", step_lambda_alb, inputs=["core_infra"],
+         outputs=["main.tf", "src/index.js", "src/package.json"],
+         fingerprint=lambda inputs: build_prompt_lambda_alb(inputs["core_infra"]["main.tf"])),
+    Step("workflow", step_workflow,
+         outputs=[".github/workflows/deploy.yml"],
+         fingerprint=lambda inputs: build_prompt_github_actions()),
+    Step("gitignore", step_gitignore,
+         outputs=[".gitignore"],
+         fingerprint=lambda inputs: GITIGNORE_CONTENT),
+    Step("publish", step_publish, inputs=["backend_names", "backend_apply", "lambda_alb", "workflow", "gitignore"],
+         fingerprint=lambda inputs: GITHUB_REPO_URL),
+]
 
-    print("\n--- Deployment Automation Script Finished ---")
-    print("Please check your GitHub Actions workflow for deployment status.")
-    print(f"\nYour S3 state bucket: {S3_STATE_BUCKET_NAME}")
-    print(f"Your DynamoDB lock table: {DDB_LOCK_TABLE_NAME}")
+
+# --- Main Script Execution ---
+# Steps run by each generation subcommand; "all" (the default) runs the whole DAG.
+COMMAND_STEPS = {
+    "all": [step.name for step in PIPELINE_STEPS],
+    "generate": ["backend_names", "backend", "core_infra", "lambda_alb", "workflow", "gitignore"],
+    "bootstrap": ["backend_names", "backend", "backend_apply"],
+}
+COMMANDS = ("all", "generate", "bootstrap", "apply", "package", "push", "batch", "serve", "extract")
+
+def add_generation_args(parser):
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream Gemini responses and write each file to disk as soon as its code block completes "
+                             "(.tf files once terraform fmt accepts them), before the stage's full validation.")
+    parser.add_argument("--output-format", choices=("markdown", "json"), default="markdown",
+                        help="json: ask for schema-constrained JSON ({path, language, content} objects) instead of "
+                             "markdown code blocks, and re-request only the files that come back missing or malformed.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Neither read nor write the on-disk LLM response cache.")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ignore cached LLM responses but store the fresh ones.")
+    parser.add_argument("--new-backend", action="store_true",
+                        help="Bootstrap a new state bucket and lock table even if one is already registered.")
+    parser.add_argument("--edit-mode", action="store_true",
+                        help="Send only main.tf's block index and apply the resource-level edits that come back, "
+                             "instead of resending and regenerating the whole file.")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"Skip steps recorded in {RUN_JOURNAL_PATH} whose inputs and outputs are unchanged.")
+    parser.add_argument("--llm-mode", choices=LLM_MODES, default=None,
+                        help="live: call Gemini; record: call Gemini and save responses; replay: serve saved responses offline. "
+                             "Defaults to $LLM_MODE or live.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the on-disk LLM response cache.")
+    parser.add_argument("--recordings-dir", default=DEFAULT_RECORDINGS_DIR,
+                        help="Where record mode saves responses and replay mode reads them.")
+    parser.add_argument("--llm-rpm", type=float, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="Requests per minute allowed to Gemini (token bucket).")
+    parser.add_argument("--llm-max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help="Gemini calls in flight at once.")
+    parser.add_argument("--llm-max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help="Retries of a throttled (429) or transiently failing (5xx) call.")
+    parser.add_argument("--llm-deadline", type=float, default=DEFAULT_DEADLINE_SECONDS,
+                        help="Seconds one Gemini call may take, including waits and retries.")
+    parser.add_argument("--candidates", type=int, default=1, metavar="N",
+                        help="Request N candidates per stage concurrently and keep the first that passes validation.")
+    parser.add_argument("--candidate-temperature", type=float, default=CANDIDATE_TEMPERATURE,
+                        help="Sampling temperature for the extra candidates.")
+    parser.add_argument("--terraform-validate", action="store_true",
+                        help="Also run `terraform init -backend=false` + `terraform validate` on generated Terraform "
+                             "before accepting it (uses the shared provider cache).")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Send a duplicate request when a call is slower than --hedge-percentile of its stage's "
+                             "recent latencies, and use whichever response arrives first.")
+    parser.add_argument("--hedge-percentile", type=float, default=HEDGE_PERCENTILE,
+                        help="Percentile of the stage's latency history after which a call is hedged.")
+    parser.add_argument("--latency-history", default=DEFAULT_HISTORY_PATH,
+                        help="Per-stage latency samples and exported histograms, kept across runs.")
+    parser.add_argument("--count-tokens", choices=("estimate", "api"), default="estimate",
+                        help="Count prompt tokens locally (about 4 characters per token) or with Gemini's count_tokens API.")
+    parser.add_argument("--prompt-token-budget", type=int, metavar="TOKENS",
+                        help="Prompt token limit for every stage.")
+    parser.add_argument("--stage-token-budget", action="append", default=[], metavar="STAGE=TOKENS",
+                        help="Prompt token limit for one stage (backend, core_infra, lambda_alb, lambda_alb_edits, "
+                             "workflow); repeatable, overrides --prompt-token-budget.")
+    parser.add_argument("--run-token-budget", type=int, metavar="TOKENS",
+                        help="Limit on the total tokens (prompt + output) used by the run.")
+    parser.add_argument("--budget-policy", choices=BUDGET_POLICIES, default="compress",
+                        help="What to do with a prompt over budget: warn and send it, compress the embedded code "
+                             "(falling back to edit mode for main.tf) and fail if still over, or fail.")
+    parser.add_argument("--replay-latency", default=None,
+                        help="Simulated latency per replayed call: seconds, or 'recorded' to reuse the original latency.")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and deploy the Lambda + ALB stack with Gemini.")
+    subparsers = parser.add_subparsers(dest="command", metavar="{" + ",".join(COMMANDS) + "}")
+
+    add_generation_args(subparsers.add_parser(
+        "all", help="Generate files, bootstrap the backend and push (default when no command is given)."))
+    add_generation_args(subparsers.add_parser(
+        "generate", help="Generate backend.tf, main.tf, variables.tf, src/* and deploy.yml."))
+    add_generation_args(subparsers.add_parser(
+        "bootstrap", help="Generate (if needed) and apply the S3/DynamoDB state backend."))
+
+    apply_parser = subparsers.add_parser("apply", help="Run terraform init, plan and (if anything changed) apply for the root module.")
+    apply_parser.add_argument("--var", action="append", default=[], metavar="NAME=VALUE",
+                              help="Terraform variable passed as -var (repeatable).")
+
+    package_parser = subparsers.add_parser("package", help="Build a reproducible lambda.zip from src/ and optionally upload it.")
+    package_parser.add_argument("--src", default="src", help="Directory to package.")
+    package_parser.add_argument("--output", default="lambda.zip")
+    package_parser.add_argument("--upload", metavar="S3_URI",
+                                help="Upload to s3://bucket/key unless the object already has the same source_code_hash.")
+    package_parser.add_argument("--force", action="store_true", help="Rebuild even if src/ is unchanged.")
+
+    subparsers.add_parser("push", help="Commit the generated files and push them to GitHub.")
+
+    batch_parser = subparsers.add_parser("batch", help="Generate many projects from a JSONL manifest in a worker pool.")
+    batch_parser.add_argument("manifest", help="JSONL file, one project per line (see batch.py).")
+    batch_parser.add_argument("--steps", choices=sorted(COMMAND_STEPS), default="generate",
+                              help="Which generation command to run for each project.")
+    batch_parser.add_argument("--root", default="projects", help="Parent directory for projects without a directory key.")
+    batch_parser.add_argument("--workers", type=int, default=4, help="Projects processed in parallel.")
+    batch_parser.add_argument("--llm-concurrency", type=int, default=2,
+                              help="Model calls in flight across all workers.")
+    batch_parser.add_argument("--results", default="batch_results.jsonl", help="Where to write one result record per project.")
+    batch_parser.add_argument("--no-package", action="store_true", help="Skip building lambda.zip for each project.")
+    add_generation_args(batch_parser)
+
+    serve_parser = subparsers.add_parser("serve", help="Run a warm generation daemon that accepts jobs over local HTTP.")
+    # Defaults come from daemon.py in run_serve(), so building the parser doesn't import it.
+    serve_parser.add_argument("--host", help="Interface to listen on (default 127.0.0.1; keep it local).")
+    serve_parser.add_argument("--port", type=int, help="Port to listen on (default 8765).")
+    serve_parser.add_argument("--socket", metavar="PATH",
+                              help="Listen on a Unix socket instead of TCP (which requires the token in .daemon_token).")
+    serve_parser.add_argument("--steps", choices=sorted(COMMAND_STEPS), default="generate",
+                              help="Which generation command each job runs.")
+    serve_parser.add_argument("--root", default="projects",
+                              help="Parent directory for job projects; a job's directory key must be inside it.")
+    serve_parser.add_argument("--workers", type=int, default=2, help="Warm worker processes, i.e. jobs running at once.")
+    serve_parser.add_argument("--llm-concurrency", type=int, default=2,
+                              help="Model calls in flight across all workers.")
+    serve_parser.add_argument("--no-package", action="store_true", help="Skip building lambda.zip for each job.")
+    add_generation_args(serve_parser)
+
+    extract_parser = subparsers.add_parser("extract", help="Extract named code blocks from a saved LLM response.")
+    extract_parser.add_argument("response", help="Path to the response text, or - for stdin.")
+    extract_parser.add_argument("--file", action="append", default=[], metavar="PATH=LANG",
+                                help="Block to extract (repeatable). Without it, all named blocks are listed.")
+    extract_parser.add_argument("--write", action="store_true", help="Write the extracted blocks to their paths.")
+
+    for name, subparser in subparsers.choices.items():
+        if name != "extract":
+            subparser.add_argument("--trace", metavar="PREFIX",
+                                   help="Write <PREFIX>.summary.json and a Chrome trace <PREFIX>.trace.json.")
+        if name in COMMAND_STEPS:
+            subparser.add_argument("--isolated", action="store_true",
+                                   help=f"Work in a fresh {DEFAULT_RUNS_DIR}/<run id> directory that snapshots this one, "
+                                        "so concurrent runs on one host do not clobber each other. Runs publish "
+                                        "one at a time, each rebasing onto the latest origin/main before it pushes.")
+        if name in COMMAND_STEPS or name in ("apply", "package", "push"):
+            subparser.add_argument("--run-id", help=f"Work in {DEFAULT_RUNS_DIR}/<RUN_ID> (created by --isolated).")
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in COMMANDS + ("-h", "--help"):
+        argv.insert(0, "all")
+    return parser.parse_args(argv)
+
+def enter_run_dir(args):
+    """
+    Moves the process into the run directory for --isolated / --run-id. Caches, the backend
+    registry and the publish lock stay in the project directory, shared by all runs.
+    """
+    global BACKEND_REGISTRY_PATH, PUBLISH_LOCK_PATH
+    share_run_paths(args)
+    BACKEND_REGISTRY_PATH = os.path.abspath(BACKEND_REGISTRY_PATH)
+    PUBLISH_LOCK_PATH = os.path.abspath(PUBLISH_LOCK_PATH)
+    run_dir = os.path.abspath(os.path.join(DEFAULT_RUNS_DIR, args.run_id)) if args.run_id else None
+    if not (run_dir and os.path.isdir(run_dir)):
+        if not getattr(args, "isolated", False):
+            print(f"Error: Run directory {run_dir} does not exist (create it with --isolated).")
+            exit(1)
+        try:
+            run_dir = create_run_dir(".", DEFAULT_RUNS_DIR, args.run_id)
+        except OSError as e:
+            print(f"Error: Could not create the run directory: {e}")
+            exit(1)
+    else:
+        print(f"Using run directory {run_dir}")
+    os.chdir(run_dir)
+
+def load_environment():
+    """Step 1: Load .env. Imported lazily so commands that never need it stay fast."""
+    import dotenv
+
+    dotenv.load_dotenv()
+
+def configure_llm(args):
+    """Step 2: Build the model backend (Gemini, recording or offline replay) and the response cache."""
+    global STREAM_RESPONSES, LLM_CACHE, FORCE_NEW_BACKEND, LLM_BACKEND, EDIT_MODE, OUTPUT_FORMAT
+    global CANDIDATES, CANDIDATE_TEMPERATURE, TERRAFORM_VALIDATE, LATENCY_HISTORY, HEDGE, HEDGE_PERCENTILE
+    STREAM_RESPONSES = args.stream
+    LATENCY_HISTORY = LatencyHistory(args.latency_history)
+    HEDGE = args.hedge
+    HEDGE_PERCENTILE = args.hedge_percentile
+    CANDIDATES = max(1, args.candidates)
+    CANDIDATE_TEMPERATURE = args.candidate_temperature
+    TERRAFORM_VALIDATE = args.terraform_validate
+    OUTPUT_FORMAT = args.output_format
+    if args.stream and OUTPUT_FORMAT == "json":
+        print("Note: --stream has no effect with --output-format json; files are written once the response is decoded.")
+    EDIT_MODE = args.edit_mode
+    FORCE_NEW_BACKEND = args.new_backend
+    LLM_CACHE = ResponseCache(args.cache_dir, enabled=not args.no_cache, refresh=args.refresh)
+
+    llm_mode = args.llm_mode or os.getenv("LLM_MODE", "live")
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key and llm_mode != "replay":
+        print("GEMINI_API_KEY not found. Please check your .env file and ensure it contains GOOGLE_API_KEY=YOUR_KEY.")
+        exit(1)
+    limits = {
+        "requests_per_minute": args.llm_rpm,
+        "max_concurrency": args.llm_max_concurrency,
+        "max_retries": args.llm_max_retries,
+        "deadline": args.llm_deadline,
+    }
+    LLM_BACKEND = make_backend(llm_mode, MODEL_NAME, api_key, recordings_dir=args.recordings_dir,
+                               replay_latency=args.replay_latency, limits=limits)
+    reset_run_state(args)
+
+def reset_run_state(args):
+    """Per-run accounting; a warm daemon worker resets it for every job but keeps the model client."""
+    global HEDGE_STATS
+    configure_token_budget(args)
+    HEDGE_STATS = HedgeStats()
+    LLM_CACHE.hits = LLM_CACHE.misses = 0
+    if hasattr(LLM_BACKEND, "reset_stats"):
+        LLM_BACKEND.reset_stats()
+
+def configure_token_budget(args):
+    """Builds TOKEN_BUDGET from the budget options."""
+    global TOKEN_BUDGET
+    stage_budgets = {}
+    for entry in args.stage_token_budget:
+        stage, _, tokens = entry.partition("=")
+        if not stage or not tokens.isdigit():
+            print(f"Error: --stage-token-budget expects STAGE=TOKENS, got {entry!r}")
+            exit(1)
+        stage_budgets[stage] = int(tokens)
+    counter = api_token_counter if args.count_tokens == "api" and hasattr(LLM_BACKEND, "count_tokens") else None
+    TOKEN_BUDGET = TokenBudget(args.prompt_token_budget, stage_budgets, args.run_token_budget,
+                               args.budget_policy, counter)
+
+def committing_step(step):
+    """
+    Wraps step so its staged outputs are written to disk as soon as it succeeds, before the
+    run journal hashes them. A later step failing then leaves finished steps' files in place
+    for --resume; the failing step's own files stay staged and are discarded.
+    """
+    def run(step_inputs):
+        result = step.func(step_inputs)
+        commit_workspace(step.outputs)
+        return result
+    return Step(step.name, run, step.inputs, step.outputs, step.fingerprint)
+
+def run_pipeline(steps, resume=False):
+    """Runs steps through the DAG scheduler, journaling each one's on-disk outputs."""
+    journal = RunJournal(RUN_JOURNAL_PATH, resume=resume)
+    return run_steps([committing_step(step) for step in steps], journal=journal)
+
+def run_generation(args, configure=True):
+    """
+    Runs the DAG steps for the all/generate/bootstrap commands. configure=False reuses the model
+    client and caches set up by an earlier configure_llm() (daemon workers).
+    """
+    if configure:
+        configure_llm(args)
+    else:
+        reset_run_state(args)
+
+    # Steps 4.0 - 5: Run the generation DAG. Files are staged in WORKSPACE and each step's
+    # outputs are written (with their directories) once that step has succeeded.
+    step_names = COMMAND_STEPS[args.command]
+    steps = [step for step in PIPELINE_STEPS if step.name in step_names]
+    try:
+        results = run_pipeline(steps, resume=args.resume)
+    except TokenBudgetExceeded as e:
+        print(f"Error: Token budget exceeded: {e}")
+        print(TOKEN_BUDGET.summary())
+        exit(1)
+    finally:
+        save_latency_history()
+    commit_workspace()
+
+    if args.command == "all":
+        print("\n--- Deployment Automation Script Finished ---")
+        print("Please check your GitHub Actions workflow for deployment status.")
+    print(f"\nYour S3 state bucket: {results['backend_names']['state_bucket']}")
+    print(f"Your DynamoDB lock table: {results['backend_names']['lock_table']}")
     print(f"Your GitHub Repo: {GITHUB_REPO_URL}")
+    print(LLM_CACHE.summary())
+    print(TOKEN_BUDGET.summary())
+    if HEDGE:
+        print(HEDGE_STATS.summary())
+    if hasattr(LLM_BACKEND, "summary"):
+        print(LLM_BACKEND.summary())
+
+def save_latency_history():
+    try:
+        LATENCY_HISTORY.save()
+    except OSError as e:
+        print(f"Warning: Could not save the latency history: {e}")
+
+def run_apply(args):
+    """Runs terraform init, then plans and applies the saved plan for the root module."""
+    var_args = [f"-var={var}" for var in args.var]
+    run_terraform_init(".")
+    run_terraform_plan_apply(".", var_args)
+
+def run_package(args):
+    """Builds lambda.zip deterministically, skipping the build and upload when nothing changed."""
+    try:
+        package_and_upload(args.src, args.output, args.upload, args.force)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Error: Packaging failed: {e}")
+        exit(1)
+
+def configure_project(project):
+    """Points the module-level project settings at one batch manifest entry."""
+    global PROJECT_NAME, AWS_REGION, LAMBDA_RUNTIME, GITHUB_REPO_URL, WORKSPACE
+    PROJECT_NAME = project["project_name"]
+    AWS_REGION = project.get("aws_region", AWS_REGION)
+    LAMBDA_RUNTIME = project.get("lambda_runtime", LAMBDA_RUNTIME)
+    GITHUB_REPO_URL = project.get("github_repo_url", GITHUB_REPO_URL)
+    WORKSPACE = Workspace()
+
+def init_batch_worker(llm_slots):
+    """Process pool initializer: every model call in this worker takes a slot from llm_slots."""
+    global LLM_SLOTS
+    LLM_SLOTS = llm_slots
+
+def run_project(project, args, log_name="batch.log", warm=False):
+    """
+    Batch/daemon worker: generates (and packages) one project inside its own directory, with all
+    output going to log_name there. warm=True reuses this process's model client and caches.
+    Returns the project's result record.
+    """
+    record = {"project": project["project_name"], "directory": project["directory"], "status": "ok"}
+    started = time.monotonic()
+    os.makedirs(project["directory"], exist_ok=True)
+    os.chdir(project["directory"])
+    if warm:
+        clear_spans()
+        clear_command_log()
+    # Line-buffered, so the daemon can stream progress as it is written.
+    with open(log_name, "w", buffering=1) as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            configure_project(project)
+            run_generation(argparse.Namespace(**dict(vars(args), command=args.steps)), configure=not warm)
+            if not args.no_package:
+                package = build_package("src", "lambda.zip")
+                record.update(source_code_hash=package["source_code_hash"], package_rebuilt=package["rebuilt"])
+        except SystemExit as e:
+            record.update(status="failed", error=f"exited with status {e.code} (see {log_name})")
+        except Exception as e:
+            record.update(status="failed", error=f"{type(e).__name__}: {e}")
+        finally:
+            print(command_summary())
+            print(format_report())
+            if args.trace:
+                write_trace(args.trace)
+    record.update(
+        duration_seconds=round(time.monotonic() - started, 3),
+        llm_cache=LLM_CACHE.summary(),
+        files=sorted(path for step in PIPELINE_STEPS if step.name in COMMAND_STEPS[args.steps]
+                     for path in step.outputs if os.path.exists(path)),
+    )
+    return record
+
+def init_daemon_worker(llm_slots, events, args):
+    """
+    Daemon pool initializer: builds the model client and caches once, so every job this
+    worker runs starts warm.
+    """
+    global LLM_SLOTS, DAEMON_EVENTS
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is for the parent, which shuts the pool down
+    LLM_SLOTS = llm_slots
+    DAEMON_EVENTS = events
+    configure_llm(args)
+
+def run_daemon_job(job_id, project, args):
+    """Daemon worker: runs one job with the warm client; its output goes to <project>/daemon.log."""
+    from daemon import LOG_NAME
+
+    DAEMON_EVENTS.put(("started", job_id))
+    return run_project(project, args, log_name=LOG_NAME, warm=True)
+
+def share_run_paths(args):
+    """Makes the LLM cache, recordings and latency history absolute, so every project directory shares them."""
+    for name in ("cache_dir", "recordings_dir", "latency_history"):
+        if hasattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+def run_serve(args):
+    """
+    Starts the warm worker pool and serves the job API until interrupted.
+    daemon (http.server, multiprocessing) is imported here so other commands don't pay for it at startup.
+    """
+    from daemon import DEFAULT_HOST, DEFAULT_PORT, TOKEN_FILE, JobQueue, make_server, write_token
+
+    args.host = args.host or DEFAULT_HOST
+    args.port = args.port or DEFAULT_PORT
+    share_run_paths(args)
+    configure_llm(args)  # fail fast on a missing API key or bad options, before any worker starts
+    job_queue = JobQueue(run_daemon_job, args, workers=args.workers, llm_concurrency=args.llm_concurrency,
+                         initializer=init_daemon_worker, root=args.root)
+    print(f"Starting {args.workers} warm worker(s)...")
+    job_queue.warm_up()
+    try:
+        # The Unix socket is private to this user; TCP is open to every local user, so it needs a token.
+        token = None if args.socket else write_token(TOKEN_FILE)
+        server = make_server(job_queue, args.host, args.port, args.socket, token)
+    except OSError as e:
+        print(f"Error: Could not listen on {args.socket or f'{args.host}:{args.port}'}: {e}")
+        job_queue.shutdown()
+        exit(1)
+    if token:
+        print(f"API token written to {os.path.abspath(TOKEN_FILE)}; send it as 'Authorization: Bearer <token>'.")
+    print(f"Generation daemon listening on {args.socket or f'http://{args.host}:{args.port}'} "
+          f"({args.workers} worker(s), at most {args.llm_concurrency} model call(s) at a time)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down.")
+    finally:
+        server.server_close()
+        job_queue.shutdown()
+
+def run_batch_command(args):
+    """
+    Fans the manifest's projects out over a process pool and writes one result record per project.
+    batch (and multiprocessing) is imported here so other commands don't pay for it at startup.
+    """
+    from batch import ManifestError, format_results, load_manifest, run_batch, write_results
+
+    try:
+        projects = load_manifest(args.manifest, root=args.root)
+    except (OSError, ManifestError) as e:
+        print(f"Error: {e}")
+        exit(1)
+    share_run_paths(args)
+    results_path = os.path.abspath(args.results)
+    print(f"Running {len(projects)} project(s) with {args.workers} worker(s), "
+          f"at most {args.llm_concurrency} model call(s) at a time...")
+    started = time.monotonic()
+    records = run_batch(projects, run_project, args, workers=args.workers,
+                        llm_concurrency=args.llm_concurrency, initializer=init_batch_worker)
+    write_results(results_path, records)
+    print(format_results(records, time.monotonic() - started))
+    print(f"Results written to {results_path}")
+    if any(record["status"] != "ok" for record in records):
+        exit(1)
+
+def run_extract(args):
+    """Extracts code blocks from a saved response without calling the LLM."""
+    if args.response == "-":
+        response = sys.stdin.read()
+    else:
+        response = read_file(args.response)
+    if not args.file:
+        for path, (language, content) in index_code_blocks(response).named.items():
+            print(f"{path} ({language}, {len(content)} chars)")
+        return
+
+    file_language_map = dict(spec.split("=", 1) for spec in args.file)
+    blocks = extract_multiple_code_blocks(response, file_language_map)
+    for path, content in blocks.items():
+        if content is None:
+            continue
+        if args.write:
+            write_file(path, content)
+        else:
+            print(f"### {path} {file_language_map[path]}\n{content}\n")
+    commit_workspace()
+    if any(content is None for content in blocks.values()):
+        exit(1)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command != "extract":
+        load_environment()
+    if getattr(args, "isolated", False) or getattr(args, "run_id", None):
+        enter_run_dir(args)
+
+    if args.command in COMMAND_STEPS:
+        run_generation(args)
+    elif args.command == "apply":
+        run_apply(args)
+    elif args.command == "package":
+        run_package(args)
+    elif args.command == "push":
+        step_publish({})
+    elif args.command == "batch":
+        run_batch_command(args)  # each project prints its own report to its batch.log
+        return
+    elif args.command == "serve":
+        run_serve(args)
+        return
+    elif args.command == "extract":
+        run_extract(args)
+        return
+    print(command_summary())
+    print(format_report())
+    if args.trace:
+        summary_path, chrome_path = write_trace(args.trace)
+        print(f"Trace written to {summary_path} and {chrome_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
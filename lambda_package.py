@@ -0,0 +1,220 @@
+"""
+Reproducible lambda.zip builder.
+
+The archive only depends on file contents: entries are sorted, every
+timestamp is fixed at 1980-01-01 and permissions are normalized to 644/755,
+so the same src/ always produces byte-identical zips and the same
+source_code_hash. Junk files and dev dependencies (from package-lock.json,
+or package.json's devDependencies) are left out.
+
+A manifest next to the zip records the hash of the inputs of the last build,
+so an unchanged src/ is not zipped again. Uploads to S3 store the
+source_code_hash as object metadata and are skipped when the object already
+carries the same hash.
+
+Usage:
+    python lambda_package.py [src] [--output lambda.zip] [--upload s3://bucket/key] [--force]
+"""
+import argparse
+import base64
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+
+from journal import file_sha256, fingerprint
+from runner import run_command
+
+# Bump when the archive layout changes, so old manifests stop matching.
+PACKAGE_FORMAT_VERSION = 1
+
+FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# File and directory names (glob patterns) never shipped in the package.
+DEFAULT_EXCLUDES = (
+    ".git", ".github", ".DS_Store", "Thumbs.db", "*.log", ".env", ".env.*",
+    "coverage", ".nyc_output", "__tests__", "*.test.js", "*.spec.js",
+    ".eslintrc*", ".prettierrc*", ".editorconfig", ".npmrc",
+)
+
+
+def manifest_path(output):
+    return os.path.join(os.path.dirname(os.path.abspath(output)), ".lambda_package.json")
+
+
+def dev_dependency_paths(src_dir):
+    """Returns the node_modules paths (relative to src_dir) that only dev dependencies need."""
+    try:
+        with open(os.path.join(src_dir, "package-lock.json"), "r") as f:
+            lock = json.load(f)
+        packages = lock.get("packages")
+        if packages:
+            return {path for path, info in packages.items() if path and info.get("dev")}
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(src_dir, "package.json"), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    runtime = set(manifest.get("dependencies") or {})
+    return {f"node_modules/{name}" for name in manifest.get("devDependencies") or {} if name not in runtime}
+
+
+def _excluded(name, excludes):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in excludes)
+
+
+def collect_files(src_dir, excludes=DEFAULT_EXCLUDES):
+    """Sorted relative paths (with '/' separators) of the files that go into the package."""
+    dev_paths = dev_dependency_paths(src_dir)
+    files = []
+    for root, dirs, names in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir).replace(os.sep, "/")
+        rel_root = "" if rel_root == "." else rel_root + "/"
+        dirs[:] = [d for d in dirs if not _excluded(d, excludes) and f"{rel_root}{d}" not in dev_paths]
+        files.extend(f"{rel_root}{name}" for name in names if not _excluded(name, excludes))
+    return sorted(files)
+
+
+def inputs_hash(src_dir, files):
+    """Hash of the file list, contents and executable bits that determine the archive."""
+    entries = [
+        [path, file_sha256(os.path.join(src_dir, path)), os.access(os.path.join(src_dir, path), os.X_OK)]
+        for path in files
+    ]
+    return fingerprint({"version": PACKAGE_FORMAT_VERSION, "files": entries})
+
+
+def build_zip_bytes(src_dir, files):
+    """Builds the archive in memory with fixed timestamps, ordering and permissions."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for path in files:
+            full_path = os.path.join(src_dir, path)
+            info = zipfile.ZipInfo(path, date_time=FIXED_DATE_TIME)
+            info.create_system = 3  # Unix, so external_attr holds the mode bits
+            info.external_attr = (0o100755 if os.access(full_path, os.X_OK) else 0o100644) << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(full_path, "rb") as f:
+                archive.writestr(info, f.read(), compresslevel=9)
+    return buffer.getvalue()
+
+
+def source_code_hash(data):
+    """base64(sha256(zip)), the format Terraform expects for source_code_hash."""
+    return base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
+
+
+def _load_manifest(output):
+    try:
+        with open(manifest_path(output), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(output, manifest):
+    path = manifest_path(output)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def build_package(src_dir="src", output="lambda.zip", force=False, excludes=DEFAULT_EXCLUDES):
+    """
+    Builds output from src_dir unless the last build had the same inputs and the zip is intact.
+    Returns {"path", "sha256", "source_code_hash", "files", "rebuilt"}.
+    """
+    files = collect_files(src_dir, excludes)
+    if not files:
+        raise FileNotFoundError(f"No files to package in {src_dir}")
+    current_inputs = inputs_hash(src_dir, files)
+    manifest = _load_manifest(output)
+    if (not force and manifest.get("inputs_hash") == current_inputs
+            and file_sha256(output) == manifest.get("sha256")):
+        return dict(manifest["package"], rebuilt=False)
+
+    data = build_zip_bytes(src_dir, files)
+    directory = os.path.dirname(os.path.abspath(output))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".zip.tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, output)
+
+    package = {
+        "path": output,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "source_code_hash": source_code_hash(data),
+        "files": len(files),
+    }
+    manifest.update(inputs_hash=current_inputs, sha256=package["sha256"], package=package)
+    _save_manifest(output, manifest)
+    return dict(package, rebuilt=True)
+
+
+def parse_s3_uri(uri):
+    if not uri.startswith("s3://") or "/" not in uri[5:]:
+        raise ValueError(f"Expected s3://bucket/key, got {uri}")
+    bucket, key = uri[5:].split("/", 1)
+    return bucket, key
+
+
+def deployed_source_code_hash(bucket, key):
+    """The source-code-hash metadata of the uploaded object, or None if it is missing."""
+    result = run_command(["aws", "s3api", "head-object", "--bucket", bucket, "--key", key],
+                         timeout=120, echo=False, capture_stdout=True)
+    if not result.ok:
+        return None
+    try:
+        return json.loads(result.stdout).get("Metadata", {}).get("source-code-hash")
+    except ValueError:
+        return None
+
+
+def upload_package(package, s3_uri):
+    """Uploads the zip unless the S3 object already has the same source_code_hash. Returns True if uploaded."""
+    bucket, key = parse_s3_uri(s3_uri)
+    if deployed_source_code_hash(bucket, key) == package["source_code_hash"]:
+        return False
+    result = run_command(["aws", "s3", "cp", package["path"], s3_uri,
+                          "--metadata", f"source-code-hash={package['source_code_hash']}"], timeout=600)
+    if not result.ok:
+        raise RuntimeError(result.error_report())
+    return True
+
+
+def package_and_upload(src_dir, output, upload=None, force=False):
+    """Builds (or reuses) the package, optionally uploads it, and prints what happened."""
+    package = build_package(src_dir, output, force=force)
+    state = "Built" if package["rebuilt"] else "Unchanged, reusing"
+    print(f"{state} {package['path']} ({package['files']} files)")
+    print(f"source_code_hash: {package['source_code_hash']}")
+    if upload:
+        if upload_package(package, upload):
+            print(f"Uploaded to {upload}")
+        else:
+            print(f"{upload} already has this package; skipping upload.")
+    return package
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a reproducible lambda.zip and optionally upload it to S3.")
+    parser.add_argument("src", nargs="?", default="src", help="Directory to package (default: src).")
+    parser.add_argument("--output", default="lambda.zip")
+    parser.add_argument("--upload", metavar="S3_URI", help="Upload to s3://bucket/key unless already deployed.")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the inputs are unchanged.")
+    args = parser.parse_args()
+    try:
+        package_and_upload(args.src, args.output, args.upload, args.force)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Error: Packaging failed: {e}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Model backends for the generation scripts.
+
+Every backend exposes the same two calls:
+
+    generate(prompt, generation_config, timeout=None) -> LLMResponse
+    stream(prompt, generation_config, usage=None, timeout=None) -> iterator of text chunks
+
+stream() fills the optional usage dict with token counts once the stream ends.
+timeout is the request timeout in seconds, where the backend supports one.
+Backends that can count tokens exactly also have count_tokens(prompt) -> int.
+
+GeminiBackend talks to the real API. RecordingBackend wraps another backend
+and saves every response to disk; ReplayBackend serves those recordings
+without network access or an API key, optionally with simulated latency, so
+the whole pipeline can be profiled offline and deterministically. Live and
+record backends are wrapped in llm_client.RateLimitedBackend when limits are
+given.
+"""
+import json
+import os
+import tempfile
+import time
+
+from llm_cache import cache_key
+
+DEFAULT_RECORDINGS_DIR = ".llm_recordings"
+LLM_MODES = ("live", "record", "replay")
+
+# Chunk size used when replaying a recorded response as a stream.
+REPLAY_CHUNK_CHARS = 256
+
+
+class LLMResponse:
+    """Text of a model response plus token usage, when the backend reports it."""
+
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage = usage or {}
+
+
+class ReplayMissError(LookupError):
+    """Raised when replay mode has no recording for a prompt."""
+
+
+def usage_from_metadata(response):
+    """Extracts token counts from a Gemini response's usage_metadata, if present."""
+    metadata = getattr(response, "usage_metadata", None)
+    if not metadata:
+        return {}
+    return {
+        "prompt_tokens": getattr(metadata, "prompt_token_count", None),
+        "output_tokens": getattr(metadata, "candidates_token_count", None),
+        "total_tokens": getattr(metadata, "total_token_count", None),
+    }
+
+
+def _request_options(timeout):
+    return {"timeout": timeout} if timeout else None
+
+
+class GeminiBackend:
+    """Live Gemini calls through google.generativeai."""
+
+    def __init__(self, model_name, api_key):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt, generation_config, timeout=None):
+        response = self.model.generate_content(prompt, generation_config=generation_config,
+                                               request_options=_request_options(timeout))
+        return LLMResponse(response.text, usage_from_metadata(response))
+
+    def count_tokens(self, prompt):
+        return self.model.count_tokens(prompt).total_tokens
+
+    def stream(self, prompt, generation_config, usage=None, timeout=None):
+        chunk = None
+        for chunk in self.model.generate_content(prompt, generation_config=generation_config, stream=True,
+                                                 request_options=_request_options(timeout)):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks carrying only finish/safety metadata have no text parts.
+                continue
+            yield text
+        if usage is not None and chunk is not None:
+            # The final chunk carries the usage for the whole response.
+            usage.update(usage_from_metadata(chunk))
+
+
+def recording_path(directory, model_name, generation_config, prompt):
+    return os.path.join(directory, f"{cache_key(model_name, generation_config, prompt)}.json")
+
+
+class RecordingBackend:
+    """Delegates to another backend and saves each response (with its latency) for replay."""
+
+    def __init__(self, inner, directory=DEFAULT_RECORDINGS_DIR):
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.directory = directory
+
+    def _save(self, prompt, generation_config, text, usage, latency):
+        os.makedirs(self.directory, exist_ok=True)
+        record = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "response": text,
+            "usage": usage,
+            "latency_seconds": latency,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f, indent=2)
+        os.replace(tmp_path, recording_path(self.directory, self.model_name, generation_config, prompt))
+
+    def count_tokens(self, prompt):
+        return self.inner.count_tokens(prompt)
+
+    def generate(self, prompt, generation_config, timeout=None):
+        started = time.monotonic()
+        response = self.inner.generate(prompt, generation_config, timeout=timeout)
+        self._save(prompt, generation_config, response.text, response.usage, time.monotonic() - started)
+        return response
+
+    def stream(self, prompt, generation_config, usage=None, timeout=None):
+        started = time.monotonic()
+        chunks = []
+        stream_usage = {}
+        for chunk in self.inner.stream(prompt, generation_config, stream_usage, timeout=timeout):
+            chunks.append(chunk)
+            yield chunk
+        if usage is not None:
+            usage.update(stream_usage)
+        self._save(prompt, generation_config, "".join(chunks), stream_usage, time.monotonic() - started)
+
+
+class ReplayBackend:
+    """
+    Serves recorded responses from disk.
+    Args:
+        latency (float or str, optional): Seconds to sleep per call, or "recorded" to
+            reproduce each recording's original latency. Default is no delay.
+    """
+
+    def __init__(self, model_name, directory=DEFAULT_RECORDINGS_DIR, latency=None):
+        self.model_name = model_name
+        self.directory = directory
+        self.latency = latency
+
+    def _load(self, prompt, generation_config):
+        path = recording_path(self.directory, self.model_name, generation_config, prompt)
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ReplayMissError(f"No recording for this prompt in {self.directory} ({os.path.basename(path)})")
+
+    def _delay(self, record):
+        if self.latency == "recorded":
+            return record.get("latency_seconds") or 0.0
+        return float(self.latency or 0.0)
+
+    def generate(self, prompt, generation_config, timeout=None):
+        record = self._load(prompt, generation_config)
+        time.sleep(self._delay(record))
+        return LLMResponse(record["response"], record.get("usage"))
+
+    def stream(self, prompt, generation_config, usage=None, timeout=None):
+        record = self._load(prompt, generation_config)
+        text = record["response"]
+        chunks = [text[i:i + REPLAY_CHUNK_CHARS] for i in range(0, len(text), REPLAY_CHUNK_CHARS)] or [""]
+        pause = self._delay(record) / len(chunks)
+        for chunk in chunks:
+            time.sleep(pause)
+            yield chunk
+        if usage is not None:
+            usage.update(record.get("usage") or {})
+
+
+def make_backend(mode, model_name, api_key=None, recordings_dir=DEFAULT_RECORDINGS_DIR, replay_latency=None,
+                 limits=None):
+    """
+    Builds the backend for an --llm-mode value ("live", "record" or "replay").
+    limits (dict, optional): RateLimitedBackend keyword arguments for the live and record modes.
+    """
+    if mode == "replay":
+        return ReplayBackend(model_name, recordings_dir, replay_latency)
+    if mode not in LLM_MODES:
+        raise ValueError(f"Unknown LLM mode: {mode}")
+    backend = GeminiBackend(model_name, api_key)
+    if mode == "record":
+        backend = RecordingBackend(backend, recordings_dir)
+    if limits is not None:
+        from llm_client import RateLimitedBackend
+
+        # Outermost, so a recording keeps the latency of the successful attempt only.
+        backend = RateLimitedBackend(backend, **limits)
+    return backend
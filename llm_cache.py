@@ -0,0 +1,146 @@
+"""
+Content-addressed on-disk cache for LLM responses.
+
+Entries are keyed by a SHA-256 of the model name, the generation config and the
+rendered prompt, so re-running the generator with identical prompts is served
+from disk instead of paying model latency and quota again.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_CACHE_DIR = ".llm_cache"
+DEFAULT_MAX_ENTRIES = 200
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_MAX_AGE_SECONDS = 7 * 24 * 3600
+
+
+def config_fingerprint(generation_config):
+    """Returns a stable, JSON-serializable view of a generation config."""
+    if generation_config is None:
+        return None
+    if dataclasses.is_dataclass(generation_config):
+        return dataclasses.asdict(generation_config)
+    if isinstance(generation_config, dict):
+        return generation_config
+    return {k: v for k, v in vars(generation_config).items() if not k.startswith("_")}
+
+
+def cache_key(model_name, generation_config, prompt):
+    """Hashes everything that can change the model's answer."""
+    payload = json.dumps(
+        {"model": model_name, "config": config_fingerprint(generation_config), "prompt": prompt},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Stores one JSON file per response under directory.
+    Args:
+        enabled (bool): When False, nothing is read or written (--no-cache).
+        refresh (bool): When True, lookups always miss but new responses are stored (--refresh).
+        max_entries/max_bytes/max_age_seconds: Eviction limits, oldest-used entries go first.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, enabled=True, refresh=False,
+                 max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        self.directory = directory
+        self.enabled = enabled
+        self.refresh = refresh
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached response text, or None on a miss."""
+        if not self.enabled:
+            return None
+        text = None
+        if not self.refresh:
+            path = self._path(key)
+            try:
+                if time.time() - os.path.getmtime(path) <= self.max_age_seconds:
+                    with open(path, "r") as f:
+                        text = json.load(f)["response"]
+                    # Bump the mtime so eviction drops the least recently used entries.
+                    os.utime(path)
+            except (OSError, ValueError, KeyError):
+                text = None
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return text
+
+    def put(self, key, text, model_name=None):
+        """Stores a response atomically, then applies the eviction limits."""
+        if not self.enabled or not text:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"model": model_name, "created": time.time(), "response": text}, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Warning: Could not write LLM cache entry {key[:12]}: {e}")
+            return
+        self.evict()
+
+    def discard(self, key):
+        """Drops one entry, e.g. a response that turned out to be unusable."""
+        if self.enabled:
+            self._remove(self._path(key))
+
+    def evict(self):
+        """Removes expired entries, then the least recently used ones beyond the size limits."""
+        with self._lock:
+            try:
+                names = [n for n in os.listdir(self.directory) if n.endswith(".json")]
+            except FileNotFoundError:
+                return
+            now = time.time()
+            entries = []
+            for name in names:
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.max_age_seconds:
+                    self._remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+            entries.sort()
+            total_bytes = sum(size for _, size, _ in entries)
+            while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+                _, size, path = entries.pop(0)
+                self._remove(path)
+                total_bytes -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def summary(self):
+        if not self.enabled:
+            return "LLM cache: disabled"
+        return f"LLM cache: {self.hits} hit(s), {self.misses} miss(es)"
@@ -0,0 +1,313 @@
+"""
+Rate-limit-aware wrapper around a model backend.
+
+RateLimitedBackend exposes the same generate()/stream() calls as the backends
+in llm.py and adds, per call:
+
+- a token bucket (requests per minute, with a small burst) shared by all
+  threads of the process,
+- a cap on the number of calls in flight,
+- retries of throttling (429) and transient server errors with jittered
+  exponential backoff; a retry hint from the server (RetryInfo, Retry-After,
+  "retry in 12s") is honoured when it asks for a longer wait,
+- a deadline covering all attempts of the call, passed down to the backend as
+  the request timeout.
+
+A stream is only retried if it fails before its first chunk; after that the
+caller has already consumed part of the response.
+
+Metrics for the calling thread's last call are in last_call(), and summary()
+aggregates all calls (retries, time spent throttled, latency percentiles).
+A call whose result is no longer wanted (a hedged request that lost) can be
+abandoned with set_cancel_check(): it makes no further attempts and is left
+out of the metrics.
+"""
+import random
+import re
+import threading
+import time
+
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_DEADLINE_SECONDS = 600
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+# HTTP statuses worth retrying: throttling, timeouts and transient server errors.
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# The same conditions as google.api_core exception classes and gRPC status names.
+RETRYABLE_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "BadGateway", "GatewayTimeout", "DeadlineExceeded", "RequestTimeout",
+    "RESOURCE_EXHAUSTED", "UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED",
+}
+
+_RETRY_IN = re.compile(r"retry (?:in|after) (\d+(?:\.\d+)?)\s*(ms|s)\b", re.IGNORECASE)
+
+
+class LLMCallError(RuntimeError):
+    """Raised when a call fails permanently, runs out of retries or passes its deadline."""
+
+
+def _status(error):
+    code = getattr(error, "code", None)
+    if callable(code):  # grpc.RpcError.code() returns a StatusCode enum
+        try:
+            code = code()
+        except Exception:
+            return None
+    return code
+
+
+def is_retryable(error):
+    """True for throttling, timeouts, connection errors and transient 5xx responses."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    code = _status(error)
+    if isinstance(code, int) and code in RETRYABLE_STATUS:
+        return True
+    if getattr(code, "name", None) in RETRYABLE_NAMES:
+        return True
+    return type(error).__name__ in RETRYABLE_NAMES
+
+
+def _duration_seconds(value):
+    """Seconds from a protobuf Duration, a number, or a "12s"/"1.5s" string."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)s?\s*", value)
+        return float(match.group(1)) if match else None
+    if hasattr(value, "total_seconds"):
+        return value.total_seconds()
+    if hasattr(value, "seconds"):
+        return value.seconds + getattr(value, "nanos", 0) / 1e9
+    return None
+
+
+def retry_hint(error):
+    """Seconds the server asked us to wait before retrying, or None."""
+    for detail in getattr(error, "details", None) or []:
+        if isinstance(detail, dict):
+            delay = _duration_seconds(detail.get("retryDelay") or detail.get("retry_delay"))
+        else:
+            delay = _duration_seconds(getattr(detail, "retry_delay", None))
+        if delay is not None:
+            return delay
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        pass
+    match = _RETRY_IN.search(str(error))
+    if match:
+        return float(match.group(1)) / (1000 if match.group(2).lower() == "ms" else 1)
+    return None
+
+
+def backoff_delay(attempt, hint=None, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_MAX_SECONDS):
+    """
+    Full-jitter exponential backoff for the given retry number (0-based). A server hint acts
+    as a floor, with a little jitter so throttled callers do not all come back at once.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if hint is not None:
+        delay = max(delay, hint * random.uniform(1.0, 1.2))
+    return delay
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum burst.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """Takes one token, sleeping until one is available. Returns the seconds waited."""
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - started
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                raise LLMCallError("Deadline exceeded while waiting for the request rate limit")
+            time.sleep(wait)
+
+
+class CallStats:
+    """Metrics of one logical call (all its attempts)."""
+
+    def __init__(self):
+        self.attempts = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self.latency_seconds = None
+        self.errors = []
+
+    def as_dict(self):
+        return {
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "latency_seconds": None if self.latency_seconds is None else round(self.latency_seconds, 3),
+        }
+
+
+class RateLimitedBackend:
+    """
+    Wraps a backend with rate limiting, a concurrency cap, retries and deadlines.
+    Args:
+        inner: Backend with generate()/stream() (see llm.py).
+        requests_per_minute (float): Sustained request rate; bursts of up to max_concurrency.
+        max_concurrency (int): Calls in flight at once from this process.
+        max_retries (int): Retries per call after the first attempt.
+        deadline (float): Seconds a call may take, including waiting and retries.
+    """
+
+    def __init__(self, inner, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES,
+                 deadline=DEFAULT_DEADLINE_SECONDS):
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.bucket = TokenBucket(requests_per_minute / 60.0, capacity=max_concurrency)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.calls = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def set_cancel_check(self, check):
+        """
+        Sets check() for the calling thread's next calls (None clears it). Once check() is true
+        the call gives up instead of retrying, prints nothing more and is not recorded.
+        """
+        self._local.cancelled = check
+
+    def _cancelled(self):
+        check = getattr(self._local, "cancelled", None)
+        return bool(check and check())
+
+    def last_call(self):
+        """Metrics of the calling thread's most recent call, or {}."""
+        stats = getattr(self._local, "stats", None)
+        return stats.as_dict() if stats else {}
+
+    def _attempts(self, stats):
+        """
+        Yields (attempt number, remaining seconds) with a rate-limit token and a concurrency slot
+        held for each attempt. The caller breaks out on success; the next iteration backs off.
+        """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                error = stats.errors[-1]
+                if self._cancelled():
+                    raise LLMCallError(f"Call abandoned after {stats.attempts} attempt(s): {error}")
+                delay = backoff_delay(attempt - 1, retry_hint(error))
+                if time.monotonic() + delay > deadline:
+                    raise LLMCallError(f"Deadline of {self.deadline}s exceeded after {stats.attempts} attempt(s): {error}")
+                print(f"Model call failed ({type(error).__name__}: {str(error)[:200]}); "
+                      f"retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                stats.retries += 1
+                stats.throttled_seconds += delay
+                time.sleep(delay)
+            stats.throttled_seconds += self.bucket.acquire(deadline)
+            queued = time.monotonic()
+            with self.slots:
+                stats.throttled_seconds += time.monotonic() - queued
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LLMCallError(f"Deadline of {self.deadline}s exceeded before attempt {attempt + 1}")
+                stats.attempts += 1
+                yield attempt, remaining
+        raise LLMCallError(f"Gave up after {stats.attempts} attempt(s): {stats.errors[-1]}")
+
+    def _record(self, stats):
+        self._local.stats = stats
+        if self._cancelled():
+            return
+        with self._lock:
+            self.calls.append(stats)
+
+    def count_tokens(self, prompt):
+        # count_tokens has its own (much larger) quota, so it bypasses the limiter.
+        return self.inner.count_tokens(prompt)
+
+    def generate(self, prompt, generation_config, timeout=None):
+        stats = CallStats()
+        try:
+            for _, remaining in self._attempts(stats):
+                started = time.monotonic()
+                try:
+                    response = self.inner.generate(prompt, generation_config, timeout=min(remaining, timeout or remaining))
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    stats.errors.append(e)
+                    continue
+                stats.latency_seconds = time.monotonic() - started
+                return response
+        finally:
+            self._record(stats)
+
+    def stream(self, prompt, generation_config, usage=None, timeout=None):
+        stats = CallStats()
+        try:
+            for _, remaining in self._attempts(stats):
+                started = time.monotonic()
+                chunks = self.inner.stream(prompt, generation_config, usage, timeout=min(remaining, timeout or remaining))
+                try:
+                    first = next(chunks, None)
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    stats.errors.append(e)
+                    continue
+                if first is not None:
+                    yield first
+                    yield from chunks
+                stats.latency_seconds = time.monotonic() - started
+                return
+        finally:
+            self._record(stats)
+
+    def reset_stats(self):
+        """Forgets recorded calls, so summary() covers only the next run (warm daemon jobs)."""
+        with self._lock:
+            self.calls = []
+
+    def summary(self):
+        """One line of aggregate metrics for the run."""
+        with self._lock:
+            calls = list(self.calls)
+        if not calls:
+            return "LLM client: no calls"
+        latencies = sorted(c.latency_seconds for c in calls if c.latency_seconds is not None)
+        retries = sum(c.retries for c in calls)
+        throttled = sum(c.throttled_seconds for c in calls)
+        failed = sum(1 for c in calls if c.latency_seconds is None)
+        line = (f"LLM client: {len(calls)} call(s), {retries} retr{'y' if retries == 1 else 'ies'}, "
+                f"{failed} failed, {throttled:.1f}s throttled")
+        if latencies:
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            line += f", latency p50 {p50:.1f}s / p95 {p95:.1f}s"
+        return line
@@ -0,0 +1,123 @@
+"""
+Dependency-aware step scheduler for the generation scripts.
+
+Each step declares the names of the steps it needs as inputs. A step is
+started as soon as all of its inputs have finished, so independent LLM calls
+and Terraform commands overlap instead of running one after another.
+"""
+import concurrent.futures
+import time
+
+from journal import fingerprint as journal_fingerprint
+from tracing import span
+
+
+class Step:
+    """
+    A single pipeline stage.
+    Args:
+        name (str): Unique step name, used by other steps to declare inputs.
+        func (callable): Called with a dict mapping each input name to that step's result.
+        inputs (list, optional): Names of the steps that must finish first.
+        outputs (list, optional): Files the step produces, hashed into the run journal.
+        fingerprint (callable, optional): Called with the step inputs; returns JSON-serializable
+            data (e.g. the rendered prompt) that must match for a journaled result to be reused.
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), fingerprint=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.fingerprint = fingerprint
+
+    def inputs_hash(self, step_inputs):
+        """Hash of everything that determines this step's result."""
+        extra = self.fingerprint(step_inputs) if self.fingerprint else None
+        return journal_fingerprint({"step": self.name, "inputs": step_inputs, "extra": extra})
+
+    def __repr__(self):
+        return f"Step({self.name!r}, inputs={self.inputs!r})"
+
+
+def _run_traced(step, step_inputs):
+    with span(step.name, "step"):
+        return step.func(step_inputs)
+
+
+def check_steps(steps):
+    """Raises ValueError for duplicate names, unknown inputs or dependency cycles."""
+    by_name = {}
+    for step in steps:
+        if step.name in by_name:
+            raise ValueError(f"Duplicate step name: {step.name}")
+        by_name[step.name] = step
+    for step in steps:
+        for name in step.inputs:
+            if name not in by_name:
+                raise ValueError(f"Step {step.name} depends on unknown step {name}")
+
+    # Kahn's algorithm: anything left over after peeling ready steps is a cycle.
+    remaining = {step.name: set(step.inputs) for step in steps}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Dependency cycle between steps: {', '.join(sorted(remaining))}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+def run_steps(steps, max_workers=4, journal=None):
+    """
+    Runs the steps on a thread pool, each one as soon as its inputs are done.
+    Returns a dict mapping step name to its result. The first step that raises
+    (including SystemExit from exit(1)) stops scheduling and is re-raised here
+    once the steps that already started have finished, so none of them outlives
+    the run (a warm daemon worker reuses the process for the next job).
+    With a journal, every completed step is recorded, and steps the journal
+    reports as unchanged since the last run are skipped with their recorded result.
+    """
+    check_steps(steps)
+    by_name = {step.name: step for step in steps}
+    results = {}
+    hashes = {}
+    pending = dict(by_name)
+    running = {}
+    started = time.monotonic()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="step")
+    try:
+        while pending or running:
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for name, step in list(pending.items()):
+                    if not all(dep in results for dep in step.inputs):
+                        continue
+                    del pending[name]
+                    scheduled = True
+                    step_inputs = {dep: results[dep] for dep in step.inputs}
+                    if journal is not None:
+                        hashes[name] = step.inputs_hash(step_inputs)
+                        fresh, result = journal.lookup(name, hashes[name], step.outputs)
+                        if fresh:
+                            results[name] = result
+                            print(f"\n[pipeline] Skipping step '{name}' (unchanged since last run)")
+                            continue
+                    print(f"\n[pipeline] Starting step '{name}' (+{time.monotonic() - started:.1f}s)")
+                    running[executor.submit(_run_traced, step, step_inputs)] = name
+
+            if not running:
+                continue
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                if journal is not None:
+                    journal.record(name, hashes[name], by_name[name].outputs, results[name])
+                print(f"[pipeline] Finished step '{name}' (+{time.monotonic() - started:.1f}s)")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return results
@@ -0,0 +1,129 @@
+"""
+Isolated per-run directories, so several pipelines can run on one host.
+
+Every run normally reads and writes the current directory: main.tf,
+backend-bootstrap/, src/, .terraform and .git. With --isolated, a run instead
+works in a fresh directory under .runs/<run id>/ that starts as a snapshot of
+the project:
+
+- Files are hardlinked (copied when linking fails, e.g. across filesystems).
+  This is safe because everything the generator writes goes through a temp
+  file and os.replace(), which swaps the run's link for a new file and leaves
+  the shared inode alone. Terraform state is the exception: Terraform rewrites
+  it in place, so *.tfstate files are always copied.
+- .git is cloned with `git clone --local`, which hardlinks the object store, so
+  each run commits on its own index and HEAD.
+- .terraform, caches and other runs are never snapshotted. Providers come from
+  the shared plugin cache (see terraform_init.py).
+
+Writes that must stay shared between runs (the LLM cache, the backend registry,
+the final push) are pointed at the project directory and serialized with
+file_lock().
+"""
+import contextlib
+import fnmatch
+import os
+import shutil
+import time
+import uuid
+
+from runner import run_command
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks are no-ops
+    fcntl = None
+
+DEFAULT_RUNS_DIR = ".runs"
+
+# Never snapshotted into a run directory (matched against every path component).
+SKIPPED_NAMES = (".git", ".terraform", DEFAULT_RUNS_DIR, ".llm_cache", ".llm_recordings", "__pycache__", "*.lock")
+
+# Rewritten in place by Terraform, so a hardlink would leak one run's writes into the others.
+COPIED_PATTERNS = ("*.tfstate", "*.tfstate.backup")
+
+
+def new_run_id():
+    """Sortable, collision-free run id, e.g. 20240501-142233-1f3a9c2e."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def _matches(name, patterns):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def link_or_copy(src, dst):
+    """Hardlinks src to dst, falling back to a copy. Returns True if a link was made."""
+    if not _matches(os.path.basename(src), COPIED_PATTERNS):
+        try:
+            os.link(src, dst)
+            return True
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return False
+
+
+def snapshot_tree(base, target):
+    """Links (or copies) every file under base into target. Returns (linked, copied) counts."""
+    linked = copied = 0
+    for directory, dirnames, filenames in os.walk(base):
+        dirnames[:] = [d for d in dirnames if not _matches(d, SKIPPED_NAMES)]
+        relative = os.path.relpath(directory, base)
+        os.makedirs(os.path.join(target, relative), exist_ok=True)
+        for name in filenames:
+            if _matches(name, SKIPPED_NAMES):
+                continue
+            src = os.path.join(directory, name)
+            if os.path.islink(src) or not os.path.isfile(src):
+                continue
+            if link_or_copy(src, os.path.join(target, relative, name)):
+                linked += 1
+            else:
+                copied += 1
+    return linked, copied
+
+
+def create_run_dir(base=".", runs_dir=DEFAULT_RUNS_DIR, run_id=None):
+    """
+    Creates <base>/<runs_dir>/<run_id> as a snapshot of base and returns its absolute path.
+    Raises FileExistsError if the run directory already exists.
+    """
+    base = os.path.abspath(base)
+    path = os.path.join(base, runs_dir, run_id or new_run_id())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.isdir(os.path.join(base, ".git")):
+        # Clone first: git refuses to clone into a non-empty directory.
+        result = run_command(["git", "clone", "--quiet", "--local", "--no-checkout", base, path],
+                             echo=False, timeout=300)
+        if not result.ok:
+            raise OSError(f"git clone of {base} failed:\n{result.error_report()}")
+        # Populate the index from HEAD so only real changes show up as staged later.
+        run_command(["git", "reset", "--quiet"], cwd=path, echo=False, timeout=300)
+    else:
+        os.makedirs(path)
+    linked, copied = snapshot_tree(base, path)
+    print(f"Run directory {path} ({linked} file(s) linked, {copied} copied)")
+    return path
+
+
+@contextlib.contextmanager
+def file_lock(path, description=None):
+    """
+    Holds an exclusive advisory lock on path (created if missing) for the duration of the block.
+    Blocks until other processes holding the same lock release it.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl is None:
+            yield
+            return
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"Waiting for {description or path} (held by another run)...")
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,164 @@
+"""
+Subprocess runner shared by the Terraform and git helpers.
+
+Output is streamed line by line as it arrives instead of being buffered until
+the command exits. Only a bounded tail of each stream is kept in memory for
+error reports, unless the caller asks for the full stdout (e.g. for
+`terraform output -json`). Every command's wall-clock time and exit status is
+recorded in COMMAND_LOG.
+"""
+import collections
+import os
+import subprocess
+import threading
+import time
+
+from tracing import span
+
+DEFAULT_TAIL_LINES = 200
+
+# Seconds to wait after terminate() before a timed-out command is killed.
+KILL_GRACE_SECONDS = 10
+
+COMMAND_LOG = []
+_COMMAND_LOG_LOCK = threading.Lock()
+
+
+class CommandResult:
+    """Outcome of one command: exit status, timing and the retained output."""
+
+    def __init__(self, args, cwd):
+        self.args = list(args)
+        self.cwd = cwd
+        self.returncode = None
+        self.duration = 0.0
+        self.timed_out = False
+        self.stdout = None  # Full stdout, only when capture_stdout=True
+        self.stdout_tail = []
+        self.stderr_tail = []
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out
+
+    @property
+    def command(self):
+        return " ".join(self.args)
+
+    def error_report(self):
+        """Last lines of stdout and stderr, for printing after a failure."""
+        status = "timed out" if self.timed_out else f"exit status {self.returncode}"
+        return (
+            f"Command failed ({status} after {self.duration:.1f}s): {self.command}\n"
+            f"Last stdout lines:\n{''.join(self.stdout_tail)}\n"
+            f"Last stderr lines:\n{''.join(self.stderr_tail)}"
+        )
+
+
+def _pump(stream, tail, prefix, echo, full=None):
+    for line in iter(stream.readline, ""):
+        tail.append(line)
+        if full is not None:
+            full.append(line)
+        if echo:
+            print(f"{prefix}{line}", end="" if line.endswith("\n") else "\n", flush=True)
+    stream.close()
+
+
+def run_command(args, cwd=None, timeout=None, env=None, input_text=None,
+                echo=True, capture_stdout=False, tail_lines=DEFAULT_TAIL_LINES, label=None):
+    """
+    Runs a command without a shell and streams its output live.
+    Args:
+        args (list): Command and arguments.
+        cwd (str, optional): Working directory.
+        timeout (float, optional): Seconds before the command is terminated (then killed).
+        env (dict, optional): Extra environment variables layered over os.environ.
+        input_text (str, optional): Text written to the command's stdin.
+        echo (bool): Print output lines as they arrive, prefixed with the label.
+        capture_stdout (bool): Keep the complete stdout in result.stdout.
+        tail_lines (int): Lines of each stream retained for error reports.
+        label (str, optional): Output prefix, defaults to the program name.
+    Returns:
+        CommandResult. Raises FileNotFoundError if the program is not installed.
+    """
+    program = label or os.path.basename(args[0])
+    with span(" ".join(args), program, cwd=cwd) as command_span:
+        result = _run_command(args, cwd, timeout, env, input_text, echo, capture_stdout, tail_lines, program)
+        command_span.set(exit_status=result.returncode, timed_out=result.timed_out)
+    return result
+
+
+def _run_command(args, cwd, timeout, env, input_text, echo, capture_stdout, tail_lines, program):
+    result = CommandResult(args, cwd)
+    prefix = f"[{program}] "
+    full_env = dict(os.environ, **env) if env else None
+    started = time.monotonic()
+
+    process = subprocess.Popen(
+        args,
+        cwd=cwd,
+        env=full_env,
+        stdin=subprocess.PIPE if input_text is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+    )
+    stdout_tail = collections.deque(maxlen=tail_lines)
+    stderr_tail = collections.deque(maxlen=tail_lines)
+    stdout_full = [] if capture_stdout else None
+    readers = [
+        threading.Thread(target=_pump, args=(process.stdout, stdout_tail, prefix, echo and not capture_stdout, stdout_full), daemon=True),
+        threading.Thread(target=_pump, args=(process.stderr, stderr_tail, prefix, echo), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    if input_text is not None:
+        try:
+            process.stdin.write(input_text)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        result.timed_out = True
+        process.terminate()
+        try:
+            process.wait(timeout=KILL_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    for reader in readers:
+        reader.join()
+
+    result.returncode = process.returncode
+    result.duration = time.monotonic() - started
+    result.stdout_tail = list(stdout_tail)
+    result.stderr_tail = list(stderr_tail)
+    if capture_stdout:
+        result.stdout = "".join(stdout_full)
+    with _COMMAND_LOG_LOCK:
+        COMMAND_LOG.append(result)
+    return result
+
+
+def clear_command_log():
+    with _COMMAND_LOG_LOCK:
+        COMMAND_LOG.clear()
+
+
+def command_summary():
+    """One line per command run so far: status, wall-clock time and the command."""
+    with _COMMAND_LOG_LOCK:
+        results = list(COMMAND_LOG)
+    if not results:
+        return "No commands were run."
+    lines = ["Command timings:"]
+    for result in results:
+        status = "TIMEOUT" if result.timed_out else f"exit {result.returncode}"
+        lines.append(f"  {result.duration:8.1f}s  {status:<8}  {result.command}  (in {result.cwd or '.'})")
+    return "\n".join(lines)
@@ -0,0 +1,95 @@
+"""
+Shared provider cache and init skipping for Terraform working directories.
+
+Every Terraform command is run with TF_PLUGIN_CACHE_DIR pointing at one cache
+shared by all directories and runs, so a provider is downloaded once instead
+of on every `terraform init`.
+
+After a successful init, a manifest of everything init depends on is written
+to <directory>/.terraform/init_manifest.json: the dependency lock file, the
+terraform blocks (backend config, required providers), the module blocks and
+the providers implied by resource types. While the manifest still matches, init
+can be skipped entirely. The manifest lives inside .terraform, so deleting that
+directory also forces a fresh init.
+"""
+import glob
+import json
+import os
+import tempfile
+
+from hcl import HclParseError, parse_blocks
+from journal import file_sha256, fingerprint
+
+DEFAULT_PLUGIN_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".terraform.d", "plugin-cache")
+MANIFEST_NAME = "init_manifest.json"
+
+
+def plugin_cache_dir():
+    """The shared cache directory: $TF_PLUGIN_CACHE_DIR if set, else ~/.terraform.d/plugin-cache."""
+    return os.environ.get("TF_PLUGIN_CACHE_DIR") or DEFAULT_PLUGIN_CACHE_DIR
+
+
+def terraform_env():
+    """Environment overrides for Terraform commands, creating the cache directory if needed."""
+    cache_dir = plugin_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    return {
+        "TF_PLUGIN_CACHE_DIR": cache_dir,
+        # Without this, Terraform 1.4+ re-downloads any provider whose checksums are not yet
+        # in the lock file (e.g. in a freshly generated directory) instead of using the cache.
+        "TF_PLUGIN_CACHE_MAY_BREAK_DEPENDENCY_LOCK_FILE": "true",
+    }
+
+
+def init_fingerprint(directory, init_args=()):
+    """
+    Hash of everything `terraform init` depends on in a directory.
+    Returns None when a .tf file cannot be parsed, so init is never skipped on a guess.
+    """
+    inputs = {
+        "args": list(init_args),
+        "lock_file": file_sha256(os.path.join(directory, ".terraform.lock.hcl")),
+        "blocks": [],
+        "providers": set(),
+    }
+    for path in sorted(glob.glob(os.path.join(directory, "*.tf"))):
+        try:
+            with open(path, "r") as f:
+                blocks = parse_blocks(f.read())
+        except (OSError, HclParseError):
+            return None
+        for block in blocks:
+            if block.type in ("terraform", "module", "provider"):
+                inputs["blocks"].append(block.text)
+            elif block.type in ("resource", "data") and block.labels:
+                inputs["providers"].add(block.labels[0].split("_")[0])
+    inputs["providers"] = sorted(inputs["providers"])
+    return fingerprint(inputs)
+
+
+def _manifest_path(directory):
+    return os.path.join(directory, ".terraform", MANIFEST_NAME)
+
+
+def init_is_current(directory, init_hash):
+    """True if the last successful init in directory was done with the same inputs."""
+    if not init_hash:
+        return False
+    try:
+        with open(_manifest_path(directory), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return manifest.get("init_hash") == init_hash
+
+
+def record_init(directory, init_hash):
+    """Writes the manifest after a successful init (the lock file may have just been created)."""
+    if not init_hash:
+        return
+    path = _manifest_path(directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"init_hash": init_hash, "plugin_cache_dir": plugin_cache_dir()}, f, indent=2)
+    os.replace(tmp_path, path)
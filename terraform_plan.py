@@ -0,0 +1,79 @@
+"""
+Saved-plan helpers: summarize `terraform show -json <planfile>` as resource changes.
+
+Applying goes through `terraform plan -out=<planfile>` first. The saved plan is
+inspected, apply is skipped when it contains no changes, and otherwise the
+exact plan that was summarized is applied, without a second refresh/plan cycle.
+"""
+import json
+
+from runner import run_command
+
+DEFAULT_PLAN_FILE = "tfplan"
+
+# Change buckets in the order they are reported.
+CHANGE_KINDS = ("add", "change", "replace", "destroy")
+
+
+def _change_kind(actions):
+    actions = list(actions)
+    if actions == ["create"]:
+        return "add"
+    if actions == ["update"]:
+        return "change"
+    if actions == ["delete"]:
+        return "destroy"
+    if sorted(actions) == ["create", "delete"]:
+        return "replace"
+    return None  # no-op, read
+
+
+def summarize_plan(plan):
+    """
+    Structured change summary of a plan in `terraform show -json` format.
+    Returns {"add": [...], "change": [...], "replace": [...], "destroy": [...], "outputs": [...]}
+    with resource addresses and the names of outputs whose values change.
+    """
+    summary = {kind: [] for kind in CHANGE_KINDS}
+    for resource in plan.get("resource_changes", []):
+        kind = _change_kind(resource.get("change", {}).get("actions", []))
+        if kind:
+            summary[kind].append(resource.get("address"))
+    summary["outputs"] = sorted(
+        name for name, change in plan.get("output_changes", {}).items()
+        if change.get("actions", ["no-op"]) != ["no-op"]
+    )
+    return summary
+
+
+def plan_is_empty(summary):
+    return not any(summary[kind] for kind in CHANGE_KINDS) and not summary["outputs"]
+
+
+def format_plan_summary(summary):
+    """'Plan: 2 to add, 1 to change, 0 to replace, 0 to destroy.' plus one line per resource."""
+    counts = ", ".join(f"{len(summary[kind])} to {kind}" for kind in CHANGE_KINDS)
+    lines = [f"Plan: {counts}."]
+    symbols = {"add": "+", "change": "~", "replace": "-/+", "destroy": "-"}
+    for kind in CHANGE_KINDS:
+        lines.extend(f"  {symbols[kind]:>3} {address}" for address in summary[kind])
+    if summary["outputs"]:
+        lines.append(f"  Changed outputs: {', '.join(summary['outputs'])}")
+    return "\n".join(lines)
+
+
+def show_plan(directory, plan_file=DEFAULT_PLAN_FILE, env=None, timeout=120):
+    """
+    Runs `terraform show -json <plan_file>` and returns its change summary.
+    Returns None if the command fails or prints something that is not a plan.
+    """
+    result = run_command(["terraform", "show", "-json", plan_file], cwd=directory, timeout=timeout, env=env,
+                         echo=False, capture_stdout=True)
+    if not result.ok:
+        print(result.error_report())
+        return None
+    try:
+        return summarize_plan(json.loads(result.stdout))
+    except (ValueError, AttributeError) as e:
+        print(f"Warning: Could not parse terraform show -json output: {e}")
+        return None
@@ -0,0 +1,37 @@
+"""
+Behaviour tests for the code-block extractor.
+
+Run with: python -m pytest -q test_codeblocks.py
+"""
+from codeblocks import StreamingBlockParser, extract_code_block, extract_multiple_code_blocks
+
+
+def test_section_banner_before_closing_fence_stays_in_the_block():
+    response = '### main.tf hcl\n```hcl\nresource "a" "b" {}\n### end of outputs\n```\n'
+    assert extract_code_block(response, "main.tf", "hcl") == 'resource "a" "b" {}\n### end of outputs'
+
+
+def test_unterminated_block_is_dropped_at_the_next_tagged_header():
+    response = "### a.tf hcl\n```hcl\nx = 1\n### b.tf hcl\n```hcl\ny = 2\n```\n"
+    assert extract_multiple_code_blocks(response, {"a.tf": "hcl", "b.tf": "hcl"}) == {"a.tf": None, "b.tf": "y = 2"}
+
+
+def test_unterminated_block_is_dropped_at_an_expected_header_with_a_bare_fence():
+    response = "### a.tf hcl\n```hcl\nx = 1\n### b.tf hcl\n```\ny = 2\n```\n"
+    assert extract_multiple_code_blocks(response, {"a.tf": "hcl", "b.tf": "hcl"}) == {"a.tf": None, "b.tf": "y = 2"}
+
+
+def test_nested_fence_in_heredoc_does_not_close_the_block():
+    body = 'user_data = <<-EOF\n  ```bash\n  echo hi\n  ```\nEOF'
+    response = f"### main.tf hcl\n```hcl\n{body}\n```\n"
+    assert extract_code_block(response, "main.tf", "hcl") == body
+
+
+def test_streaming_parser_completes_blocks_across_chunk_boundaries():
+    response = "### a.yml yaml\r\n```yaml\r\non: push\r\n### Jobs\r\n```\r\n### b.tf hcl\n```hcl\nx = 1\n```"
+    parser = StreamingBlockParser(["a.yml", "b.tf"])
+    completed = []
+    for i in range(0, len(response), 7):
+        completed.extend(parser.feed(response[i:i + 7]))
+    completed.extend(parser.close())
+    assert completed == [("a.yml", "yaml", "on: push\n### Jobs"), ("b.tf", "hcl", "x = 1")]
@@ -0,0 +1,90 @@
+"""
+Behaviour tests for HCL block parsing and resource-level edits.
+
+Run with: python -m pytest -q test_hcl.py
+"""
+import pytest
+
+from hcl import Contract, EditConflict, HclParseError, apply_edits, parse_blocks, validate_hcl
+
+BASE = '''resource "aws_s3_bucket" "logs" {
+  bucket = "logs-${var.env}"
+}
+
+resource "aws_instance" "web" {
+  user_data = <<-EOF
+    echo "{ not a brace }"
+  EOF
+}
+'''
+
+
+def keys(text):
+    return [block.key for block in parse_blocks(text)]
+
+
+def test_blocks_are_delimited_past_strings_and_heredocs():
+    assert keys(BASE) == ["resource.aws_s3_bucket.logs", "resource.aws_instance.web"]
+
+
+def test_replaces_an_existing_block_and_leaves_the_rest_alone():
+    edit = 'resource "aws_s3_bucket" "logs" {\n  bucket = "new"\n}'
+    patched = apply_edits(BASE, BASE, edit)
+    assert 'bucket = "new"' in patched
+    assert patched.endswith(BASE[BASE.index('resource "aws_instance"'):])
+
+
+def test_adds_new_blocks_and_deletes_old_ones():
+    edit = 'output "bucket" {\n  value = aws_s3_bucket.logs.id\n}\n# delete resource.aws_instance.web'
+    patched = apply_edits(BASE, BASE, edit)
+    assert keys(patched) == ["resource.aws_s3_bucket.logs", "output.bucket"]
+
+
+def test_block_changed_on_disk_since_the_base_is_a_conflict():
+    current = BASE.replace('"logs-${var.env}"', '"logs-prod"')
+    with pytest.raises(EditConflict, match="modified since"):
+        apply_edits(BASE, current, 'resource "aws_s3_bucket" "logs" {\n  bucket = "new"\n}')
+
+
+def test_deleting_a_missing_block_and_empty_edits_are_conflicts():
+    with pytest.raises(EditConflict, match="no such block"):
+        apply_edits(BASE, BASE, "# delete resource.aws_vpc.main")
+    with pytest.raises(EditConflict, match="no blocks"):
+        apply_edits(BASE, BASE, "")
+
+
+def test_unbalanced_edit_is_a_parse_error():
+    with pytest.raises(HclParseError):
+        apply_edits(BASE, BASE, 'resource "aws_s3_bucket" "logs" {\n  bucket = "new"\n')
+
+
+BACKEND_CONTRACT = Contract(required=["resource.aws_s3_bucket", "output.bucket|output.bucket_name"],
+                            forbidden=["provider", "terraform.backend"])
+
+
+def test_contract_passes_when_required_blocks_are_present():
+    text = 'resource "aws_s3_bucket" "state" {\n  bucket = "x"\n}\noutput "bucket_name" {\n  value = "x"\n}\n'
+    assert validate_hcl(text, BACKEND_CONTRACT) == []
+
+
+def test_contract_reports_missing_and_forbidden_blocks():
+    text = ('terraform {\n  backend "s3" {}\n}\nprovider "aws" {\n  region = "eu-west-1"\n}\n'
+            'resource "aws_s3_bucket" "state" {}\n')
+    assert validate_hcl(text, BACKEND_CONTRACT) == [
+        "missing required block output.bucket or output.bucket_name",
+        "forbidden block provider.aws",
+        "forbidden block terraform.backend.s3",
+    ]
+
+
+def test_allowed_types_and_label_counts_are_checked():
+    text = 'variable "region" {}\nresource "aws_vpc" {}\n'
+    assert validate_hcl(text, Contract(allowed_types=["variable"])) == [
+        "'resource \"aws_vpc\"' should have 2 label(s), not 1",
+        "'resource \"aws_vpc\"' is not allowed here (only variable blocks)",
+    ]
+
+
+def test_unparseable_file_reports_the_parse_error():
+    problems = validate_hcl('resource "aws_vpc" "main" {\n  cidr_block = "10.0.0.0/16"\n', BACKEND_CONTRACT)
+    assert len(problems) == 1
@@ -0,0 +1,39 @@
+"""
+Behaviour tests for the JSON output mode.
+
+Run with: python -m pytest -q test_json_output.py
+"""
+import json
+
+from json_output import decode_files
+
+FILES = {"main.tf": "hcl", "backend-bootstrap/main.tf": "hcl"}
+
+
+def response(*entries):
+    return json.dumps({"files": [dict(zip(("path", "language", "content"), entry)) for entry in entries]})
+
+
+def test_decodes_requested_files_and_ignores_others():
+    text = response(("main.tf", "hcl", "  a = 1\n"), ("backend-bootstrap/main.tf", "hcl", "b = 2"), ("x.tf", "hcl", "c"))
+    assert decode_files(text, FILES) == ({"main.tf": "a = 1", "backend-bootstrap/main.tf": "b = 2"}, [])
+
+
+def test_path_that_is_a_substring_of_a_reported_path_is_still_missing():
+    blocks, problems = decode_files(response(("backend-bootstrap/main.tf", "hcl", "")), FILES)
+    assert blocks == {"main.tf": None, "backend-bootstrap/main.tf": None}
+    assert problems == ["backend-bootstrap/main.tf: content is empty.", "main.tf: missing from the response."]
+
+
+def test_fenced_json_is_accepted():
+    text = "```json\n" + response(("main.tf", "hcl", "a = 1")) + "\n```"
+    blocks, _ = decode_files(text, {"main.tf": "hcl"})
+    assert blocks == {"main.tf": "a = 1"}
+
+
+def test_malformed_entries_and_invalid_json_are_reported():
+    blocks, problems = decode_files(json.dumps({"files": [{"path": "main.tf"}]}), {"main.tf": "hcl"})
+    assert blocks == {"main.tf": None}
+    assert problems == ['files[0] must be an object with string "path", "language" and "content".',
+                        "main.tf: missing from the response."]
+    assert decode_files("not json", {"main.tf": "hcl"})[1][0].startswith("The response was not valid JSON")
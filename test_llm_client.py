@@ -0,0 +1,89 @@
+"""
+Behaviour tests for the rate-limited model client.
+
+Run with: python -m pytest -q test_llm_client.py
+"""
+import pytest
+
+import llm_client
+from llm_client import LLMCallError, RateLimitedBackend, backoff_delay, is_retryable, retry_hint
+
+
+class Throttled(Exception):
+    code = 429
+
+
+class BadRequest(Exception):
+    code = 400
+
+
+class FlakyBackend:
+    """Fails with the queued errors, then returns "ok"."""
+    model_name = "test-model"
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def generate(self, prompt, generation_config, timeout=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(llm_client.time, "sleep", slept.append)
+    return slept
+
+
+def make_client(inner, **kwargs):
+    return RateLimitedBackend(inner, requests_per_minute=6000, **kwargs)
+
+
+def test_retries_throttling_with_the_server_hint_as_a_floor(sleeps):
+    inner = FlakyBackend(Throttled("quota exceeded, retry in 2s"), ConnectionError("reset"))
+    client = make_client(inner)
+    assert client.generate("p", {}) == "ok"
+    assert inner.calls == 3
+    assert 2.0 <= sleeps[0] <= 2.4
+    assert client.last_call()["retries"] == 2
+    assert client.summary().startswith("LLM client: 1 call(s), 2 retries, 0 failed")
+
+
+def test_non_retryable_errors_are_raised_at_once(sleeps):
+    inner = FlakyBackend(BadRequest("invalid argument"))
+    with pytest.raises(BadRequest):
+        make_client(inner).generate("p", {})
+    assert inner.calls == 1 and sleeps == []
+
+
+def test_gives_up_after_max_retries(sleeps):
+    inner = FlakyBackend(*[Throttled("busy") for _ in range(5)])
+    with pytest.raises(LLMCallError, match="Gave up after 3 attempt"):
+        make_client(inner, max_retries=2).generate("p", {})
+    assert inner.calls == 3
+
+
+def test_cancelled_call_stops_retrying_and_is_not_recorded(sleeps):
+    inner = FlakyBackend(Throttled("busy"), Throttled("busy"))
+    client = make_client(inner)
+    client.set_cancel_check(lambda: True)
+    with pytest.raises(LLMCallError, match="abandoned"):
+        client.generate("p", {})
+    assert inner.calls == 1
+    assert client.summary() == "LLM client: no calls"
+
+
+def test_backoff_is_capped_and_jittered(monkeypatch):
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: high)
+    assert [backoff_delay(attempt, base=1, cap=10) for attempt in range(5)] == [1, 2, 4, 8, 10]
+    assert backoff_delay(0, hint=30, base=1, cap=10) == pytest.approx(36)
+
+
+def test_retry_classification_and_hints():
+    assert is_retryable(Throttled()) and is_retryable(TimeoutError()) and not is_retryable(BadRequest())
+    assert retry_hint(Exception("Please retry after 250ms")) == 0.25
+    assert retry_hint(Exception("no hint")) is None
@@ -0,0 +1,55 @@
+"""
+Regression test for --resume after a late step fails.
+
+Run with: python -m pytest -q test_resume.py
+"""
+import os
+
+import lambda1
+from pipeline import Step
+from workspace import Workspace
+
+
+def make_steps(calls, fail_workflow):
+    def staging(name, path):
+        def run(inputs):
+            calls.append(name)
+            lambda1.write_file(path, f"{name} output\n")
+            return name
+        return run
+
+    def workflow(inputs):
+        calls.append("workflow")
+        lambda1.write_file(".github/workflows/deploy.yml", "on: push\n")
+        if fail_workflow:
+            exit(1)
+        return "workflow"
+
+    return [
+        Step("core_infra", staging("core_infra", "variables.tf"), outputs=["variables.tf"]),
+        Step("lambda_alb", staging("lambda_alb", "main.tf"), inputs=["core_infra"], outputs=["main.tf"]),
+        Step("workflow", workflow, inputs=["lambda_alb"], outputs=[".github/workflows/deploy.yml"]),
+    ]
+
+
+def test_resume_skips_steps_finished_before_a_late_failure(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(lambda1, "WORKSPACE", Workspace())
+
+    calls = []
+    try:
+        lambda1.run_pipeline(make_steps(calls, fail_workflow=True))
+    except SystemExit:
+        pass
+    else:
+        raise AssertionError("the workflow step should have failed")
+    assert calls == ["core_infra", "lambda_alb", "workflow"]
+    assert os.path.exists("variables.tf") and os.path.exists("main.tf")
+    assert not os.path.exists(".github/workflows/deploy.yml")
+
+    monkeypatch.setattr(lambda1, "WORKSPACE", Workspace())
+    calls.clear()
+    results = lambda1.run_pipeline(make_steps(calls, fail_workflow=False), resume=True)
+    assert calls == ["workflow"]
+    assert results == {"core_infra": "core_infra", "lambda_alb": "lambda_alb", "workflow": "workflow"}
+    assert os.path.exists(".github/workflows/deploy.yml")
@@ -0,0 +1,48 @@
+"""
+Behaviour tests for token budgets and prompt compression.
+
+Run with: python -m pytest -q test_token_budget.py
+"""
+import pytest
+
+from token_budget import TokenBudget, TokenBudgetExceeded, compress_prompt
+
+PROMPT = ("Update this file:\n# keep this instruction line\n"
+          "```hcl\n# a comment\n\nresource \"a\" \"b\" {}   \n  // another\n```\nThanks.")
+
+
+def count_chars(prompt):
+    return len(prompt)
+
+
+def test_compression_only_touches_fenced_code():
+    assert compress_prompt(PROMPT) == ("Update this file:\n# keep this instruction line\n"
+                                       "```hcl\nresource \"a\" \"b\" {}\n```\nThanks.")
+
+
+def test_prompt_within_budget_is_sent_unchanged():
+    budget = TokenBudget(prompt_budget=len(PROMPT), counter=count_chars)
+    assert budget.fit("stage", PROMPT) == (PROMPT, len(PROMPT))
+
+
+def test_compress_policy_sends_the_compressed_prompt_when_it_fits():
+    compressed = compress_prompt(PROMPT)
+    budget = TokenBudget(prompt_budget=len(compressed), counter=count_chars)
+    assert budget.fit("stage", PROMPT) == (compressed, len(compressed))
+
+
+def test_over_budget_after_compression_raises_unless_warning():
+    with pytest.raises(TokenBudgetExceeded, match="stage prompt budget"):
+        TokenBudget(prompt_budget=10, counter=count_chars).fit("stage", PROMPT)
+    with pytest.raises(TokenBudgetExceeded):
+        TokenBudget(prompt_budget=len(PROMPT) - 1, policy="fail", counter=count_chars).fit("stage", PROMPT)
+    assert TokenBudget(prompt_budget=10, policy="warn", counter=count_chars).fit("stage", PROMPT) == (PROMPT, len(PROMPT))
+
+
+def test_stage_budgets_override_the_default_and_the_run_budget_shrinks():
+    budget = TokenBudget(prompt_budget=10, stage_budgets={"big": 1000}, run_budget=200, counter=count_chars)
+    assert budget.fit("big", PROMPT)[1] == len(PROMPT)
+    budget.record("big", len(PROMPT), "ok", {"total_tokens": 150})
+    with pytest.raises(TokenBudgetExceeded, match="remaining run budget"):
+        budget.fit("big", PROMPT)
+    assert "big" in budget.summary() and "150 total of 200 budget" in budget.summary()
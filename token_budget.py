@@ -0,0 +1,152 @@
+"""
+Prompt-size accounting and token budgets.
+
+Before a prompt is sent, its tokens are counted (estimated locally, or with
+the model's count_tokens API) and checked against two limits:
+
+- a per-stage prompt budget (--prompt-token-budget, --stage-token-budget), and
+- a per-run budget on total tokens actually used (--run-token-budget).
+
+What happens to a prompt over budget depends on the policy:
+
+    warn      send it anyway and print a warning
+    compress  strip comments and blank lines from the code embedded in the
+              prompt, then fail if it is still over budget
+    fail      refuse to send it
+
+Usage reported by the model is recorded per stage and for the run, and
+summary() prints both. Calls served from the LLM cache use no tokens.
+"""
+import math
+import re
+import threading
+
+BUDGET_POLICIES = ("warn", "compress", "fail")
+
+# Rough average for English text and code with Gemini's tokenizer.
+CHARS_PER_TOKEN = 4
+
+_FENCED = re.compile(r"(```[^\n]*\n)(.*?)(\n```)", re.DOTALL)
+_COMMENT_LINE = re.compile(r"^\s*(#|//)")
+
+
+class TokenBudgetExceeded(RuntimeError):
+    """Raised when a prompt does not fit its stage or run budget under the current policy."""
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def compress_code(code):
+    """Drops full-line comments, trailing whitespace and blank lines."""
+    lines = (line.rstrip() for line in code.splitlines())
+    return "\n".join(line for line in lines if line and not _COMMENT_LINE.match(line))
+
+
+def compress_prompt(prompt):
+    """
+    compress_code() applied to every fenced block of the prompt, i.e. the file contents
+    given as context. The instructions around them are left alone.
+    """
+    return _FENCED.sub(lambda m: m.group(1) + compress_code(m.group(2)) + m.group(3), prompt)
+
+
+class TokenBudget:
+    """
+    Per-stage and per-run token limits plus usage accounting. Thread-safe.
+    Args:
+        prompt_budget (int, optional): Default prompt token limit for every stage.
+        stage_budgets (dict, optional): Prompt token limits by stage name, overriding prompt_budget.
+        run_budget (int, optional): Limit on total tokens used by the run.
+        policy (str): One of BUDGET_POLICIES.
+        counter (callable, optional): prompt -> token count; defaults to estimate_tokens.
+    """
+
+    def __init__(self, prompt_budget=None, stage_budgets=None, run_budget=None, policy="compress", counter=None):
+        if policy not in BUDGET_POLICIES:
+            raise ValueError(f"Unknown budget policy: {policy}")
+        self.prompt_budget = prompt_budget
+        self.stage_budgets = dict(stage_budgets or {})
+        self.run_budget = run_budget
+        self.policy = policy
+        self.counter = counter or estimate_tokens
+        self.stages = {}  # stage -> {"calls", "prompt_tokens", "output_tokens", "total_tokens"}
+        self.run_tokens = 0
+        self._lock = threading.Lock()
+
+    def stage_budget(self, stage):
+        return self.stage_budgets.get(stage, self.prompt_budget)
+
+    def _limit(self, stage):
+        """The tightest limit for the next prompt of stage, and what it comes from."""
+        limits = []
+        if self.stage_budget(stage) is not None:
+            limits.append((self.stage_budget(stage), f"{stage} prompt budget"))
+        if self.run_budget is not None:
+            with self._lock:
+                limits.append((self.run_budget - self.run_tokens, "remaining run budget"))
+        return min(limits) if limits else (None, None)
+
+    def over_budget(self, stage, prompt):
+        """True if prompt, as is, does not fit the budgets for stage."""
+        limit, _ = self._limit(stage)
+        return limit is not None and self.counter(prompt) > limit
+
+    def fit(self, stage, prompt):
+        """
+        Returns (prompt to send, its token count), compressed if the policy allows and it is needed.
+        Raises TokenBudgetExceeded when the prompt cannot be made to fit and the policy is not "warn".
+        """
+        tokens = self.counter(prompt)
+        limit, source = self._limit(stage)
+        if limit is None or tokens <= limit:
+            return prompt, tokens
+        if self.policy == "compress":
+            compressed = compress_prompt(prompt)
+            compressed_tokens = self.counter(compressed)
+            print(f"[tokens] {stage}: prompt of {tokens:,} tokens is over the {source} ({limit:,}); "
+                  f"compressed embedded code to {compressed_tokens:,} tokens")
+            prompt, tokens = compressed, compressed_tokens
+            if tokens <= limit:
+                return prompt, tokens
+        if self.policy == "warn":
+            print(f"Warning: [tokens] {stage}: sending a prompt of {tokens:,} tokens, over the {source} ({limit:,})")
+            return prompt, tokens
+        raise TokenBudgetExceeded(f"{stage}: prompt of {tokens:,} tokens is over the {source} ({limit:,})")
+
+    def record(self, stage, prompt_tokens, response, usage):
+        """
+        Adds one call's usage to the stage and run totals and prints it. usage is the model's
+        token counts; when the model reports none, prompt_tokens (the pre-send count) and an
+        estimate for the response text stand in.
+        """
+        prompt_used = usage.get("prompt_tokens") or prompt_tokens
+        output_used = usage.get("output_tokens") or estimate_tokens(response)
+        total_used = usage.get("total_tokens") or prompt_used + output_used
+        with self._lock:
+            totals = self.stages.setdefault(stage, {"calls": 0, "prompt_tokens": 0, "output_tokens": 0,
+                                                    "total_tokens": 0})
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_used
+            totals["output_tokens"] += output_used
+            totals["total_tokens"] += total_used
+            self.run_tokens += total_used
+            run_tokens = self.run_tokens
+        budget = f"/{self.run_budget:,}" if self.run_budget is not None else ""
+        print(f"[tokens] {stage}: prompt {prompt_used:,} (counted {prompt_tokens:,}), output {output_used:,}, "
+              f"run total {run_tokens:,}{budget}")
+
+    def summary(self):
+        """Per-stage token usage table for the run."""
+        with self._lock:
+            stages = {stage: dict(totals) for stage, totals in self.stages.items()}
+            run_tokens = self.run_tokens
+        if not stages:
+            return "Token usage: no model calls"
+        lines = [f"Token usage ({run_tokens:,} total"
+                 + (f" of {self.run_budget:,} budget" if self.run_budget is not None else "") + "):"]
+        for stage, totals in sorted(stages.items()):
+            lines.append(f"  {stage:<20} {totals['calls']:>3} call(s)  prompt {totals['prompt_tokens']:>9,}"
+                         f"  output {totals['output_tokens']:>9,}  total {totals['total_tokens']:>9,}")
+        return "\n".join(lines)
@@ -0,0 +1,157 @@
+"""
+Span-based timing instrumentation for the generation pipeline.
+
+Wrap any unit of work in `with span(name, category, **attrs):` to record its
+wall-clock time, thread and attributes (prompt/response sizes, token usage,
+exit status, ...). At the end of a run, the spans can be written as a JSON
+summary aggregated per category and as a Chrome trace (chrome://tracing or
+https://ui.perfetto.dev) that shows how the LLM calls, Terraform commands and
+git steps overlap.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+TRACE_START = time.perf_counter()
+
+SPANS = []
+_SPANS_LOCK = threading.Lock()
+
+
+class Span:
+    """One timed unit of work. Attributes can be added while the span is open."""
+
+    def __init__(self, name, category, attrs):
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.start = time.perf_counter() - TRACE_START
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update({k: v for k, v in attrs.items() if v is not None})
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "category": self.category,
+            "start_seconds": round(self.start, 6),
+            "duration_seconds": round(self.duration or 0.0, 6),
+            "thread": self.thread_name,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+@contextlib.contextmanager
+def span(name, category="step", **attrs):
+    """Times the enclosed block and records it in SPANS, even when it raises."""
+    current = Span(name, category, {k: v for k, v in attrs.items() if v is not None})
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - TRACE_START - current.start
+        with _SPANS_LOCK:
+            SPANS.append(current)
+
+
+def clear_spans():
+    """Drops all recorded spans, e.g. between jobs of a long-running process."""
+    global TRACE_START
+    with _SPANS_LOCK:
+        SPANS.clear()
+        TRACE_START = time.perf_counter()
+
+
+def finished_spans():
+    with _SPANS_LOCK:
+        return sorted(SPANS, key=lambda s: s.start)
+
+
+def trace_summary():
+    """Per-category totals plus token usage, and every span in start order."""
+    spans = finished_spans()
+    categories = {}
+    for s in spans:
+        stats = categories.setdefault(s.category, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["count"] += 1
+        stats["total_seconds"] += s.duration
+        stats["max_seconds"] = max(stats["max_seconds"], s.duration)
+        for key in ("prompt_tokens", "output_tokens", "prompt_chars", "response_chars"):
+            if isinstance(s.attrs.get(key), int):
+                stats[key] = stats.get(key, 0) + s.attrs[key]
+    for stats in categories.values():
+        stats["total_seconds"] = round(stats["total_seconds"], 3)
+        stats["max_seconds"] = round(stats["max_seconds"], 3)
+    wall = max((s.start + s.duration for s in spans), default=0.0) - min((s.start for s in spans), default=0.0)
+    return {
+        "wall_seconds": round(wall, 3),
+        "categories": categories,
+        "spans": [s.to_dict() for s in spans],
+    }
+
+
+def chrome_trace():
+    """Spans as Chrome trace-event JSON, one lane per thread."""
+    pid = os.getpid()
+    events = []
+    threads = {}
+    for s in finished_spans():
+        threads.setdefault(s.thread_id, s.thread_name)
+        args = dict(s.attrs)
+        if s.error:
+            args["error"] = s.error
+        events.append({
+            "name": s.name,
+            "cat": s.category,
+            "ph": "X",
+            "ts": int(s.start * 1e6),
+            "dur": int(s.duration * 1e6),
+            "pid": pid,
+            "tid": s.thread_id,
+            "args": args,
+        })
+    for thread_id, thread_name in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id,
+                       "args": {"name": thread_name}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_trace(prefix):
+    """Writes <prefix>.summary.json and <prefix>.trace.json; returns both paths."""
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    summary_path = f"{prefix}.summary.json"
+    chrome_path = f"{prefix}.trace.json"
+    with open(summary_path, "w") as f:
+        json.dump(trace_summary(), f, indent=2, default=str)
+    with open(chrome_path, "w") as f:
+        json.dump(chrome_trace(), f, default=str)
+    return summary_path, chrome_path
+
+
+def format_report():
+    """Human-readable per-category and per-step timing table."""
+    summary = trace_summary()
+    if not summary["spans"]:
+        return "No spans were recorded."
+    lines = [f"Timing report (wall clock {summary['wall_seconds']:.1f}s):"]
+    for category, stats in sorted(summary["categories"].items(), key=lambda kv: -kv[1]["total_seconds"]):
+        tokens = ""
+        if "prompt_tokens" in stats or "output_tokens" in stats:
+            tokens = f", tokens in/out {stats.get('prompt_tokens', 0)}/{stats.get('output_tokens', 0)}"
+        lines.append(f"  {category:<10} {stats['count']:3d} span(s)  total {stats['total_seconds']:7.1f}s"
+                     f"  max {stats['max_seconds']:6.1f}s{tokens}")
+    for s in finished_spans():
+        if s.category == "step":
+            lines.append(f"  step {s.name:<16} +{s.start:6.1f}s  {s.duration:6.1f}s")
+    return "\n".join(lines)
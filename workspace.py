@@ -0,0 +1,111 @@
+"""
+Staged, in-memory workspace for generated files.
+
+Steps stage their files here instead of writing them straight to disk.
+commit() then writes a set of staged files in one go: every changed file is
+first written to a temp file next to it, and only once all of them are
+written are they moved into place with os.replace(). Files whose content hash
+already matches what is on disk are skipped. The generator commits each
+step's outputs when that step succeeds (and, with --stream, each file whose
+block has closed and passed its syntax check), so a step that fails halfway
+leaves its other files untouched, and reruns only rewrite (and only show git
+and Terraform) files that actually changed.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+from journal import file_sha256
+
+
+def content_sha256(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class Workspace:
+    """
+    Staged file contents keyed by path, layered over the files on disk.
+    Args:
+        root (str): Directory that relative paths are resolved against.
+    """
+
+    def __init__(self, root="."):
+        self.root = root
+        self.staged = {}
+        self._lock = threading.Lock()
+
+    def _full_path(self, path):
+        return os.path.join(self.root, path)
+
+    def stage(self, path, content):
+        with self._lock:
+            self.staged[path] = content
+
+    def read(self, path):
+        """Staged content if any, else the file on disk; None if neither exists."""
+        with self._lock:
+            if path in self.staged:
+                return self.staged[path]
+        try:
+            with open(self._full_path(path), "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def staged_paths(self):
+        with self._lock:
+            return sorted(self.staged)
+
+    def sha256(self, path):
+        """SHA-256 of the content the file will have after commit (staged or on disk)."""
+        with self._lock:
+            if path in self.staged:
+                return content_sha256(self.staged[path])
+        return file_sha256(self._full_path(path))
+
+    def commit(self, paths=None, contents=None):
+        """
+        Writes staged files (all, or just paths) whose content differs from disk.
+        With contents ({path: content}), a path is only committed while that content is still
+        the one staged for it. Returns (written, unchanged) lists of paths. Committed paths are unstaged.
+        """
+        with self._lock:
+            selected = sorted(self.staged if paths is None else [p for p in paths if p in self.staged])
+            if contents is not None:
+                selected = [p for p in selected if contents.get(p) == self.staged[p]]
+            pending = [(path, self.staged.pop(path)) for path in selected]
+        unchanged = []
+        temp_files = []  # (temp path, final path, relative path)
+        try:
+            # Write every changed file to a temp file first, so a failure leaves the tree untouched...
+            for path, content in pending:
+                full_path = self._full_path(path)
+                if file_sha256(full_path) == content_sha256(content):
+                    unchanged.append(path)
+                    continue
+                directory = os.path.dirname(full_path) or "."
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+                temp_files.append((tmp_path, full_path, path))
+                with os.fdopen(fd, "w") as f:
+                    f.write(content)
+                # mkstemp creates 0600 files; keep the existing mode, or use the usual 0644.
+                try:
+                    mode = os.stat(full_path).st_mode & 0o777
+                except FileNotFoundError:
+                    mode = 0o644
+                os.chmod(tmp_path, mode)
+        except BaseException:
+            for tmp_path, _, _ in temp_files:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+        # ...then move them all into place.
+        for tmp_path, full_path, _ in temp_files:
+            os.replace(tmp_path, full_path)
+        return [path for _, _, path in temp_files], unchanged
+
+    def discard(self):
+        with self._lock:
+            self.staged.clear()